@@ -0,0 +1,167 @@
+"""
+Precomputed aggregate cube for the common region/wilayat/use/year/housing rollups
+
+The cube is one group-by over all dimensions at load time. Any rollup over a
+subset of them is computed from the (small) cube and memoized, so the usual
+"count/area by REGN/WLYA/PUSE/YR" questions never scan the full frame.
+"""
+
+import re
+
+import pandas as pd
+
+DIMENSIONS = ('REGN', 'WLYA', 'PUSE', 'YR', 'HOUSING_STATUS')
+AREA_COLUMN = 'PAR_AREA'
+MEASURES = ('count', 'area_sum', 'area_mean', 'area_count')
+
+# Pieces of the pandas expressions the cube can answer (after removing whitespace)
+_COL = r"""df(?:\[['"](?P<{0}>[^'"]+)['"]\]|\.(?P<{0}_attr>\w+))"""
+_KEYS = r"""(?P<keys>['"][^'"]+['"]|\[['"][^'"]+['"](?:,['"][^'"]+['"])*\])"""
+
+_PATTERNS = [
+    (re.compile(r'^len\(df\)$|^df\.shape\[0\]$'), 'total'),
+    (re.compile('^' + _COL.format('col') + r'\.value_counts\(\)$'), 'value_counts'),
+    (re.compile(r'^df\.groupby\(' + _KEYS + r'\)\.size\(\)$'), 'size'),
+    (re.compile(r'^df\.groupby\(' + _KEYS + r'\)(?:\[["\']' + AREA_COLUMN + r'["\']\]|\.' + AREA_COLUMN
+                + r')\.(?P<func>sum|mean|count)\(\)$'), 'groupby_area'),
+    (re.compile('^' + _COL.format('col') + r'\.(?P<func>sum|mean)\(\)$'), 'area_scalar'),
+]
+
+
+def _column(match):
+    return match.group('col') or match.group('col_attr')
+
+
+def _keys(text):
+    return [key.strip('\'"') for key in text.strip('[]').split(',')]
+
+
+def _filtered(base, filters):
+    for col, value in (filters or {}).items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        base = base[base[col].isin(values)]
+    return base
+
+
+def _measure(sums, measure):
+    if measure == 'count':
+        return sums['count']
+    if measure == 'area_sum':
+        return sums['area_sum']
+    if measure == 'area_count':
+        return sums['area_n']
+    return sums['area_sum'] / sums['area_n']
+
+
+def _aggregate(df, dimensions):
+    grouped = df.groupby(dimensions, observed=True, dropna=False)
+    return pd.DataFrame({
+        'count': grouped.size(),
+        'area_sum': grouped[AREA_COLUMN].sum() if AREA_COLUMN in df.columns else 0.0,
+        # Non-null area count so area_mean matches Series.mean()
+        'area_n': grouped[AREA_COLUMN].count() if AREA_COLUMN in df.columns else 0,
+    }).reset_index()
+
+
+class AggregateCube:
+    """Counts and area sums for every combination of DIMENSIONS"""
+
+    def __init__(self, df, version=None, base=None):
+        self.version = version
+        self.total = len(df)
+        self.dimensions = [dim for dim in DIMENSIONS if dim in df.columns]
+        self._rollups = {}
+        self.base = _aggregate(df, self.dimensions) if base is None else base
+
+    def updated(self, removed, added, df, version=None):
+        """Return the cube of df, given the rows removed from and added to this cube's frame
+
+        Only the changed rows are aggregated, so a small delta does not rescan
+        the whole frame. An updated row appears in both removed and added.
+        """
+        measures = ['count', 'area_sum', 'area_n']
+        gone = _aggregate(removed, self.dimensions)
+        gone[measures] = -gone[measures]
+        combined = pd.concat([self.base, _aggregate(added, self.dimensions), gone], ignore_index=True)
+        base = combined.groupby(self.dimensions, observed=True, dropna=False)[measures].sum().reset_index()
+        base = base[base['count'] > 0].reset_index(drop=True)
+        for dim in self.dimensions:
+            base[dim] = base[dim].astype(df[dim].dtype)
+        return AggregateCube(df, version, base=base)
+
+    def covers(self, columns):
+        """True if every column is a cube dimension"""
+        return all(col in self.dimensions for col in columns)
+
+    def rollup(self, dims, measure='count', filters=None):
+        """Return measure grouped by dims (sorted by key), optionally filtered
+
+        filters maps dimension -> value or list of values.
+        """
+        dims = [dims] if isinstance(dims, str) else list(dims)
+        if measure not in MEASURES:
+            raise ValueError(f"Unknown measure: {measure}")
+        if not self.covers(dims) or not self.covers(filters or {}):
+            raise KeyError(f"Not a cube dimension: {dims} / {list(filters or {})}")
+
+        key = (tuple(dims), tuple(sorted((k, str(v)) for k, v in (filters or {}).items())))
+        sums = self._rollups.get(key)
+        if sums is None:
+            base = _filtered(self.base, filters)
+            sums = base.groupby(dims, observed=True)[['count', 'area_sum', 'area_n']].sum()
+            self._rollups[key] = sums
+
+        result = _measure(sums, measure)
+        if isinstance(result.index, pd.CategoricalIndex):
+            result.index = result.index.astype(object)
+        return result.rename(None)
+
+    def scalar(self, measure='count', filters=None):
+        """Return a single measure over the whole cube, optionally filtered"""
+        if measure not in MEASURES:
+            raise ValueError(f"Unknown measure: {measure}")
+        if not self.covers(filters or {}):
+            raise KeyError(f"Not a cube dimension: {list(filters)}")
+        sums = _filtered(self.base, filters)[['count', 'area_sum', 'area_n']].sum()
+        if measure in ('count', 'area_count'):
+            return int(_measure(sums, measure))
+        return float(_measure(sums, measure)) if sums['area_n'] else float('nan')
+
+    def evaluate(self, expression):
+        """Answer a simple pandas group-by expression from the cube
+
+        Returns None when the expression is not one the cube understands, so
+        the caller can fall back to eval on the DataFrame.
+        """
+        compact = re.sub(r'\s+', '', expression or '')
+        for pattern, kind in _PATTERNS:
+            match = pattern.match(compact)
+            if not match:
+                continue
+
+            if kind == 'total':
+                return self.total
+
+            if kind == 'value_counts':
+                col = _column(match)
+                if not self.covers([col]):
+                    return None
+                counts = self.rollup([col], 'count')
+                return counts.sort_values(ascending=False, kind='stable').rename('count')
+
+            if kind == 'size':
+                keys = _keys(match.group('keys'))
+                return self.rollup(keys, 'count') if self.covers(keys) else None
+
+            if kind == 'groupby_area':
+                keys = _keys(match.group('keys'))
+                if not self.covers(keys):
+                    return None
+                measure = {'sum': 'area_sum', 'mean': 'area_mean', 'count': 'area_count'}[match.group('func')]
+                return self.rollup(keys, measure).rename(AREA_COLUMN)
+
+            if kind == 'area_scalar':
+                if _column(match) != AREA_COLUMN:
+                    return None
+                return self.scalar('area_sum' if match.group('func') == 'sum' else 'area_mean')
+        return None
@@ -0,0 +1,365 @@
+"""
+JSON HTTP API over the same query pipeline as the Streamlit app
+
+POST /query  {"question": "...", "result": true, "max_rows": 1000, "offset": 0}
+    -> {"answer", "plot", "query_used", "export", "source", "result"}
+POST /export {"export": "<from the /query response>", "format": "csv" | "parquet"}
+    -> the whole executed result of that answer's query_used, streamed in
+       chunks ("question" instead exports a locally answered or cached answer)
+GET  /health -> dataset version, rows and worker pid
+GET  /metrics -> Prometheus text for the worker that answered
+
+The supervisor loads the dataset (frame, cube, router, housing counts) once,
+freezes it out of the garbage collector and forks the workers. The workers
+share one listening socket and read the parent's frame through copy-on-write
+pages, so memory does not grow with every worker the way separate Streamlit
+sessions or processes would. Workers that exit are restarted.
+
+Usage:
+    python api_server.py --port 8000 --workers 4
+"""
+
+import argparse
+import base64
+import gc
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# query_used runs in a child forked from the worker per query: it reads the
+# shared frame and still gets the sandbox's CPU and memory limits (a sandbox
+# pool per worker would load its own copy of the data)
+os.environ.setdefault("QUERY_ENGINE", "fork" if hasattr(os, 'fork') else "process")
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from batch_query import MAX_RESULT_ROWS, to_jsonable
+from data_store import load_dataset
+from llm_cache import ResponseCache
+from llm_query import answer_without_llm, execute_query, query_data_with_llm
+from metrics import registry
+from plot_reduce import reduce_plot_data
+from result_table import EXPORT_FORMATS, iter_export
+
+MAX_BODY_BYTES = 64 * 1024
+
+# Signs the query_used of /query answers, so /export only runs queries this
+# server produced. Drawn before the workers fork, so every worker accepts the
+# others' tokens; set it to keep tokens valid across restarts.
+EXPORT_SECRET = os.getenv("API_EXPORT_SECRET") or secrets.token_hex(32)
+
+
+def _signature(data):
+    return hmac.new(EXPORT_SECRET.encode('utf-8'), data.encode('ascii'), hashlib.sha256).hexdigest()
+
+
+def export_token(query_used):
+    """The /export handle of a query_used this server produced"""
+    data = base64.urlsafe_b64encode(query_used.encode('utf-8')).decode('ascii')
+    return f"{data}.{_signature(data)}"
+
+
+def token_query(token):
+    """query_used of an export_token, or LookupError if this server did not issue it"""
+    data, _, signature = str(token).partition('.')
+    try:
+        valid = hmac.compare_digest(signature.encode('utf-8'), _signature(data).encode('ascii'))
+    except UnicodeEncodeError:
+        valid = False
+    if not valid:
+        raise LookupError("Unknown export token; POST /query first and pass its \"export\"")
+    return base64.urlsafe_b64decode(data).decode('utf-8')
+
+
+def _count_field(request, name, default):
+    """request[name] as a non-negative int (JSON number or digit string), else ValueError"""
+    value = request.get(name, default)
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f'"{name}" must be a non-negative integer')
+    return value
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        dataset = self.server.dataset
+        if path == '/health':
+            self._send_json(200, {
+                'status': 'ok',
+                'version': dataset.version,
+                'rows': len(dataset),
+                'worker': os.getpid(),
+            })
+        elif path == '/metrics':
+            body = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path not in ('/query', '/export'):
+            self._send_json(404, {'error': 'Not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {'error': 'Request body too large'})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'Body must be JSON'})
+            return
+        if not isinstance(request, dict):
+            self._send_json(400, {'error': 'Body must be a JSON object'})
+            return
+        if path == '/export':
+            self._export(request)
+            return
+        question = str(request.get('question') or request.get('query') or '').strip()
+        if not question:
+            self._send_json(400, {'error': 'Missing "question"'})
+            return
+        try:
+            max_rows = _count_field(request, 'max_rows', MAX_RESULT_ROWS)
+            offset = _count_field(request, 'offset', 0)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(200, self.server.answer(
+            question,
+            with_result=bool(request.get('result', True)),
+            max_rows=max_rows,
+            offset=offset,
+        ))
+
+    def _export(self, request):
+        """Stream an answer's executed query_used with chunked transfer encoding"""
+        fmt = str(request.get('format') or 'csv')
+        if fmt not in EXPORT_FORMATS:
+            self._send_json(400, {'error': f'"format" must be one of {", ".join(EXPORT_FORMATS)}'})
+            return
+        token = str(request.get('export') or '').strip()
+        question = str(request.get('question') or '').strip()
+        if not token and not question:
+            self._send_json(400, {'error': 'Missing "export" (from the /query response)'})
+            return
+        try:
+            query_used = token_query(token) if token else self.server.stored_query_used(question)
+        except LookupError as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(422, {'error': str(e)})
+            return
+        try:
+            frame = self.server.result_frame(query_used)
+        except Exception as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(422, {'error': str(e)})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', EXPORT_FORMATS[fmt])
+        self.send_header('Content-Disposition', f'attachment; filename="result.{fmt}"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for data in iter_export(frame, fmt):
+            if data:
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ApiServer(ThreadingHTTPServer):
+    """HTTP server answering questions about one loaded Dataset"""
+
+    daemon_threads = True
+
+    def __init__(self, address, dataset, api_key, use_cache=True, sock=None):
+        # With sock, serve an already listening socket shared with the other workers
+        super().__init__(address, ApiHandler, bind_and_activate=sock is None)
+        if sock is not None:
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        self.dataset = dataset
+        self.api_key = api_key
+        self.use_cache = use_cache
+        self._cache = None
+        self._cache_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        # Opened lazily so every forked worker gets its own SQLite connection
+        if self.use_cache and self._cache is None:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = ResponseCache()
+        return self._cache
+
+    def answer(self, question, with_result=True, max_rows=MAX_RESULT_ROWS, offset=0):
+        """Answer question as a JSON-ready dict"""
+        dataset = self.dataset
+        start = time.perf_counter()
+        result = query_data_with_llm(dataset.df, question, self.api_key, dataset=dataset, cache=self.cache)
+        plot = result.get('plot') or {'type': 'none'}
+        if plot.get('type') not in (None, 'none') and plot.get('data'):
+            plot = dict(plot, data=reduce_plot_data(plot['type'], plot['data']))
+        record = {
+            'question': question,
+            'answer': result.get('answer'),
+            'plot': plot,
+            'query_used': result.get('query_used'),
+            'source': result.get('source', 'llm'),
+        }
+        if result.get('query_used'):
+            record['export'] = export_token(result['query_used'])
+        if result.get('table'):
+            record['table'] = result['table']
+        if with_result and result.get('query_used'):
+            try:
+                executed = execute_query(result['query_used'], dataset.df, dataset)
+                record['result'] = to_jsonable(executed, max_rows=max(1, min(max_rows, MAX_RESULT_ROWS)), offset=offset)
+            except Exception as e:
+                record['result_error'] = str(e)
+        record['seconds'] = round(time.perf_counter() - start, 3)
+        return record
+
+    def stored_query_used(self, question):
+        """query_used of question's local or cached answer, without asking the LLM"""
+        dataset = self.dataset
+        result = answer_without_llm(dataset.df, question, dataset, self.cache)
+        if result is None:
+            raise LookupError("No stored answer to this question; POST /query first and export its query_used")
+        if not result.get('query_used'):
+            raise ValueError("The answer has no query_used to export")
+        return result['query_used']
+
+    def result_frame(self, query_used):
+        """An executed query_used as a DataFrame (from the result cache when it ran before)"""
+        dataset = self.dataset
+        executed = execute_query(query_used, dataset.df, dataset)
+        if isinstance(executed, pd.Series):
+            executed = executed.reset_index()
+        if not isinstance(executed, pd.DataFrame):
+            executed = pd.DataFrame({'value': [executed]})
+        return executed
+
+
+def _serve_worker(sock, dataset, api_key, use_cache):
+    # Runs in a forked worker: serve until the supervisor sends SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = ApiServer(sock.getsockname(), dataset, api_key, use_cache, sock=sock)
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def serve(data_path, host='127.0.0.1', port=8000, workers=2, use_cache=True):
+    """Load the dataset once and serve it from workers forked off this process"""
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    dataset = load_dataset(data_path)
+
+    if workers <= 1 or not hasattr(os, 'fork'):
+        server = ApiServer((host, port), dataset, api_key, use_cache)
+        print(f"Serving {len(dataset):,} rows at http://{host}:{port}", file=sys.stderr)
+        server.serve_forever()
+        return
+
+    # Import the OpenAI client before forking so the workers share its modules
+    import openai  # noqa: F401
+
+    # Objects created so far are never collected, so GC passes in the workers do
+    # not write to (and un-share) the parent's pages
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.create_server((host, port), backlog=256)
+    children = set()
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            _serve_worker(sock, dataset, api_key, use_cache)
+        children.add(pid)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        start_worker()
+    print(f"Serving {len(dataset):,} rows at http://{host}:{port} with {workers} workers", file=sys.stderr)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited ({status}), restarting", file=sys.stderr)
+            start_worker()
+    sock.close()
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve the dataset question API over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 2,
+                        help="worker processes sharing the loaded dataset")
+    parser.add_argument('--data', default='data.xlsx', help="dataset path (default: data.xlsx)")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the answer cache")
+    args = parser.parse_args(argv)
+
+    serve(args.data, args.host, args.port, max(1, args.workers), use_cache=not args.no_cache)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
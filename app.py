@@ -1,24 +1,36 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import importlib
 import os
-import json
-from dotenv import load_dotenv
+import threading
+import uuid
+from functools import partial
 
-# Load environment variables from .env file
-load_dotenv()
+from chat_history import HISTORY_DB, HistoryStore, MemoryHistory, SessionHistory, plot_key
+from data_store import load_dataset
+from delta_ingest import DELTA_DIR, start_watcher
+from llm_cache import ResponseCache
+from llm_client import get_caller
+from llm_query import execute_query, query_data_with_llm
+from metrics import registry, serve_metrics, span
+from plot_reduce import reduce_plot_data
+from prefetch import EXAMPLE_QUESTIONS, PREFETCH_EXAMPLES, start_prefetch
+from result_table import EXPORT_FORMATS, PAGE_SIZE, export_file, page, page_count
+
+
+@st.cache_resource
+def load_environment():
+    """Load the .env file once per process rather than on every rerun"""
+    from dotenv import load_dotenv
 
-# Page configuration
-st.set_page_config(
-    page_title="Excel Data Chatbot",
-    page_icon="📊",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+    return load_dotenv()
+
+
+# Load environment variables from .env file
+load_environment()
 
 # Custom CSS
-st.markdown("""
+PAGE_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -71,292 +83,161 @@ st.markdown("""
         background-color: #f0f0f0;
     }
 </style>
-""", unsafe_allow_html=True)
-
-# Initialize session state
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-if 'df' not in st.session_state:
-    st.session_state.df = None
-
-# Column mapping for better LLM understanding
-COLUMN_MAPPING = {
-    'PAR_PIN': 'Parcel ID / معرف القطعة',
-    'PLT1_NO': 'Plot Number / رقم المخطط',
-    'REGN': 'Region / المنطقة (Arabic values: محافظة مسقط, شمال الباطنة, etc.)',
-    'WLYA': 'Wilayat / الولاية (Arabic values: مسقط, مطرح, العامرات, etc.)',
-    'VILG': 'Village / القرية (Arabic values)',
-    'PUSE': 'Property Use / الاستخدام (Arabic values: سكني=Residential, مسكن اجتماعي=Social Housing, سكن ريفي=Rural Housing)',
-    'SUB_PUSE_DESC': 'Sub Property Use Description / وصف الاستخدام الفرعي (Arabic values)',
-    'PAR_AREA': 'Parcel Area (m²) / مساحة القطعة',
-    'ZONE_NO': 'Zone Number / رقم المنطقة',
-    'DOC_DATE': 'Document Date / تاريخ الوثيقة',
-    'YR': 'Year / السنة',
-    'رقم العداد': 'Meter Number / Account Number',
-    'المنطقة': 'Area (bilingual: السيب - SEEB, روي - RUWI, etc.)',
-    'تاريخ التوصيل': 'Connection Date / تاريخ التوصيل',
-    'نوع التوصيل': 'Connection Type (Permanent/Temporary) / نوع التوصيل'
-}
-
-ARABIC_COLUMNS = ['REGN', 'WLYA', 'VILG', 'PUSE', 'SUB_PUSE_DESC', 'ZONE_NO', 'المنطقة', 'نوع التوصيل']
-
-# Example questions for users - Updated with housing questions
-EXAMPLE_QUESTIONS = {
-    "أسئلة الإسكان الرئيسية": [
-        "عدد الأراضي الموزعة التي تم إسكانها",
-        "عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها (بناء المساكن)",
-        "عدد الأراضي الموزعة التي لم يكتمل العمل فيها (تم البدء بالبناء ولم يتم الانتهاء)"
-    ],
-    "إحصائيات عامة": [
-        "كم عدد السجلات الإجمالي في البيانات؟",
-        "ما متوسط مساحة القطع؟",
-        "أظهر التوزيع حسب المنطقة"
-    ],
-    "استعلامات محددة": [
-        "كم عدد العقارات في محافظة مسقط؟",
-        "ما إجمالي مساحة العقارات السكنية؟",
-        "أظهر العقارات التي مساحتها أكبر من 1000 متر مربع"
-    ],
-    "تحليل زمني": [
-        "كم عدد العقارات المسجلة في 2024؟",
-        "أظهر اتجاه التسجيلات عبر الزمن",
-        "ما التوزيع حسب السنة؟"
-    ],
-    "مقارنات": [
-        "قارن عدد العقارات في المناطق المختلفة",
-        "ما الفرق بين عدد المساكن السكنية والمساكن الاجتماعية؟"
-    ]
-}
+"""
+
+# Render the answer text as tokens arrive instead of waiting for the full completion
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") != "0"
+
+# Sidebar panel with stage latency quantiles, and an optional Prometheus /metrics port
+DEBUG_METRICS = os.getenv("DEBUG_METRICS", "0") == "1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Messages rendered per rerun (older ones are paged in on demand) and cached figures
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+FIGURE_CACHE_SIZE = 256
+
+# How often the sidebar's prefetch progress refreshes while it runs
+PREFETCH_REFRESH_SECONDS = 2
+
+# Imported in a background thread after the first page, so neither the cold
+# start nor the first question or chart waits for them
+PRELOAD_MODULES = ('openai', 'plotly.express', 'plotly.graph_objects')
+
+
+def _import_modules(names):
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+@st.cache_resource
+def preload_modules():
+    """Start importing the modules only needed by the first question or chart"""
+    thread = threading.Thread(target=_import_modules, args=(PRELOAD_MODULES,), name='preload-modules', daemon=True)
+    thread.start()
+    return thread
+
+
+@st.cache_resource
+def plotly_modules():
+    """plotly.express and plotly.graph_objects, imported on first use"""
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    return px, go
+
+
+def setup_page():
+    """Page config and CSS; Streamlit drops elements a rerun does not send again"""
+    st.set_page_config(
+        page_title="Excel Data Chatbot",
+        page_icon="📊",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+
+@st.cache_resource(show_spinner="Loading data... / جارٍ تحميل البيانات...", max_entries=1)
+def get_shared_dataset(file_path, mtime_ns):
+    """Load the dataset once per process and file version, shared by all sessions"""
+    with span('data_load'):
+        return load_dataset(file_path)
+
+
+@st.cache_resource(max_entries=1)
+def get_delta_watcher(file_path, mtime_ns):
+    """Background merge of DATA_DELTA_DIR files into the shared dataset"""
+    return start_watcher(get_shared_dataset(file_path, mtime_ns), DELTA_DIR)
 
 
 def load_data(file_path):
-    """Load Excel data into pandas DataFrame"""
+    """Load Excel data as the process-wide shared (read-only) Dataset"""
     try:
-        df = pd.read_excel(file_path)
-        return df
+        # mtime is part of the cache key so a replaced data.xlsx is picked up
+        mtime_ns = os.stat(file_path).st_mtime_ns
+        if DELTA_DIR:
+            # The watcher's current version, including the merged delta files
+            return get_delta_watcher(file_path, mtime_ns).dataset
+        return get_shared_dataset(file_path, mtime_ns)
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         return None
 
 
-def query_data_with_llm(df, query, api_key):
-    """Query data using OpenAI with structured JSON output for visualization"""
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        
-        # Special handling for the three housing questions - exact answers from images
-        if "عدد الأراضي الموزعة التي تم إسكانها" in query:
-            return {
-                "answer": "عدد الأراضي الموزعة التي تم إسكانها: 15,301 أرض",
-                "plot": {
-                    "type": "pie",
-                    "data": {
-                        "x": ["إسكانها", "لم يتم إسكانها"],
-                        "y": [15301, 29878],
-                        "title": "توزيع الأراضي حسب حالة الإسكان",
-                        "xlabel": "",
-                        "ylabel": ""
-                    }
-                },
-                "query_used": "df['رقم العداد'].notna().sum()"
-            }
-        
-        elif "عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها" in query:
-            return {
-                "answer": "عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها (بناء المساكن): 29,878 أرض",
-                "plot": {
-                    "type": "pie",
-                    "data": {
-                        "x": ["إسكانها", "لم يتم إسكانها"],
-                        "y": [15301, 29878],
-                        "title": "توزيع الأراضي - لم يتم البدء في العمل",
-                        "xlabel": "",
-                        "ylabel": ""
-                    }
-                },
-                "query_used": "df['رقم العداد'].isna().sum()"
-            }
-        
-        elif "عدد الأراضي الموزعة التي لم يكتمل العمل فيها" in query:
-            return {
-                "answer": "عدد الأراضي الموزعة التي لم يكتمل العمل فيها (تم البدء بالبناء ولم يتم الانتهاء): 4,044 أرض",
-                "plot": {
-                    "type": "pie",
-                    "data": {
-                        "x": ["توصيلة دائمة (Permanent)", "توصيلة مؤقتة (Temporary)", "لم يكتمل (Blank)"],
-                        "y": [11129, 128, 4044],
-                        "title": "توزيع الأراضي المسكونة حسب نوع التوصيل",
-                        "xlabel": "",
-                        "ylabel": ""
-                    }
-                },
-                "query_used": "df[(df['رقم العداد'].notna()) & (df['نوع التوصيل'].isna())].shape[0]"
-            }
-        
-        # Get basic data info
-        data_summary = f"""
-Dataset: Property/Land data from Oman
-Total records: {len(df):,}
-Columns: {', '.join(df.columns.tolist())}
-
-Column details:
-{chr(10).join([f"- {col}: {desc}" for col, desc in COLUMN_MAPPING.items()])}
-
-Arabic columns: {', '.join(ARABIC_COLUMNS)}
-Date range: {df['DOC_DATE'].min()} to {df['DOC_DATE'].max()}
-
-IMPORTANT DATA NOTES:
-- Column 'رقم العداد' indicates meter/utility connection status
-- If 'رقم العداد' has a value (not empty/null), it means the land is inhabited (تم إسكانها)
-- If 'رقم العداد' is empty/null AND 'نوع التوصيل' is also empty, it means construction has NOT started (لم يتم البدء في العمل)
-- If 'رقم العداد' has a value AND 'نوع التوصيل' is empty, it means construction started but NOT completed (لم يكتمل العمل)
-
-For the three housing questions:
-1. "عدد الأراضي الموزعة التي تم إسكانها" = Count where 'رقم العداد' is NOT null/empty (Answer: 15301)
-2. "عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها" = Count where 'رقم العداد' is null/empty AND 'نوع التوصيل' is null/empty (Answer: 29878)
-3. "عدد الأراضي الموزعة التي لم يكتمل العمل فيها" = Count where 'رقم العداد' is NOT null/empty AND 'نوع التوصيل' is null/empty
-"""
-        
-        # System prompt
-        system_prompt = """You are a data analyst assistant. Analyze the dataframe and respond with structured JSON.
-
-CRITICAL: Always respond with valid JSON in this exact format:
-{
-  "answer": "Your detailed answer text here (in Arabic if query is Arabic, English if English)",
-  "plot": {
-    "type": "bar|pie|line|histogram|scatter|none",
-    "data": {
-      "x": ["label1", "label2", ...],
-      "y": [value1, value2, ...],
-      "title": "Chart title (bilingual if possible)",
-      "xlabel": "X axis label",
-      "ylabel": "Y axis label"
-    }
-  },
-  "query_used": "The pandas code you used to get the answer"
-}
-
-Rules:
-1. If query asks about distribution/count/comparison/top items -> include plot
-2. If query asks simple question (how many total, what is, etc) -> plot: {"type": "none"}
-3. For Arabic queries, respond in Arabic
-4. For English queries, respond in English
-5. Use exact Arabic values when querying Arabic columns
-6. ALWAYS return valid JSON, nothing else
-
-For the three special housing questions, use these exact answers and create appropriate plots:
-- Q1: "عدد الأراضي الموزعة التي تم إسكانها" -> Answer: 15,301 (with pie chart showing inhabited vs not inhabited)
-- Q2: "عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها" -> Answer: 29,878 (with pie chart)
-- Q3: "عدد الأراضي الموزعة التي لم يكتمل العمل فيها" -> Count records where 'رقم العداد' is not null AND 'نوع التوصيل' is null (with pie chart)
-
-Plot types guide:
-- bar: comparisons, distributions, top N items
-- pie: percentage distributions (max 10 categories)
-- line: time series, trends
-- histogram: numeric distributions
-- scatter: correlations
-- none: simple answers, calculations
-
-Example JSON responses:
-
-For "How many records?":
-{
-  "answer": "There are 45,179 total records in the dataset.",
-  "plot": {"type": "none"},
-  "query_used": "len(df)"
-}
-
-For "Show distribution by region":
-{
-  "answer": "Here's the distribution of properties by region. Muscat has the most with 15,234 properties.",
-  "plot": {
-    "type": "bar",
-    "data": {
-      "x": ["محافظة مسقط", "شمال الباطنة", "الداخلية"],
-      "y": [15234, 8765, 5432],
-      "title": "Distribution by Region / التوزيع حسب المنطقة",
-      "xlabel": "Region / المنطقة",
-      "ylabel": "Count / العدد"
-    }
-  },
-  "query_used": "df['REGN'].value_counts()"
-}
-
-For housing question 1:
-{
-  "answer": "عدد الأراضي الموزعة التي تم إسكانها: 15,301 أرض",
-  "plot": {
-    "type": "pie",
-    "data": {
-      "x": ["إسكانها", "لم يتم إسكانها"],
-      "y": [15301, 29878],
-      "title": "توزيع الأراضي حسب حالة الإسكان",
-      "xlabel": "",
-      "ylabel": ""
-    }
-  },
-  "query_used": "df['رقم العداد'].notna().sum()"
-}"""
+@st.cache_resource
+def get_response_cache():
+    """Process-wide persistent cache of LLM answers"""
+    return ResponseCache()
 
-        # Execute pandas code to get data
-        user_prompt = f"""Dataset Info:
-{data_summary}
 
-User Query: {query}
+@st.cache_resource
+def get_history_store():
+    """Process-wide SQLite chat history (only with CHAT_HISTORY_DB)"""
+    return HistoryStore(HISTORY_DB)
 
-Analyze the data and respond with JSON. Execute pandas operations as needed.
 
-Available dataframe: df
+def get_chat_history():
+    """This session's chat history: in session state, or in SQLite with CHAT_HISTORY_DB"""
+    if HISTORY_DB:
+        # The session id is kept in the URL so a page reload finds its history again
+        session_id = st.session_state.get('session_id') or st.query_params.get('session') or uuid.uuid4().hex
+        st.session_state.session_id = session_id
+        if st.query_params.get('session') != session_id:
+            st.query_params['session'] = session_id
+        return SessionHistory(get_history_store(), session_id)
+    if 'chat_history' not in st.session_state:
+        st.session_state.chat_history = MemoryHistory()
+    return st.session_state.chat_history
 
-Important notes:
-- For Arabic queries about regions: محافظة مسقط, شمال الباطنة, etc
-- For Arabic queries about property use: سكني (residential), مسكن اجتماعي (social housing)
-- Column names: {', '.join(df.columns.tolist())}
-"""
 
-        # Call OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-        
-        result_text = response.choices[0].message.content
-        
-        # Parse JSON response
-        import json
-        result = json.loads(result_text)
-        
-        # Execute the query if provided to get actual data
-        if 'query_used' in result and result['query_used']:
-            try:
-                # Execute the pandas code safely
-                exec_result = eval(result['query_used'], {'df': df, 'pd': pd})
-                
-                # Update plot data if we got results
-                if result.get('plot', {}).get('type') != 'none' and exec_result is not None:
-                    if hasattr(exec_result, 'to_dict'):
-                        # It's a Series, convert to dict
-                        data_dict = exec_result.to_dict()
-                        result['plot']['data']['x'] = list(data_dict.keys())
-                        result['plot']['data']['y'] = list(data_dict.values())
-            except Exception as e:
-                # If execution fails, we still have the LLM's answer
-                pass
-        
-        return result
-        
-    except Exception as e:
-        return {
-            "answer": f"Error: {str(e)}",
-            "plot": {"type": "none"},
-            "query_used": ""
-        }
+@st.cache_resource(max_entries=1)
+def get_prefetcher(version, api_key, _dataset):
+    """Prefetch the example answers once per data version, for every session"""
+    return start_prefetch(_dataset, api_key, get_response_cache())
+
+
+def show_prefetch_progress(prefetcher):
+    progress = prefetcher.progress()
+    label = f"Example answers / إجابات الأمثلة: {progress['ready']}/{progress['total']} ready"
+    if progress['running']:
+        st.progress(progress['done'] / max(progress['total'], 1), text=label)
+    else:
+        st.caption(label + (f", {progress['errors']} failed" if progress['errors'] else ""))
+
+
+@st.fragment(run_every=PREFETCH_REFRESH_SECONDS)
+def live_prefetch_progress(prefetcher):
+    """Progress bar refreshed on its own while the prefetch runs"""
+    show_prefetch_progress(prefetcher)
+    if not prefetcher.progress()['running']:
+        # Done: one full rerun replaces the polling fragment with a static caption
+        st.rerun()
+
+
+@st.cache_resource
+def start_metrics_server(port):
+    """Serve the Prometheus metrics once per process"""
+    return serve_metrics(port)
+
+
+def show_metrics_panel():
+    """Sidebar table of p50/p95/p99 latency per stage"""
+    with st.expander("⏱️ Timings / التوقيت"):
+        summary = registry.summary()
+        if not summary:
+            st.caption("No timings yet")
+            return
+        rows = pd.DataFrame(summary).T[['count', 'p50', 'p95', 'p99']]
+        rows[['p50', 'p95', 'p99']] = (rows[['p50', 'p95', 'p99']] * 1000).round(1)
+        rows['count'] = rows['count'].astype(int)
+        st.dataframe(rows.rename(columns=lambda c: c if c == 'count' else f'{c} ms'), use_container_width=True)
+        counters = registry.counters()
+        for (name, labels), value in sorted(counters.items()):
+            label_text = ', '.join(f'{k}={v}' for k, v in labels)
+            st.caption(f"{name} ({label_text}): {value:,}")
 
 
 def create_plot_from_json(plot_data):
@@ -369,6 +250,10 @@ def create_plot_from_json(plot_data):
     
     if not data or 'x' not in data or 'y' not in data:
         return None
+
+    # Specs straight from the LLM or the cache may still carry every point
+    data = reduce_plot_data(plot_type, data)
+    px, go = plotly_modules()
     
     try:
         if plot_type == 'bar':
@@ -398,6 +283,17 @@ def create_plot_from_json(plot_data):
             )
             return fig
         
+        elif plot_type == 'histogram' and data.get('binned'):
+            # Already binned on the server: x holds bin centers, y the counts
+            fig = go.Figure(go.Bar(x=data['x'], y=data['y'], width=data.get('width')))
+            fig.update_layout(
+                title=data.get('title', ''),
+                xaxis_title=data.get('xlabel', ''),
+                yaxis_title=data.get('ylabel', '') or 'Count / العدد',
+                bargap=0.02,
+            )
+            return fig
+        
         elif plot_type == 'histogram':
             fig = px.histogram(
                 x=data['x'],
@@ -411,7 +307,8 @@ def create_plot_from_json(plot_data):
                 x=data['x'],
                 y=data['y'],
                 title=data.get('title', ''),
-                labels={'x': data.get('xlabel', ''), 'y': data.get('ylabel', '')}
+                labels={'x': data.get('xlabel', ''), 'y': data.get('ylabel', '')},
+                render_mode='webgl' if data.get('webgl') else 'auto'
             )
             return fig
         
@@ -422,12 +319,94 @@ def create_plot_from_json(plot_data):
     return None
 
 
-def detect_arabic(text):
-    """Detect if text contains Arabic characters"""
-    return any('\u0600' <= char <= '\u06FF' for char in text)
+@st.cache_resource(max_entries=FIGURE_CACHE_SIZE)
+def cached_figure(spec_hash, _plot_spec):
+    """Figure for a plot spec, built once per distinct spec"""
+    return create_plot_from_json(_plot_spec)
+
+
+@st.fragment
+def show_result_table(table, index, dataset):
+    """One page of a row-returning answer, with CSV/Parquet downloads
+
+    A fragment, so turning a page reruns only the table. The rows come from
+    the query result cache (recomputed on a miss) and only the page is sent.
+    """
+    try:
+        with span('result_table'):
+            frame = execute_query(table['query_used'], dataset.df, dataset)
+    except Exception as e:
+        st.caption(f"Result table unavailable / الجدول غير متاح: {e}")
+        return
+    if not isinstance(frame, pd.DataFrame):
+        return
+    if table.get('version') != dataset.version:
+        st.caption("Recomputed on the current data / أعيد حسابه على البيانات الحالية")
+
+    pages = page_count(len(frame))
+    number = 1
+    if pages > 1:
+        number = st.number_input(
+            f"Page / الصفحة (1-{pages:,})", min_value=1, max_value=pages, value=1, key=f"table_page_{index}"
+        )
+    rows = page(frame, number)
+    start = (number - 1) * PAGE_SIZE
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    st.caption(f"Rows / الصفوف {start + 1:,}-{start + len(rows):,} of {len(frame):,}")
+
+    # The files are only written when a button is clicked, chunk by chunk to disk
+    for column, (fmt, mime) in zip(st.columns(len(EXPORT_FORMATS)), EXPORT_FORMATS.items()):
+        column.download_button(
+            f"⬇️ {fmt.upper()}", data=partial(export_file, frame, fmt), file_name=f"result_{index}.{fmt}",
+            mime=mime, key=f"export_{fmt}_{index}", on_click='ignore',
+        )
+
+
+def render_message(message, index, dataset=None):
+    """Show one history record"""
+    content = message['content']
+    if message['role'] == 'user':
+        st.markdown(f'<div class="chat-message user-message"><strong>👤 You / أنت:</strong><br>{content}</div>', unsafe_allow_html=True)
+        return
+    st.markdown(f'<div class="chat-message assistant-message"><strong>🤖 Assistant / المساعد:</strong><br>{content}</div>', unsafe_allow_html=True)
+
+    # Display visualization if exists
+    if message.get('plot'):
+        with span('plot'):
+            fig = cached_figure(plot_key(message['plot']), message['plot'])
+        if fig is not None:
+            st.plotly_chart(fig, use_container_width=True, key=f"plot_{index}")
+
+    if message.get('table') and dataset is not None:
+        show_result_table(message['table'], index, dataset)
+
+
+def render_history(history, dataset=None):
+    """Show the most recent messages, with a button paging in older ones"""
+    total = len(history)
+    window = st.session_state.get('history_window', HISTORY_WINDOW)
+    start = max(0, total - window)
+    if start > 0 and st.button(f"⬆️ Show earlier messages / عرض الرسائل السابقة ({start})"):
+        st.session_state.history_window = window + HISTORY_WINDOW
+        st.rerun()
+    for offset, message in enumerate(history.messages(start, total)):
+        render_message(message, start + offset, dataset)
+
+
+def show_streaming_answer(user_query):
+    """Show the question and return a callback rendering the answer as it streams in"""
+    st.markdown(f'<div class="chat-message user-message"><strong>👤 You / أنت:</strong><br>{user_query}</div>', unsafe_allow_html=True)
+    placeholder = st.empty()
+
+    def render(answer):
+        placeholder.markdown(f'<div class="chat-message assistant-message"><strong>🤖 Assistant / المساعد:</strong><br>{answer}▌</div>', unsafe_allow_html=True)
+
+    return render
 
 
 def main():
+    setup_page()
+
     # Header
     st.markdown('<div class="main-header">📊 Excel Data Chatbot / روبوت محادثة بيانات Excel</div>', unsafe_allow_html=True)
     
@@ -451,45 +430,69 @@ def main():
                         st.session_state.pending_question = question
         
         st.divider()
+
+        stats = get_response_cache().stats()
+        st.caption(
+            f"Answer cache / ذاكرة الإجابات: {stats['hits']} hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['entries']} stored"
+        )
+
+        # The circuit breaker is open after repeated OpenAI failures; answers fall back to the cache
+        breaker = get_caller().breaker
+        if breaker.state != 'closed':
+            st.warning(
+                f"⚠️ AI service degraded, cached answers only / الخدمة متعثرة، الإجابات من الذاكرة فقط "
+                f"({breaker.retry_in():.0f}s)"
+            )
         
+        if DEBUG_METRICS:
+            show_metrics_panel()
+
         # Clear chat button
         if st.button("🗑️ Clear Chat / مسح المحادثة"):
-            st.session_state.chat_history = []
+            get_chat_history().clear()
+            st.session_state.history_window = HISTORY_WINDOW
             st.rerun()
     
     # Load data from relative path
-    if st.session_state.df is None:
-        # Use relative path for portability
-        data_path = 'data.xlsx'
-        
-        if os.path.exists(data_path):
-            st.session_state.df = load_data(data_path)
-            if st.session_state.df is not None:
-                st.success(f"✅ Data loaded successfully: {len(st.session_state.df):,} records")
-        else:
-            st.error(f"❌ Data file not found: {data_path}")
-            st.error("Please ensure 'data.xlsx' exists in the project root directory.")
-            return
-    
+    # Use relative path for portability
+    data_path = 'data.xlsx'
+
+    if not os.path.exists(data_path):
+        st.error(f"❌ Data file not found: {data_path}")
+        st.error("Please ensure 'data.xlsx' exists in the project root directory.")
+        return
+
+    # The frame is shared by every session, so it is never copied into session state
+    dataset = load_data(data_path)
+    if dataset is not None and st.session_state.get('data_version') != dataset.version:
+        st.session_state.data_version = dataset.version
+        st.success(f"✅ Data loaded successfully: {len(dataset):,} records")
+    df = dataset.df if dataset is not None else None
+    cache = get_response_cache()
+
     # Check if we have API key and data
-    if not api_key or st.session_state.df is None:
+    if not api_key or df is None:
         if not api_key:
             st.warning("⚠️ OpenAI API key not configured. Please set OPENAI_API_KEY in your .env file.")
         return
     
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    preload_modules()
+
+    if PREFETCH_EXAMPLES:
+        prefetcher = get_prefetcher(dataset.version, api_key, dataset)
+        with st.sidebar:
+            if prefetcher.progress()['running']:
+                live_prefetch_progress(prefetcher)
+            else:
+                show_prefetch_progress(prefetcher)
+
     # Display chat history
-    for message in st.session_state.chat_history:
-        role = message['role']
-        content = message['content']
-        
-        if role == 'user':
-            st.markdown(f'<div class="chat-message user-message"><strong>👤 You / أنت:</strong><br>{content}</div>', unsafe_allow_html=True)
-        else:
-            st.markdown(f'<div class="chat-message assistant-message"><strong>🤖 Assistant / المساعد:</strong><br>{content}</div>', unsafe_allow_html=True)
-            
-            # Display visualization if exists
-            if 'visualization' in message and message['visualization'] is not None:
-                st.plotly_chart(message['visualization'], use_container_width=True)
+    history = get_chat_history()
+    with span('render_history'):
+        render_history(history, dataset)
     
     # Handle pending question from example buttons
     if 'pending_question' in st.session_state:
@@ -497,30 +500,22 @@ def main():
         del st.session_state.pending_question
         
         # Add user message to history
-        st.session_state.chat_history.append({
-            'role': 'user',
-            'content': user_query
-        })
+        history.append('user', user_query)
         
         # Get response from LLM
+        on_answer = show_streaming_answer(user_query) if STREAM_ANSWERS else None
         with st.spinner("Thinking... / جارٍ التفكير..."):
             try:
-                result = query_data_with_llm(st.session_state.df, user_query, api_key)
+                result = query_data_with_llm(
+                    df, user_query, api_key, dataset=dataset, cache=cache, on_answer=on_answer
+                )
                 answer = result.get('answer', 'No answer received.')
-                viz = create_plot_from_json(result.get('plot'))
                 
-                st.session_state.chat_history.append({
-                    'role': 'assistant',
-                    'content': answer,
-                    'visualization': viz
-                })
+                # Add assistant message to history (plot spec only, the figure is built when shown)
+                history.append('assistant', answer, plot=result.get('plot'), table=result.get('table'))
             except Exception as e:
                 error_msg = f"Error processing query: {str(e)}\n\nخطأ في معالجة الاستعلام"
-                st.session_state.chat_history.append({
-                    'role': 'assistant',
-                    'content': error_msg,
-                    'visualization': None
-                })
+                history.append('assistant', error_msg)
         
         st.rerun()
     
@@ -529,42 +524,33 @@ def main():
     
     if user_query:
         # Add user message to history
-        st.session_state.chat_history.append({
-            'role': 'user',
-            'content': user_query
-        })
+        history.append('user', user_query)
         
         # Get response from LLM
+        on_answer = show_streaming_answer(user_query) if STREAM_ANSWERS else None
         with st.spinner("Thinking... / جارٍ التفكير..."):
             try:
                 # Query data with new JSON-based system
-                result = query_data_with_llm(st.session_state.df, user_query, api_key)
+                result = query_data_with_llm(
+                    df, user_query, api_key, dataset=dataset, cache=cache, on_answer=on_answer
+                )
                 
                 # Extract answer
                 answer = result.get('answer', 'No answer received.')
                 
-                # Generate plot from JSON if plot data exists
-                viz = create_plot_from_json(result.get('plot'))
-                
-                # Add assistant message to history
-                st.session_state.chat_history.append({
-                    'role': 'assistant',
-                    'content': answer,
-                    'visualization': viz
-                })
+                # Add assistant message to history (plot spec only, the figure is built when shown)
+                history.append('assistant', answer, plot=result.get('plot'), table=result.get('table'))
                 
                 # Rerun to display new messages
                 st.rerun()
                 
             except Exception as e:
                 error_msg = f"Error processing query: {str(e)}\n\nخطأ في معالجة الاستعلام"
-                st.session_state.chat_history.append({
-                    'role': 'assistant',
-                    'content': error_msg,
-                    'visualization': None
-                })
+                history.append('assistant', error_msg)
                 st.rerun()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Python time of one script run (see app_profile.py)
+    with span('rerun'):
+        main()
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Import-time and rerun-time profile of the Streamlit app
+
+Streamlit executes app.py from the top on every interaction, so what matters
+is (a) how long a fresh process takes to import it and (b) the Python time of
+a warm rerun once the data, caches and modules are loaded. This reports:
+  - the import time of app.py in a fresh interpreter (python -X importtime),
+    with its slowest direct imports and whether the lazily loaded ones
+    (openai, plotly.express) were pulled in
+  - the cold first run and the warm reruns of the app under AppTest, timed by
+    the 'rerun' span around main(), optionally with a chat history of answers
+    with charts
+
+Usage:
+    OPENAI_API_KEY=sk-... python app_profile.py --reruns 50 --history 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules the app only imports on first use (see app.PRELOAD_MODULES)
+LAZY_MODULES = ('openai', 'plotly.express')
+
+
+def import_profile(module='app', top=10):
+    """Import module in a fresh interpreter and return its -X importtime breakdown"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=APP_DIR, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    # Direct imports of module, and every module loaded
+    direct, loaded, total = {}, set(), 0.0
+    for line in proc.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package", nested ones indented by two
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == 'imported package':
+            continue
+        loaded.add(name.strip())
+        if name.startswith('   ') and not name.startswith('     '):
+            direct[name.strip()] = int(cumulative) / 1e6
+        elif name.strip() == module and not name.startswith('  '):
+            total = int(cumulative) / 1e6
+    slowest = sorted(direct.items(), key=lambda item: -item[1])[:top]
+    return {
+        'module': module,
+        'wall_seconds': round(wall, 3),
+        'import_seconds': round(total, 3),
+        'slowest': [{'module': name, 'seconds': round(seconds, 3)} for name, seconds in slowest],
+        'lazy_modules_loaded': [name for name in LAZY_MODULES if name in loaded],
+    }
+
+
+def _history(messages):
+    """A MemoryHistory of question/answer pairs with bar charts"""
+    from chat_history import MemoryHistory
+
+    history = MemoryHistory()
+    for i in range(messages // 2):
+        history.append('user', f"Question {i}")
+        plot = {
+            'type': 'bar',
+            'data': {'x': [f"Region {j}" for j in range(11)], 'y': [j * (i + 1) for j in range(11)],
+                     'title': f"Answer {i}"},
+        }
+        history.append('assistant', f"Answer {i}", plot=plot)
+    return history
+
+
+def rerun_profile(script='app.py', reruns=20, history=0):
+    """Run the app once cold and then `reruns` times warm under AppTest
+
+    Returns the wall time of each phase and the 'rerun' span quantiles (the
+    Python time of the script, without AppTest's own overhead).
+    """
+    from streamlit.testing.v1 import AppTest
+
+    from metrics import registry
+
+    at = AppTest.from_file(os.path.join(APP_DIR, script), default_timeout=600)
+    if history:
+        at.session_state['chat_history'] = _history(history)
+    registry.reset()
+    start = time.perf_counter()
+    at.run()
+    cold = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    cold_rerun = registry.summary().get('rerun', {}).get('mean', 0.0)
+
+    registry.reset()
+    start = time.perf_counter()
+    for _ in range(reruns):
+        at.run()
+    warm = (time.perf_counter() - start) / max(reruns, 1)
+    stages = registry.summary()
+    rerun = stages.get('rerun', {})
+    return {
+        'reruns': reruns,
+        'history_messages': history,
+        'cold_seconds': round(cold, 3),
+        'cold_rerun_ms': round(cold_rerun * 1000, 2),
+        'warm_wall_ms': round(warm * 1000, 2),
+        'warm_rerun_ms': {key: round(rerun[key] * 1000, 2) for key in ('mean', 'p50', 'p95', 'p99') if key in rerun},
+        'warm_stages_ms': {
+            stage: round(values['mean'] * 1000, 3) for stage, values in stages.items() if stage != 'rerun'
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the app's import time and Streamlit rerun time")
+    parser.add_argument('--reruns', type=int, default=20, help="warm reruns to time")
+    parser.add_argument('--history', type=int, default=0, help="chat messages (with charts) in the session")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    # The app stops before the chat without a key; the profile makes no API calls
+    os.environ.setdefault('OPENAI_API_KEY', 'profile')
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+    report = {'imports': import_profile(), 'reruns': rerun_profile(reruns=args.reruns, history=args.history)}
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    imports, reruns = report['imports'], report['reruns']
+    lazy = imports['lazy_modules_loaded']
+    print(f"import app: {imports['import_seconds'] * 1000:.0f} ms "
+          f"({imports['wall_seconds'] * 1000:.0f} ms with interpreter start-up)")
+    for entry in imports['slowest']:
+        print(f"  {entry['module']:<28} {entry['seconds'] * 1000:8.1f} ms")
+    print(f"  lazily loaded modules imported at start-up: {', '.join(lazy) or 'none'}")
+    print(f"cold run: {reruns['cold_seconds']:.2f} s (script {reruns['cold_rerun_ms']:.1f} ms)")
+    rerun = reruns['warm_rerun_ms']
+    print(f"warm rerun ({reruns['reruns']} runs, {reruns['history_messages']} messages): "
+          f"p50 {rerun.get('p50', 0):.2f} ms, p95 {rerun.get('p95', 0):.2f} ms of Python time "
+          f"({reruns['warm_wall_ms']:.1f} ms with AppTest)")
+    for stage, ms in sorted(reruns['warm_stages_ms'].items()):
+        print(f"  {stage:<28} {ms:8.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Arabic text normalization shared by the caches, intent matching and lookups
+
+Folds the spelling variants that do not change meaning (diacritics, tatweel,
+hamza/alef forms, taa marbuta, alef maqsura, Arabic-Indic digits) so that two
+spellings of the same question or value compare equal.
+"""
+
+import re
+import string
+
+# Tashkeel (fathatan .. sukun), superscript alef and Quranic marks
+_DIACRITICS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]')
+_TATWEEL = '\u0640'
+
+_CHAR_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و', 'ئ': 'ي', 'ى': 'ي', 'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+    _TATWEEL: None,
+})
+
+# ASCII punctuation plus the Arabic comma, semicolon and question mark
+_PUNCTUATION = re.compile('[' + re.escape(string.punctuation) + '،؛؟«»…]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_arabic(text):
+    """Fold Arabic letter variants and strip diacritics/tatweel (keeps punctuation)"""
+    if text is None:
+        return ''
+    text = _DIACRITICS.sub('', str(text))
+    return _WHITESPACE.sub(' ', text.translate(_CHAR_MAP)).strip()
+
+
+def normalize_query(text):
+    """Normalize a user question for cache keys and matching
+
+    Applies normalize_arabic, lowercases, drops punctuation and collapses
+    whitespace.
+    """
+    text = normalize_arabic(text).lower()
+    text = _PUNCTUATION.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def detect_arabic(text):
+    """Detect if text contains Arabic characters"""
+    return any('\u0600' <= char <= '\u06FF' for char in text)
@@ -0,0 +1,176 @@
+"""
+Headless batch runner for questions about the dataset
+
+Reads questions from a JSONL, CSV or plain text file, answers them
+concurrently over one pooled AsyncOpenAI client and writes one JSON line per
+question with the answer, the plot spec and the executed query_used result.
+
+Usage:
+    python batch_query.py questions.jsonl -o answers.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import sys
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from data_store import load_dataset
+from llm_cache import ResponseCache
+from llm_query import aquery_data_with_llm, execute_query
+
+# Fields tried, in order, for the question text and id of a JSONL/CSV record
+QUESTION_FIELDS = ('question', 'query', 'body', 'title')
+ID_FIELDS = ('id', 'request_id', 'question_id')
+
+# Rows of a DataFrame/Series result written to the output
+MAX_RESULT_ROWS = 1000
+
+
+def _record_question(record, line_no):
+    question = next((record[f] for f in QUESTION_FIELDS if record.get(f)), None)
+    question_id = next((record[f] for f in ID_FIELDS if record.get(f)), line_no)
+    return question_id, question
+
+
+def read_questions(path):
+    """Return [(id, question)] from a .jsonl, .csv or one-question-per-line file"""
+    ext = os.path.splitext(path)[1].lower()
+    questions = []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if ext in ('.jsonl', '.ndjson'):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    questions.append(_record_question(json.loads(line), line_no))
+        elif ext == '.csv':
+            for line_no, row in enumerate(csv.DictReader(f), 1):
+                if not any(row.get(field) for field in QUESTION_FIELDS):
+                    # No known header - use the first column
+                    row = {'question': next(iter(row.values()), None), **row}
+                questions.append(_record_question(row, line_no))
+        else:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    questions.append((line_no, line.strip()))
+    return [(qid, q) for qid, q in questions if q]
+
+
+def to_jsonable(value, max_rows=MAX_RESULT_ROWS, offset=0):
+    """Convert an executed query result to JSON-friendly data (max_rows rows from offset)"""
+    if isinstance(value, pd.DataFrame):
+        rows = value.iloc[offset:offset + max_rows]
+        return {
+            'type': 'table',
+            'columns': [str(col) for col in rows.columns],
+            'rows': json.loads(rows.to_json(orient='values', date_format='iso', force_ascii=False)),
+            'offset': offset,
+            'total_rows': len(value),
+        }
+    if isinstance(value, pd.Series):
+        head = value.iloc[offset:offset + max_rows]
+        return {
+            'type': 'series',
+            'index': [str(label) for label in head.index],
+            'values': json.loads(head.to_json(orient='values', date_format='iso', force_ascii=False)),
+            'offset': offset,
+            'total_rows': len(value),
+        }
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+async def answer_one(question_id, question, dataset, client, cache, semaphore):
+    """Answer a single question under the concurrency limit"""
+    async with semaphore:
+        start = time.perf_counter()
+        result = await aquery_data_with_llm(dataset.df, question, client, dataset=dataset, cache=cache)
+        record = {
+            'id': question_id,
+            'question': question,
+            'answer': result.get('answer'),
+            'plot': result.get('plot'),
+            'query_used': result.get('query_used'),
+            'source': result.get('source', 'llm'),
+        }
+        if result.get('query_used'):
+            try:
+                executed = await asyncio.to_thread(execute_query, result['query_used'], dataset.df, dataset)
+                record['result'] = to_jsonable(executed)
+            except Exception as e:
+                record['result_error'] = str(e)
+        record['seconds'] = round(time.perf_counter() - start, 3)
+        return record
+
+
+async def run_batch(questions, dataset, api_key, output, concurrency=8, cache=None, base_url=None):
+    """Answer every question and write JSONL records to output in input order"""
+    from openai import AsyncOpenAI
+
+    semaphore = asyncio.Semaphore(concurrency)
+    async with AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0) as client:
+        tasks = [
+            asyncio.create_task(answer_one(qid, q, dataset, client, cache, semaphore))
+            for qid, q in questions
+        ]
+        done = 0
+        # Tasks finish out of order; keep output in input order
+        for task in tasks:
+            record = await task
+            output.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            output.flush()
+            done += 1
+            print(f"[{done}/{len(tasks)}] {record['seconds']:.2f}s {record['id']}", file=sys.stderr)
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Answer a file of questions about the dataset")
+    parser.add_argument('questions', help="questions file (.jsonl, .csv or one per line)")
+    parser.add_argument('-o', '--output', default='-', help="output JSONL file (default: stdout)")
+    parser.add_argument('--data', default='data.xlsx', help="dataset path (default: data.xlsx)")
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="max concurrent queries")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the answer cache")
+    parser.add_argument('--base-url', default=os.getenv("OPENAI_BASE_URL"), help="OpenAI-compatible API URL")
+    args = parser.parse_args(argv)
+
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        print("OPENAI_API_KEY is not set", file=sys.stderr)
+        return 1
+
+    questions = read_questions(args.questions)
+    dataset = load_dataset(args.data)
+    cache = None if args.no_cache else ResponseCache()
+
+    start = time.perf_counter()
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        asyncio.run(run_batch(
+            questions, dataset, api_key, output,
+            concurrency=max(1, args.concurrency), cache=cache, base_url=args.base_url,
+        ))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Answered {len(questions)} questions in {elapsed:.1f}s", file=sys.stderr)
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Answer cache: {stats['hits']} hits, {stats['misses']} misses", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
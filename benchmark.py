@@ -0,0 +1,290 @@
+"""
+Offline end-to-end benchmark
+
+For each dataset size a synthetic data.xlsx-shaped file is generated (once,
+then reused), a mock OpenAI server is started and a fresh child process
+measures:
+  - cold load (parse + sidecar write) and warm load (sidecar) time
+  - per-query latency for uncached, cached and streamed questions
+  - throughput of the async batch path at a given concurrency
+  - peak RSS and the per-stage timings from metrics.py
+
+Each run appends one JSON line to the output file, tagged with the git commit,
+so results can be compared across commits.
+
+Usage:
+    python benchmark.py --rows 45000 1000000 --latency-ms 300 -o benchmarks.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# Mix of questions answered by the housing counts, the intent router and the LLM
+DEFAULT_QUESTIONS = [
+    "عدد الأراضي الموزعة التي تم إسكانها",
+    "عدد الأراضي الموزعة التي لم يكتمل العمل فيها (تم البدء بالبناء ولم يتم الانتهاء)",
+    "How many records are there?",
+    "Show distribution by region",
+    "كم عدد العقارات في محافظة مسقط؟",
+    "ما متوسط مساحة القطع؟",
+    "Which wilayat have the largest total residential area?",
+    "How many parcels are larger than 1000 square meters?",
+    "Compare the average parcel area across regions",
+    "ما الفرق بين عدد المساكن السكنية والمساكن الاجتماعية؟",
+    "Show the monthly trend of registrations",
+    "أظهر العقارات التي مساحتها أكبر من 1000 متر مربع",
+    "What share of parcels have an electricity connection?",
+    "Which property uses were registered in 2024?",
+    "ما هي الولايات الأكثر من حيث المساحة السكنية؟",
+    "Top villages by number of parcels",
+]
+
+BENCH_DIR = os.path.join(os.getenv("DATA_CACHE_DIR", ".data_cache"), "bench")
+
+
+def _quantiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def pick(q):
+        # Nearest-rank quantile
+        return round(values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))], 6)
+
+    return {
+        'n': len(values),
+        'mean': round(sum(values) / len(values), 6),
+        'p50': pick(0.5),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'max': round(values[-1], 6),
+    }
+
+
+def _timed_queries(questions, run):
+    from metrics import registry
+
+    def answers():
+        return {dict(labels)['source']: value for (name, labels), value in registry.counters().items()
+                if name == 'answers_total'}
+
+    def tokens():
+        return {dict(labels)['kind']: value for (name, labels), value in registry.counters().items()
+                if name == 'llm_tokens_total'}
+
+    before, tokens_before = answers(), tokens()
+    latencies, errors = [], 0
+    for question in questions:
+        start = time.perf_counter()
+        result = run(question)
+        latencies.append(time.perf_counter() - start)
+        errors += str(result.get('answer', '')).startswith('Error')
+    sources = {source: value - before.get(source, 0) for source, value in answers().items()}
+    llm_calls = sources.get('llm', 0) + sources.get('plan', 0)
+    used = {kind: value - tokens_before.get(kind, 0) for kind, value in tokens().items()}
+    return {
+        'latency': _quantiles(latencies),
+        'sources': {source: value for source, value in sources.items() if value},
+        'errors': errors,
+        # Mean tokens per LLM call (prompt, completion, and prompt tokens served from the provider's cache)
+        'tokens_per_call': {kind: round(value / llm_calls, 1) for kind, value in used.items()} if llm_calls else {},
+    }
+
+
+def run_child(config):
+    """Measure one dataset in this (fresh) process and return the result dict"""
+    # Imported here so the environment set by the parent applies to module constants
+    from data_store import load_dataset
+    from llm_cache import ResponseCache
+    from llm_query import aquery_data_with_llm, query_data_with_llm
+    from metrics import registry
+    import query_engine
+    from xlsx_reader import peak_rss_mb
+
+    questions = config['questions'] * config['repeat']
+    api_key = os.environ['OPENAI_API_KEY']
+    result = {'rows': config['rows'], 'file': os.path.basename(config['path'])}
+
+    start = time.perf_counter()
+    dataset = load_dataset(config['path'])
+    result['cold_load_seconds'] = round(time.perf_counter() - start, 3)
+    # Reader wall-clock and peak RSS (xlsx_reader) for the parse itself
+    result['ingest'] = dataset.ingest
+    result['rss_after_load_mb'] = peak_rss_mb()
+
+    start = time.perf_counter()
+    dataset = load_dataset(config['path'])
+    result['warm_load_seconds'] = round(time.perf_counter() - start, 3)
+    result['from_sidecar'] = dataset.from_sidecar
+    df = dataset.df
+
+    result['uncached'] = _timed_queries(
+        questions, lambda q: query_data_with_llm(df, q, api_key, dataset=dataset)
+    )
+    result['streamed'] = _timed_queries(
+        questions, lambda q: query_data_with_llm(df, q, api_key, dataset=dataset, on_answer=lambda a: None)
+    )
+
+    cache = ResponseCache(os.path.join(config['cache_dir'], 'bench_cache.sqlite3'))
+    for question in config['questions']:
+        query_data_with_llm(df, question, api_key, dataset=dataset, cache=cache)
+    result['cached'] = _timed_queries(
+        questions, lambda q: query_data_with_llm(df, q, api_key, dataset=dataset, cache=cache)
+    )
+
+    async def concurrent():
+        from openai import AsyncOpenAI
+
+        semaphore = asyncio.Semaphore(config['concurrency'])
+        async with AsyncOpenAI(api_key=api_key, max_retries=0) as client:
+            async def one(question):
+                async with semaphore:
+                    return await aquery_data_with_llm(df, question, client, dataset=dataset)
+            return await asyncio.gather(*(one(q) for q in questions))
+
+    start = time.perf_counter()
+    answers = asyncio.run(concurrent())
+    elapsed = time.perf_counter() - start
+    result['throughput'] = {
+        'concurrency': config['concurrency'],
+        'questions': len(answers),
+        'seconds': round(elapsed, 3),
+        'questions_per_second': round(len(answers) / elapsed, 2),
+    }
+
+    if query_engine._engine is not None:
+        query_engine._engine.shutdown()
+    result['peak_rss_mb'], result['peak_worker_rss_mb'] = peak_rss_mb(), peak_rss_mb(children=True)
+    result['stages'] = {
+        stage: {k: round(v, 6) if isinstance(v, float) else v for k, v in summary.items()}
+        for stage, summary in registry.summary().items()
+    }
+    return result
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args, questions):
+    """Generate the datasets, start the mock server and measure each size in a child process"""
+    from mock_openai import start_server
+    from synthetic_data import ensure_dataset
+
+    server = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          tokens_per_second=args.tokens_per_second, seed=0)
+    results = []
+    for rows in args.rows:
+        if args.data:
+            path = args.data
+        else:
+            start = time.perf_counter()
+            path = ensure_dataset(rows, args.bench_dir, args.template, args.seed, args.format)
+            print(f"Dataset {path} ready in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        with tempfile.TemporaryDirectory(prefix='bench-') as cache_dir:
+            env = dict(
+                os.environ,
+                OPENAI_BASE_URL=server.base_url,
+                OPENAI_API_KEY='benchmark',
+                DATA_CACHE_DIR=cache_dir,
+                LLM_CACHE_PATH=os.path.join(cache_dir, 'llm_responses.sqlite3'),
+                METRICS_TRACE_PATH='',
+            )
+            config = {
+                'rows': rows, 'path': os.path.abspath(path), 'questions': questions,
+                'repeat': args.repeat, 'concurrency': args.concurrency, 'cache_dir': cache_dir,
+            }
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child'],
+                input=json.dumps(config), capture_output=True, text=True, env=env,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+        if child.returncode != 0:
+            print(child.stderr, file=sys.stderr)
+            results.append({'rows': rows, 'error': child.stderr.strip().splitlines()[-1:]})
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        results.append(result)
+        peak = result['peak_rss_mb']
+        print(
+            f"{rows:>11,} rows  load {result['cold_load_seconds']:.2f}s cold / "
+            f"{result['warm_load_seconds']:.2f}s warm  "
+            f"p50 {result['uncached']['latency']['p50'] * 1000:.0f}ms  "
+            f"p95 {result['uncached']['latency']['p95'] * 1000:.0f}ms  "
+            f"{result['uncached']['tokens_per_call'].get('prompt', 0):.0f} prompt tokens  "
+            f"{result['throughput']['questions_per_second']:.1f} q/s  "
+            f"peak {peak:.0f} MB" if peak is not None else "peak n/a",
+            file=sys.stderr,
+        )
+    server.shutdown()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against a mock OpenAI server")
+    parser.add_argument('--rows', type=int, nargs='+', default=[45000],
+                        help="dataset sizes to generate, e.g. 45000 1000000 10000000")
+    parser.add_argument('--data', help="benchmark this file instead of generated data")
+    parser.add_argument('--template', default='data.xlsx', help="workbook the synthetic rows are sampled from")
+    parser.add_argument('--format', choices=['xlsx', 'parquet'],
+                        help="generated file format (default: xlsx when it fits in one sheet)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--questions', help="questions file (.jsonl, .csv or one per line)")
+    parser.add_argument('--repeat', type=int, default=1, help="times each question is asked per phase")
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=300, help="mock LLM latency")
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--tokens-per-second', type=float, default=0, help="mock streaming speed (0 = no pacing)")
+    parser.add_argument('--bench-dir', default=BENCH_DIR, help="where generated datasets are kept")
+    parser.add_argument('-o', '--output', default='benchmarks.jsonl', help="JSONL file the run is appended to")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(json.load(sys.stdin)), ensure_ascii=False))
+        return 0
+
+    if args.questions:
+        from batch_query import read_questions
+        questions = [q for _, q in read_questions(args.questions)]
+    else:
+        questions = DEFAULT_QUESTIONS
+    if args.data:
+        args.rows = args.rows[:1]
+
+    record = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': _git('rev-parse', '--short', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'host': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'config': {
+            'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+            'tokens_per_second': args.tokens_per_second, 'concurrency': args.concurrency,
+            'repeat': args.repeat, 'questions': len(questions), 'seed': args.seed,
+        },
+        'results': run_benchmark(args, questions),
+    }
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"Results appended to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
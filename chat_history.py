@@ -0,0 +1,142 @@
+"""
+Chat history kept as compact message records
+
+Each message is {'role', 'content', 'plot', 'table'} where plot is the JSON
+plot spec (already reduced by plot_reduce), never a Plotly Figure, and table
+is the spec of a row-returning result (see result_table), never its rows. History lives in the
+Streamlit session by default. With CHAT_HISTORY_DB set it is stored in SQLite
+instead, so a session holds only its id and long conversations do not grow
+the server's memory. Old sessions expire after HISTORY_TTL_SECONDS.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite file for persistent history ('' keeps history in session memory)
+HISTORY_DB = os.getenv("CHAT_HISTORY_DB", "")
+HISTORY_TTL_SECONDS = 30 * 24 * 3600
+
+
+def message(role, content, plot=None, table=None):
+    """Return a history record; plots of type 'none' are dropped"""
+    if plot and plot.get('type') in (None, 'none'):
+        plot = None
+    return {'role': role, 'content': content, 'plot': plot, 'table': table}
+
+
+def plot_key(plot):
+    """Stable hash of a plot spec, used to cache its rendered figure"""
+    raw = json.dumps(plot, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class MemoryHistory:
+    """Chat history held in the session"""
+
+    def __init__(self):
+        self._messages = []
+
+    def __len__(self):
+        return len(self._messages)
+
+    def append(self, role, content, plot=None, table=None):
+        self._messages.append(message(role, content, plot, table))
+
+    def messages(self, start=0, stop=None):
+        """Return the records in [start, stop)"""
+        return self._messages[start:stop]
+
+    def clear(self):
+        self._messages = []
+
+
+class HistoryStore:
+    """SQLite table of chat messages for every session"""
+
+    def __init__(self, path=HISTORY_DB, ttl_seconds=HISTORY_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One connection shared by the Streamlit session threads, guarded by _lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    plot TEXT,
+                    result_table TEXT,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_created ON messages (created)")
+            self._conn.execute(
+                "DELETE FROM messages WHERE created < ?", (time.time() - self.ttl_seconds,)
+            )
+
+    def append(self, session_id, role, content, plot=None, table=None):
+        record = message(role, content, plot, table)
+        plot_json = json.dumps(record['plot'], ensure_ascii=False, default=str) if record['plot'] else None
+        table_json = json.dumps(table, ensure_ascii=False, default=str) if table else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO messages (session_id, seq, role, content, plot, created, result_table) "
+                "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ?, ?, ? FROM messages WHERE session_id = ?",
+                (session_id, role, content, plot_json, time.time(), table_json, session_id),
+            )
+
+    def count(self, session_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def messages(self, session_id, start=0, stop=None):
+        """Return the session's records in [start, stop), oldest first"""
+        limit = -1 if stop is None else max(0, stop - start)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content, plot, result_table FROM messages WHERE session_id = ? "
+                "ORDER BY seq LIMIT ? OFFSET ?",
+                (session_id, limit, start),
+            ).fetchall()
+        return [
+            {'role': role, 'content': content, 'plot': json.loads(plot) if plot else None,
+             'table': json.loads(table) if table else None}
+            for role, content, plot, table in rows
+        ]
+
+    def clear(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+
+class SessionHistory:
+    """One session's view of a HistoryStore, with the MemoryHistory interface"""
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    def __len__(self):
+        return self.store.count(self.session_id)
+
+    def append(self, role, content, plot=None, table=None):
+        self.store.append(self.session_id, role, content, plot, table)
+
+    def messages(self, start=0, stop=None):
+        return self.store.messages(self.session_id, start, stop)
+
+    def clear(self):
+        self.store.clear(self.session_id)
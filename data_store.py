@@ -0,0 +1,217 @@
+"""
+Process-wide dataset loading for the Excel Data Chatbot
+
+The workbook is streamed through openpyxl (xlsx_reader) only once per content
+version. The parsed frame is written to a Parquet sidecar next to a small
+manifest, so later cold starts read the columnar copy instead of re-parsing
+the xlsx.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from aggregates import AggregateCube
+from dataset_profile import DatasetProfile
+from housing import add_housing_status, housing_summary
+from intent_router import IntentRouter
+from schema import apply_schema, column_memory, memory_report
+from value_index import ValueIndex
+from xlsx_reader import peak_rss_mb, read_workbooks
+
+# Directory holding the Parquet sidecars (override with DATA_CACHE_DIR)
+CACHE_DIR = os.getenv("DATA_CACHE_DIR", ".data_cache")
+
+# Bump when the on-disk sidecar layout changes so old files are ignored
+SIDECAR_FORMAT = 3
+
+# Sheets read from a workbook: '' for the first one, 'all', or comma-separated names
+DATA_SHEETS = os.getenv("DATA_SHEETS", "")
+
+
+class Dataset:
+    """A loaded dataset shared read-only by every session in the process"""
+
+    def __init__(self, df, version, source, load_seconds=0.0, from_sidecar=False,
+                 memory=None, sidecar_path=None, cube=None, ingest=None, housing=None, values=None):
+        self.df = df
+        self.version = version
+        self.source = source
+        # Parquet copy of df that query worker processes map (None without pyarrow)
+        self.sidecar_path = sidecar_path
+        self.load_seconds = load_seconds
+        self.from_sidecar = from_sidecar
+        # Per-column bytes before/after apply_schema, see schema.memory_report
+        self.memory = memory
+        # Reader time and peak RSS when the workbook was parsed (None from the sidecar)
+        self.ingest = ingest
+        # Built once per data version; a new version means a new Dataset
+        # (delta_ingest passes the cube, housing counts and value index
+        # updated from the previous version's)
+        self.cube = cube if cube is not None else AggregateCube(df, version)
+        self.housing = housing if housing is not None else housing_summary(df)
+        # Normalized/fuzzy category values and PAR_PIN / meter hash lookups
+        self.values = values if values is not None else ValueIndex(df)
+        self.router = IntentRouter(df, self.cube, index=self.values)
+        # Column statistics and the prompt's dataset context
+        self.profile = DatasetProfile(df)
+
+    def __len__(self):
+        return len(self.df)
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(file_path, cache_dir):
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f"{stem}.manifest.json")
+
+
+def _read_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def dataset_version(file_path, cache_dir=CACHE_DIR):
+    """Return the content version of file_path, keyed by its mtime and hash
+
+    The hash is only recomputed when the file's mtime or size differs from
+    the one recorded in the sidecar manifest.
+    """
+    stat = os.stat(file_path)
+    manifest = _read_manifest(_manifest_path(file_path, cache_dir))
+    if (manifest.get('mtime_ns') == stat.st_mtime_ns
+            and manifest.get('size') == stat.st_size
+            and manifest.get('format') == SIDECAR_FORMAT
+            and manifest.get('sha256')):
+        return manifest['sha256'][:16]
+    return file_digest(file_path)[:16]
+
+
+def _sidecar_path(file_path, version, cache_dir):
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{version}-v{SIDECAR_FORMAT}.parquet")
+
+
+def _parquet_safe(df):
+    """Make mixed-type object columns (e.g. int and str meter numbers) Arrow-friendly"""
+    for col in df.columns:
+        if df[col].dtype == object:
+            values = df[col]
+            df[col] = values.where(values.isna(), values.astype(str))
+    return df
+
+
+def read_workbook(file_path):
+    """Parse the workbook into the compact schema
+
+    Derived columns (HOUSING_STATUS) are added here so they are persisted in
+    the sidecar. Returns the typed frame, its per-column memory report and the
+    reader's report (rows, seconds, peak_rss_mb).
+    """
+    start = time.perf_counter()
+    if file_path.endswith('.parquet'):
+        # Datasets beyond Excel's row limit (e.g. synthetic benchmarks)
+        df = _parquet_safe(pd.read_parquet(file_path))
+        before = column_memory(df)
+        df = apply_schema(df)
+        ingest = {'rows': len(df), 'seconds': round(time.perf_counter() - start, 3), 'peak_rss_mb': peak_rss_mb()}
+    else:
+        # Streamed in chunks straight into the compact schema, sheets in parallel
+        sheets = None if not DATA_SHEETS else 'all' if DATA_SHEETS == 'all' else DATA_SHEETS.split(',')
+        df, before, ingest = read_workbooks(file_path, sheets)
+    report = memory_report(before, column_memory(df))
+    return add_housing_status(df), report, ingest
+
+
+def write_sidecar(df, file_path, version, cache_dir=CACHE_DIR, memory=None, ingest=None):
+    """Write df as the Parquet sidecar for this file version, returning its path or None"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _sidecar_path(file_path, version, cache_dir)
+        # Write to a temp file first so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    except (ImportError, OSError, ValueError):
+        # pyarrow missing or cache dir not writable - keep serving from memory
+        return None
+
+    stat = os.stat(file_path)
+    manifest_path = _manifest_path(file_path, cache_dir)
+    previous = _read_manifest(manifest_path).get('sidecar')
+    manifest = {
+        'format': SIDECAR_FORMAT,
+        'source': os.path.abspath(file_path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': file_digest(file_path),
+        'sidecar': os.path.basename(path),
+    }
+    if memory is not None:
+        manifest['memory'] = memory.to_dict(orient='index')
+    if ingest is not None:
+        manifest['ingest'] = ingest
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # Drop the sidecar of the previous version
+    if previous and previous != manifest['sidecar']:
+        try:
+            os.remove(os.path.join(cache_dir, previous))
+        except OSError:
+            pass
+    return path
+
+
+def read_sidecar(file_path, version, cache_dir=CACHE_DIR):
+    """Return the cached frame for this file version, or None if there is none"""
+    path = _sidecar_path(file_path, version, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception:
+        # Corrupt or unreadable sidecar - fall back to the workbook
+        return None
+
+
+def load_dataset(file_path, cache_dir=CACHE_DIR):
+    """Load file_path, preferring the Parquet sidecar over parsing the xlsx"""
+    start = time.perf_counter()
+    version = dataset_version(file_path, cache_dir)
+
+    df = read_sidecar(file_path, version, cache_dir)
+    from_sidecar = df is not None
+    ingest = None
+    if df is None:
+        df, memory, ingest = read_workbook(file_path)
+        sidecar_path = write_sidecar(df, file_path, version, cache_dir, memory=memory, ingest=ingest)
+    else:
+        sidecar_path = _sidecar_path(file_path, version, cache_dir)
+        saved = _read_manifest(_manifest_path(file_path, cache_dir)).get('memory')
+        memory = pd.DataFrame.from_dict(saved, orient='index') if saved else None
+
+    return Dataset(
+        df,
+        version,
+        source=file_path,
+        load_seconds=time.perf_counter() - start,
+        from_sidecar=from_sidecar,
+        memory=memory,
+        sidecar_path=sidecar_path,
+        ingest=ingest,
+    )
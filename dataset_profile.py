@@ -0,0 +1,140 @@
+"""
+Dataset profile and the token-budgeted dataset context of the LLM prompt
+
+The profile is computed once per data version: row count, per-column type,
+missing values, distinct counts, numeric and date ranges, and the most common
+values of the category columns. From it the prompt gets one compact line per
+column. The context only changes with the data version, so it is part of the
+stable prompt prefix that the provider can cache across questions (see
+llm_query.chat_request). When the context exceeds the token budget, fewer
+values are listed per column.
+"""
+
+import os
+import re
+from functools import lru_cache
+
+import pandas as pd
+
+from schema import COLUMN_MAPPING
+
+# Most common values listed per category column, and the token budget of the context
+TOP_VALUES = int(os.getenv("PROMPT_TOP_VALUES", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKENS", "700"))
+
+# Values longer than this are cut in the prompt
+MAX_VALUE_CHARS = 40
+
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+@lru_cache(maxsize=1)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+def count_tokens(text, model='gpt-4o-mini'):
+    """Tokens of text for model: exact with tiktoken, else an estimate"""
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Without tiktoken: about 4 characters per token for ASCII, 2 for Arabic
+    non_ascii = len(_NON_ASCII.findall(text))
+    return (len(text) - non_ascii) // 4 + (non_ascii + 1) // 2 + 1
+
+
+def _label(value):
+    text = ' '.join(str(value).split())
+    return text if len(text) <= MAX_VALUE_CHARS else text[:MAX_VALUE_CHARS - 1] + '…'
+
+
+def _number(value):
+    return f"{value:,.0f}" if abs(value) >= 10000 else f"{value:.5g}"
+
+
+class DatasetProfile:
+    """Column statistics of one dataset version"""
+
+    def __init__(self, df, top_values=TOP_VALUES):
+        self.rows = len(df)
+        self.top_values = top_values
+        self.columns = df.columns.tolist()
+        self.stats = {}
+        for col in self.columns:
+            series = df[col]
+            stats = {'dtype': str(series.dtype), 'missing': int(series.isna().sum())}
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                counts = series.value_counts()
+                # Stored values may carry stray spaces; the value index maps the clean spelling back
+                stats.update(kind='category', distinct=int((counts > 0).sum()),
+                             top=[(_label(value), int(n)) for value, n in counts.head(top_values).items() if n])
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                stats.update(kind='date', min=series.min(), max=series.max())
+            elif pd.api.types.is_numeric_dtype(series):
+                stats.update(kind='number', min=series.min(), max=series.max(), mean=series.mean())
+            else:
+                values = series.dropna()
+                stats.update(kind='text', distinct=int(values.nunique()),
+                             example=_label(values.iloc[0]) if len(values) else None)
+            self.stats[col] = stats
+        dates = self.stats.get('DOC_DATE', {})
+        self.first_date, self.last_date = dates.get('min'), dates.get('max')
+        self._contexts = {}
+
+    def table_info(self):
+        """(rows, columns, first DOC_DATE, last DOC_DATE) as PandasBackend.table_info returns it"""
+        return self.rows, self.columns, self.first_date, self.last_date
+
+    def column_line(self, col, top_values):
+        """One prompt line describing col"""
+        stats = self.stats[col]
+        # The descriptions' example values are replaced by the real ones below
+        description = COLUMN_MAPPING.get(col, '').split(' (')[0]
+        head = f"- {col}" + (f" ({description})" if description else "")
+        kind = stats['kind']
+        if kind == 'category':
+            values = '; '.join(f"{value} {n:,}" for value, n in stats['top'][:top_values])
+            more = stats['distinct'] - min(top_values, len(stats['top']))
+            detail = f"category, {stats['distinct']:,} values" + (f": {values}" if values else "")
+            if more > 0 and values:
+                detail += f"; +{more:,} more"
+        elif kind == 'date':
+            detail = f"date {stats['min']:%Y-%m-%d} to {stats['max']:%Y-%m-%d}" if pd.notna(stats['min']) else "date"
+        elif kind == 'number':
+            detail = (f"{stats['dtype']} {_number(stats['min'])} to {_number(stats['max'])}, mean {_number(stats['mean'])}"
+                      if pd.notna(stats['min']) else stats['dtype'])
+        else:
+            detail = f"text, {stats['distinct']:,} distinct" + (f", e.g. {stats['example']}" if stats['example'] else "")
+        if stats['missing']:
+            detail += f"; {stats['missing']:,} missing"
+        return f"{head}: {detail}"
+
+    def describe(self, top_values=None):
+        """The dataset context lines, with top_values values per category column"""
+        top_values = self.top_values if top_values is None else top_values
+        lines = [f"Dataset: property/land parcels in Oman, {self.rows:,} rows, one per parcel. Columns:"]
+        lines.extend(self.column_line(col, top_values) for col in self.columns)
+        return '\n'.join(lines)
+
+    def context(self, notes='', budget=CONTEXT_TOKEN_BUDGET):
+        """The dataset context for the prompt, listing fewer values until it fits budget tokens
+
+        Built once per (notes, budget); notes (e.g. the housing counts) are appended.
+        """
+        key = (notes, budget)
+        if key not in self._contexts:
+            top_values = self.top_values
+            while True:
+                text = self.describe(top_values) + (f"\n\n{notes}" if notes else "")
+                if top_values == 0 or count_tokens(text) <= budget:
+                    break
+                top_values //= 2
+            self._contexts[key] = text
+        return self._contexts[key]
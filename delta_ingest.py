@@ -0,0 +1,319 @@
+"""
+Incremental ingest of new and changed rows from a drop directory
+
+Daily extracts (new meter numbers, connection dates and types, new parcels)
+are dropped into DATA_DELTA_DIR as .xlsx, .csv or .parquet files. Rows are
+matched on PAR_PIN: known parcels are updated with the non-empty values of the
+delta and unknown ones are appended. Each merge produces a new Dataset
+version without re-parsing the base workbook: HOUSING_STATUS is recomputed for
+the touched rows only, and the aggregate cube, the housing counts and the value
+index are adjusted by the changed rows instead of being rebuilt. The intent
+router and the column profile are rebuilt (about 70 ms per 100k rows). Cached
+answers are keyed by the data version, so answers for the old version are no
+longer served.
+
+Usage:
+    python delta_ingest.py --data data.xlsx --dir deltas
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_store import CACHE_DIR, Dataset, _parquet_safe, _sidecar_path, file_digest, load_dataset
+from housing import METER_COLUMN, STATUS_COLUMN, housing_status, housing_summary_updated
+from metrics import count, span
+from schema import DATE_COLUMNS, apply_schema
+
+# Drop directory watched for delta files ('' disables delta ingest)
+DELTA_DIR = os.getenv("DATA_DELTA_DIR", "")
+POLL_SECONDS = float(os.getenv("DATA_DELTA_POLL_SECONDS", "30"))
+
+KEY_COLUMN = 'PAR_PIN'
+# Identifiers stored as text, however the delta file typed them
+TEXT_COLUMNS = (KEY_COLUMN, METER_COLUMN)
+DELTA_EXTENSIONS = ('.xlsx', '.csv', '.parquet')
+
+# Files modified more recently than this may still be being written
+SETTLE_SECONDS = 2
+
+
+def delta_files(directory):
+    """Return {path: (mtime_ns, size)} for the delta files in directory"""
+    files = {}
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return files
+    for entry in entries:
+        # Skip hidden files and Excel lock files (~$data.xlsx)
+        if entry.name.startswith(('.', '~$')) or not entry.name.lower().endswith(DELTA_EXTENSIONS):
+            continue
+        if entry.is_file():
+            stat = entry.stat()
+            files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def read_delta(path):
+    """Read a delta file into the compact schema; it must have a PAR_PIN column"""
+    lower = path.lower()
+    if lower.endswith('.parquet'):
+        delta = pd.read_parquet(path)
+    elif lower.endswith('.csv'):
+        delta = pd.read_csv(path, dtype={col: str for col in TEXT_COLUMNS}, encoding='utf-8-sig')
+    else:
+        delta = pd.read_excel(path, dtype={col: str for col in TEXT_COLUMNS})
+    if KEY_COLUMN not in delta.columns:
+        raise ValueError(f"{os.path.basename(path)} has no {KEY_COLUMN} column")
+    for col in TEXT_COLUMNS:
+        # e.g. meter numbers written as integers (or floats, with gaps) in a Parquet delta
+        if col in delta.columns and pd.api.types.is_numeric_dtype(delta[col]):
+            values = delta[col]
+            if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+                values = values.astype('Int64')
+            delta[col] = values.astype(object).where(values.isna(), values.astype(str))
+    for col in DATE_COLUMNS:
+        # Hand-made extracts mix '2026-10-01' and '2026-10-01 08:30:00'
+        if col in delta.columns and delta[col].dtype == object:
+            delta[col] = pd.to_datetime(delta[col], errors='coerce', format='mixed')
+    delta = apply_schema(_parquet_safe(delta))
+    # A pin repeated in the same file: the last row wins
+    return delta.dropna(subset=[KEY_COLUMN]).drop_duplicates(KEY_COLUMN, keep='last')
+
+
+def _as_dtype(values, dtype):
+    # Delta values in the dataset's dtype; categorical labels and text stay plain strings,
+    # so an object column never mixes int and str (which Arrow cannot write)
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == object:
+        values = values.astype(object)
+        return values.where(values.isna(), values.astype(str))
+    try:
+        return values.astype(dtype)
+    except (TypeError, ValueError):
+        return values
+
+
+def _positions(keys, wanted):
+    """Row position of each wanted key in keys, -1 where it is missing"""
+    index = pd.Index(keys)
+    if index.is_unique:
+        return index.get_indexer(wanted)
+    # Repeated pins in the base data: update the last row of each
+    last = pd.Series(np.arange(len(index)), index=index).groupby(level=0).last()
+    return last.reindex(wanted).fillna(-1).to_numpy(dtype=np.int64)
+
+
+def merge_delta(df, delta):
+    """Upsert delta rows into a copy of df by PAR_PIN
+
+    Non-empty delta values overwrite the stored ones; columns the delta does
+    not have are kept. Returns (merged, updated, touched): the positions of
+    the updated rows in df, and of every updated or appended row in merged.
+    """
+    columns = [col for col in delta.columns if col in df.columns and col != STATUS_COLUMN]
+    delta = delta[columns].copy()
+    merged = df.copy()
+    for col in columns:
+        delta[col] = _as_dtype(delta[col], merged[col].dtype)
+        if isinstance(merged[col].dtype, pd.CategoricalDtype):
+            labels = pd.Index(delta[col].dropna().unique())
+            new = labels.difference(merged[col].cat.categories)
+            if len(new):
+                merged[col] = merged[col].cat.add_categories(new)
+
+    found = _positions(df[KEY_COLUMN], delta[KEY_COLUMN])
+    hit = found >= 0
+    updated = found[hit]
+    changes = delta[hit]
+    for col in columns:
+        if col == KEY_COLUMN:
+            continue
+        values = changes[col]
+        present = values.notna().to_numpy()
+        if present.any():
+            merged.iloc[updated[present], merged.columns.get_loc(col)] = values[present].to_numpy()
+
+    added = delta[~hit]
+    if len(added):
+        rows = pd.DataFrame(index=range(len(added)))
+        for col in merged.columns:
+            values = added[col].to_numpy() if col in added.columns else [None] * len(added)
+            if isinstance(merged[col].dtype, pd.CategoricalDtype):
+                rows[col] = pd.Categorical(values, dtype=merged[col].dtype)
+            else:
+                rows[col] = _as_dtype(pd.Series(values, dtype=object), merged[col].dtype)
+        if 'YR' in merged.columns and 'YR' not in added.columns and 'DOC_DATE' in rows.columns:
+            rows['YR'] = pd.to_datetime(rows['DOC_DATE'], errors='coerce').dt.year
+        merged = apply_schema(pd.concat([merged, rows], ignore_index=True))
+
+    touched = np.concatenate([updated, np.arange(len(df), len(merged))])
+    if STATUS_COLUMN in merged.columns and len(touched):
+        status = housing_status(merged.iloc[touched])
+        merged.iloc[touched, merged.columns.get_loc(STATUS_COLUMN)] = status.to_numpy()
+    return merged, updated, touched
+
+
+def write_delta_sidecar(df, source, version, cache_dir=CACHE_DIR):
+    """Write the merged frame for the query workers, returning its path or None"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _sidecar_path(source, version, cache_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        return path
+    except (ImportError, OSError, ValueError, *_arrow_errors()):
+        return None
+
+
+def _arrow_errors():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return ()
+    return (pa.ArrowException,)
+
+
+def apply_delta(dataset, path, cache_dir=CACHE_DIR):
+    """Merge one delta file into dataset and return the new Dataset version"""
+    start = time.perf_counter()
+    with span('delta_merge'):
+        delta = read_delta(path)
+        merged, updated, touched = merge_delta(dataset.df, delta)
+        # The version chains the previous one with the delta's content, so the
+        # same files applied in the same order give the same version
+        version = hashlib.sha256(f"{dataset.version}:{file_digest(path)}".encode()).hexdigest()[:16]
+        old_rows, new_rows = dataset.df.iloc[updated], merged.iloc[touched]
+        cube = dataset.cube.updated(old_rows, new_rows, merged, version)
+        housing = housing_summary_updated(dataset.housing, old_rows, new_rows)
+        values = dataset.values.updated(merged, touched)
+        sidecar_path = write_delta_sidecar(merged, dataset.source, version, cache_dir)
+    count('delta_rows_total', len(updated), kind='updated')
+    count('delta_rows_total', len(touched) - len(updated), kind='added')
+    return Dataset(
+        merged,
+        version,
+        source=dataset.source,
+        load_seconds=time.perf_counter() - start,
+        memory=dataset.memory,
+        sidecar_path=sidecar_path,
+        cube=cube,
+        housing=housing,
+        values=values,
+    )
+
+
+class DeltaWatcher:
+    """Polls a drop directory and swaps in a merged Dataset when delta files appear
+
+    Sessions read .dataset on every rerun, so they pick up a new version
+    without a restart.
+    """
+
+    def __init__(self, dataset, directory=DELTA_DIR, poll_seconds=POLL_SECONDS, cache_dir=CACHE_DIR):
+        self.dataset = dataset
+        self.directory = directory
+        self.poll_seconds = poll_seconds
+        self.cache_dir = cache_dir
+        # path -> (mtime_ns, size) of the files merged so far
+        self.applied = {}
+        # path -> ((mtime_ns, size), error) of files that failed to merge
+        self.errors = {}
+        # Sidecar written for the current delta version
+        self._sidecar = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def pending(self):
+        """Return the new or changed delta files, oldest first"""
+        now = time.time_ns()
+        files = [
+            (signature, path) for path, signature in delta_files(self.directory).items()
+            if self.applied.get(path) != signature
+            and self.errors.get(path, (None,))[0] != signature
+            and now - signature[0] > SETTLE_SECONDS * 1e9
+        ]
+        return [path for _, path in sorted(files)]
+
+    def refresh(self):
+        """Merge the pending delta files and return how many were applied"""
+        with self._lock:
+            applied = 0
+            for path in self.pending():
+                signature = delta_files(self.directory).get(path)
+                previous = self.dataset
+                try:
+                    self.dataset = apply_delta(previous, path, self.cache_dir)
+                except Exception as e:
+                    count('errors_total', stage='delta_ingest')
+                    self.errors[path] = (signature, str(e))
+                    print(f"Delta {path} not applied: {e}", file=sys.stderr)
+                    continue
+                self.applied[path] = signature
+                self.errors.pop(path, None)
+                applied += 1
+                # Sidecars of earlier delta versions are not needed (the base one is kept)
+                if self._sidecar and self._sidecar != self.dataset.sidecar_path:
+                    try:
+                        os.remove(self._sidecar)
+                    except OSError:
+                        pass
+                self._sidecar = self.dataset.sidecar_path
+            return applied
+
+    def start(self):
+        """Merge what is already in the directory, then keep polling in the background"""
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name='delta-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.refresh()
+
+    def stop(self):
+        self._stop.set()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def start_watcher(dataset, directory=DELTA_DIR, poll_seconds=POLL_SECONDS):
+    """Start the watcher for a dataset, stopping the one for an older base version"""
+    with _watchers_lock:
+        previous = _watchers.pop(dataset.source, None)
+        if previous is not None:
+            previous.stop()
+        watcher = _watchers[dataset.source] = DeltaWatcher(dataset, directory, poll_seconds)
+    return watcher.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge delta files into the dataset and report the changes")
+    parser.add_argument('--data', default='data.xlsx', help="base dataset (default: data.xlsx)")
+    parser.add_argument('--dir', default=DELTA_DIR or 'deltas', help="drop directory with the delta files")
+    args = parser.parse_args(argv)
+
+    base = load_dataset(args.data)
+    watcher = DeltaWatcher(base, args.dir)
+    applied = watcher.refresh()
+    dataset = watcher.dataset
+    for path, (signature, error) in watcher.errors.items():
+        print(f"{os.path.basename(path)}: {error}", file=sys.stderr)
+    print(f"Applied {applied} delta file(s): {len(base):,} -> {len(dataset):,} rows, "
+          f"version {base.version} -> {dataset.version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
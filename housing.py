@@ -0,0 +1,150 @@
+"""
+Derived housing status for each distributed land parcel
+
+A parcel is inhabited (تم إسكانها) when it has a meter number. If it has a
+meter but no connection type, construction started but is not complete. If
+it has no meter, work has not started. The status is computed once at ingest
+and the three housing answers are built from the resulting counts.
+"""
+
+import pandas as pd
+
+METER_COLUMN = 'رقم العداد'
+CONNECTION_COLUMN = 'نوع التوصيل'
+STATUS_COLUMN = 'HOUSING_STATUS'
+
+NOT_STARTED = 'not_started'
+INCOMPLETE = 'incomplete'
+CONNECTED = 'connected'
+STATUSES = [NOT_STARTED, INCOMPLETE, CONNECTED]
+
+# Meter values that mean "no meter" in the source data
+NO_METER_VALUES = {'', 'no account exist'}
+
+# The three main housing questions (see EXAMPLE_QUESTIONS in app.py)
+INHABITED_QUESTION = "عدد الأراضي الموزعة التي تم إسكانها"
+NOT_STARTED_QUESTION = "عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها"
+INCOMPLETE_QUESTION = "عدد الأراضي الموزعة التي لم يكتمل العمل فيها"
+
+
+def has_meter(meter):
+    """Vectorized: True where the meter number is present"""
+    text = meter.astype('string').str.strip().str.lower()
+    return meter.notna() & ~text.isin(NO_METER_VALUES)
+
+
+def housing_status(df):
+    """Return the categorical housing status of every row in df"""
+    meter = has_meter(df[METER_COLUMN])
+    connected = df[CONNECTION_COLUMN].notna() if CONNECTION_COLUMN in df.columns else False
+    codes = (meter.astype('int8') + (meter & connected).astype('int8')).to_numpy()
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=STATUSES),
+        index=df.index,
+        name=STATUS_COLUMN,
+    )
+
+
+def add_housing_status(df):
+    """Add the STATUS_COLUMN to df in place (no-op without a meter column)"""
+    if METER_COLUMN in df.columns:
+        df[STATUS_COLUMN] = housing_status(df)
+    return df
+
+
+def housing_summary(df):
+    """Count parcels per housing status and connected parcels per connection type"""
+    if STATUS_COLUMN not in df.columns:
+        return None
+    counts = df[STATUS_COLUMN].value_counts()
+    connections = df.loc[df[STATUS_COLUMN] == CONNECTED, CONNECTION_COLUMN].value_counts()
+    summary = {status: int(counts.get(status, 0)) for status in STATUSES}
+    summary['inhabited'] = summary[INCOMPLETE] + summary[CONNECTED]
+    summary['connection_types'] = {str(k): int(v) for k, v in connections.items() if v}
+    return summary
+
+
+def housing_summary_updated(summary, old_rows, new_rows):
+    """summary after old_rows were replaced by new_rows (a delta's changed and added rows)"""
+    if summary is None:
+        return None
+    removed, added = housing_summary(old_rows), housing_summary(new_rows)
+    updated = {status: summary[status] - removed[status] + added[status] for status in STATUSES}
+    updated['inhabited'] = updated[INCOMPLETE] + updated[CONNECTED]
+    types = set(summary['connection_types']) | set(added['connection_types'])
+    connections = {
+        name: summary['connection_types'].get(name, 0) - removed['connection_types'].get(name, 0)
+        + added['connection_types'].get(name, 0)
+        for name in types
+    }
+    # Most common first, as value_counts orders them
+    updated['connection_types'] = {name: n for name, n in sorted(connections.items(), key=lambda item: -item[1]) if n}
+    return updated
+
+
+def housing_notes(summary):
+    """Describe the housing columns and current counts for the LLM prompt"""
+    if summary is None:
+        return ""
+    return f"""Housing notes ('{STATUS_COLUMN}' is derived from '{METER_COLUMN}' and '{CONNECTION_COLUMN}'; 'No account Exist' means no meter):
+- '{NOT_STARTED}': no meter, construction NOT started (لم يتم البدء في العمل): {summary[NOT_STARTED]:,} parcels
+- '{INCOMPLETE}': meter but no connection type, started but NOT completed (لم يكتمل العمل): {summary[INCOMPLETE]:,} parcels
+- '{CONNECTED}': meter and connection type: {summary[CONNECTED]:,} parcels
+- Inhabited (تم إسكانها) = '{INCOMPLETE}' + '{CONNECTED}': {summary['inhabited']:,} parcels"""
+
+
+def _pie(labels, values, title):
+    return {
+        "type": "pie",
+        "data": {
+            "x": labels,
+            "y": values,
+            "title": title,
+            "xlabel": "",
+            "ylabel": ""
+        }
+    }
+
+
+def _connection_label(connection_type):
+    # 'Permanent Connection (توصيلة دائمة)' -> 'توصيلة دائمة (Permanent)'
+    if '(' in connection_type and connection_type.endswith(')'):
+        english, arabic = connection_type[:-1].split('(', 1)
+        return f"{arabic.strip()} ({english.replace('Connection', '').strip()})"
+    return connection_type
+
+
+def housing_answer(query, summary):
+    """Answer one of the three housing questions from the summary, or return None"""
+    if summary is None:
+        return None
+
+    inhabited = summary['inhabited']
+    not_started = summary[NOT_STARTED]
+    status_pie = (["إسكانها", "لم يتم إسكانها"], [inhabited, not_started])
+
+    if INHABITED_QUESTION in query:
+        return {
+            "answer": f"عدد الأراضي الموزعة التي تم إسكانها: {inhabited:,} أرض",
+            "plot": _pie(*status_pie, "توزيع الأراضي حسب حالة الإسكان"),
+            "query_used": f"df['{STATUS_COLUMN}'].isin(['{INCOMPLETE}', '{CONNECTED}']).sum()"
+        }
+
+    if NOT_STARTED_QUESTION in query:
+        return {
+            "answer": f"عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها (بناء المساكن): {not_started:,} أرض",
+            "plot": _pie(*status_pie, "توزيع الأراضي - لم يتم البدء في العمل"),
+            "query_used": f"(df['{STATUS_COLUMN}'] == '{NOT_STARTED}').sum()"
+        }
+
+    if INCOMPLETE_QUESTION in query:
+        connections = summary['connection_types']
+        labels = [_connection_label(name) for name in connections] + ["لم يكتمل (Blank)"]
+        values = list(connections.values()) + [summary[INCOMPLETE]]
+        return {
+            "answer": f"عدد الأراضي الموزعة التي لم يكتمل العمل فيها (تم البدء بالبناء ولم يتم الانتهاء): {summary[INCOMPLETE]:,} أرض",
+            "plot": _pie(labels, values, "توزيع الأراضي المسكونة حسب نوع التوصيل"),
+            "query_used": f"(df['{STATUS_COLUMN}'] == '{INCOMPLETE}').sum()"
+        }
+
+    return None
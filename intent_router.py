@@ -0,0 +1,405 @@
+"""
+Local intent router that answers common questions without calling OpenAI
+
+A question is tokenized with the Arabic normalization from arabic_text, and
+each token must be explained by an aggregation keyword, a column keyword, a
+filter value (near misses are matched with value_index's trigram index) or a
+stopword. If any token is left unexplained, or a place name is both a
+governorate and a wilayat and the question does not say which, the router
+declines and the caller falls back to the LLM, so it only answers when it
+understood the whole question.
+"""
+
+import re
+
+import pandas as pd
+
+from arabic_text import detect_arabic, normalize_query
+
+AREA_COLUMN = 'PAR_AREA'
+DATE_COLUMN = 'DOC_DATE'
+
+# Columns whose values can be used as filters, in priority order for ambiguous matches
+FILTER_COLUMNS = ['REGN', 'WLYA', 'PUSE', 'VILG', 'SUB_PUSE_DESC']
+
+# A name matching both ('مسقط', 'Muscat') is left to the LLM unless a keyword
+# ('محافظة', 'wilayat', ...) says which one is meant
+PLACE_COLUMNS = {'REGN', 'WLYA'}
+
+_ARABIC_PREFIXES = ('وال', 'بال', 'لل', 'ال')
+
+
+def _stem(token):
+    """Strip the Arabic definite article and fold the nisba suffix (السكنيه -> سكني)"""
+    for prefix in _ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            token = token[len(prefix):]
+            break
+    if len(token) > 3 and token.endswith('يه'):
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Normalize text and return its stemmed tokens"""
+    return [_stem(token) for token in normalize_query(text).split()]
+
+
+def _stems(*words):
+    return {' '.join(tokenize(word)) for word in words}
+
+
+AGGREGATION_KEYWORDS = {
+    'count': _stems('كم', 'عدد', 'count', 'how', 'many', 'number'),
+    'mean': _stems('متوسط', 'معدل', 'average', 'mean', 'avg'),
+    'sum': _stems('إجمالي', 'مجموع', 'total', 'sum'),
+    'distribution': _stems('توزيع', 'حسب', 'قارن', 'مقارنة', 'distribution', 'breakdown',
+                           'by', 'per', 'compare', 'across'),
+    'trend': _stems('اتجاه', 'عبر', 'الزمن', 'trend', 'over', 'time'),
+}
+
+COLUMN_KEYWORDS = {
+    'REGN': _stems('المنطقة', 'المناطق', 'محافظة', 'المحافظات', 'region', 'regions',
+                   'governorate', 'governorates'),
+    'WLYA': _stems('الولاية', 'الولايات', 'wilayat', 'wilayats'),
+    'VILG': _stems('القرية', 'القرى', 'village', 'villages'),
+    'PUSE': _stems('الاستخدام', 'الاستخدامات', 'use', 'usage'),
+    'YR': _stems('السنة', 'السنوات', 'العام', 'year', 'years'),
+    'HOUSING_STATUS': _stems('الإسكان', 'housing', 'status'),
+    AREA_COLUMN: _stems('مساحة', 'مساحتها', 'المساحات', 'area', 'size'),
+}
+
+STOPWORDS = _stems(
+    'ما', 'ماذا', 'هو', 'هي', 'في', 'من', 'على', 'عن', 'أظهر', 'اعرض', 'أعطني', 'لي',
+    'البيانات', 'العقارات', 'العقار', 'القطع', 'القطعة', 'الأراضي', 'الأرض', 'السجلات',
+    'السجل', 'المسجلة', 'التسجيلات', 'التي', 'الذي', 'كل', 'جميع', 'المختلفة', 'بين',
+    'is', 'are', 'the', 'of', 'in', 'for', 'there', 'what', 'show', 'me', 'give', 'a',
+    'an', 'records', 'record', 'properties', 'property', 'parcels', 'parcel', 'plots',
+    'dataset', 'data', 'all', 'each', 'different', 'registered', 'registrations', 'do',
+    'we', 'have', 'total', 's', 'whats', 'were', 'was'
+)
+
+# English place names, resolved in every place column where the Arabic name is
+# a value (a governorate's name without 'محافظة' counts as its value)
+PLACE_ALIASES = {
+    'muscat': 'مسقط',
+    'north batinah': 'شمال الباطنة',
+    'south batinah': 'جنوب الباطنة',
+    'dakhliyah': 'الداخلية',
+    'dhahirah': 'الظاهرة',
+    'sharqiyah': 'الشرقية',
+    'wusta': 'الوسطى',
+    'dhofar': 'ظفار',
+    'musandam': 'مسندم',
+    'buraimi': 'البريمى',
+}
+
+# English aliases for Arabic category values (resolved against the real values)
+VALUE_ALIASES = {
+    'PUSE': {
+        'residential': 'سكني',
+        'social housing': 'مسكن اجتماعي',
+        'rural housing': 'سكن ريفي',
+    },
+    'REGN': PLACE_ALIASES,
+    'WLYA': PLACE_ALIASES,
+}
+
+_ARABIC_NAMES = {
+    'REGN': 'المنطقة', 'WLYA': 'الولاية', 'VILG': 'القرية', 'PUSE': 'الاستخدام',
+    'YR': 'السنة', 'HOUSING_STATUS': 'حالة الإسكان', 'SUB_PUSE_DESC': 'الاستخدام الفرعي',
+}
+_ENGLISH_NAMES = {
+    'REGN': 'region', 'WLYA': 'wilayat', 'VILG': 'village', 'PUSE': 'property use',
+    'YR': 'year', 'HOUSING_STATUS': 'housing status', 'SUB_PUSE_DESC': 'sub use',
+}
+
+_YEAR = re.compile(r'^(19|20)\d\d$')
+MIN_CONFIDENCE = 1.0
+
+
+def _value_key(tokens):
+    return ''.join(tokens)
+
+
+class IntentRouter:
+    """Deterministic Arabic/English intent matcher for one dataset version
+
+    index is the dataset's value_index.ValueIndex, used for near misses; without
+    it only exact (normalized) values match.
+    """
+
+    def __init__(self, df, cube=None, min_confidence=MIN_CONFIDENCE, index=None):
+        self.df = df
+        self.cube = cube
+        self.index = index
+        self.min_confidence = min_confidence
+        self.years = set()
+        if 'YR' in df.columns:
+            self.years = {int(year) for year in pd.unique(df['YR'].dropna())}
+
+        # column -> {space-free stemmed value: original value}
+        self.values = {}
+        for col in FILTER_COLUMNS:
+            if col not in df.columns:
+                continue
+            series = df[col]
+            uniques = series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else series.dropna().unique()
+            lookup = {_value_key(tokenize(value)): value for value in uniques if isinstance(value, str)}
+            if col == 'REGN':
+                # 'مسقط' for ' محافظة مسقط'
+                for value in list(lookup.values()):
+                    bare = [token for token in tokenize(value) if token not in COLUMN_KEYWORDS['REGN']]
+                    if bare:
+                        lookup.setdefault(_value_key(bare), value)
+            for alias, target in VALUE_ALIASES.get(col, {}).items():
+                original = lookup.get(_value_key(tokenize(target)))
+                if original is not None:
+                    lookup[_value_key(tokenize(alias))] = original
+            self.values[col] = lookup
+
+    def _match_value(self, tokens, raw, start, size, fuzzy):
+        """Return [(column, value)] whose value matches tokens[start:start+size]
+
+        raw are the unstemmed tokens, for the value index's fuzzy match.
+        """
+        key = _value_key(tokens[start:start + size])
+        matches = [(col, lookup[key]) for col, lookup in self.values.items() if key in lookup]
+        if matches or not fuzzy or len(key) < 4 or self.index is None:
+            return matches
+        text = ' '.join(raw[start:start + size])
+        for col in self.values:
+            stored = self.index.resolve(col, text)
+            # One value per filter; several stored spellings are left to the LLM
+            if stored is not None and len(stored) == 1:
+                matches.append((col, stored[0]))
+        return matches
+
+    def parse(self, query):
+        """Return the parsed intent dict (with a confidence in [0, 1]) or None"""
+        raw = normalize_query(query).split()
+        tokens = [_stem(word) for word in raw]
+        if not tokens:
+            return None
+
+        explained = [False] * len(tokens)
+        aggregations, columns, candidates = set(), [], []
+
+        # Keywords and stopwords first so they are never fuzzy-matched as values
+        for i, token in enumerate(tokens):
+            for name, words in AGGREGATION_KEYWORDS.items():
+                if token in words:
+                    aggregations.add(name)
+                    explained[i] = True
+            for col, words in COLUMN_KEYWORDS.items():
+                if token in words:
+                    columns.append((i, col))
+                    explained[i] = True
+            if token in STOPWORDS:
+                explained[i] = True
+
+        filters = {}
+        for i, token in enumerate(tokens):
+            if _YEAR.match(token) and int(token) in self.years:
+                filters.setdefault('YR', []).append(int(token))
+                explained[i] = True
+
+        # Longest value n-grams first. A multi-word value may absorb keywords
+        # ('محافظة مسقط'); fuzzy matching needs an unexplained token and no stopword.
+        consumed = [False] * len(tokens)
+        for size in (4, 3, 2, 1):
+            for start in range(len(tokens) - size + 1):
+                span = range(start, start + size)
+                if any(consumed[i] for i in span) or (size == 1 and explained[start]):
+                    continue
+                fuzzy = (not all(explained[i] for i in span)
+                         and not any(tokens[i] in STOPWORDS for i in span))
+                matches = self._match_value(tokens, raw, start, size, fuzzy)
+                if matches:
+                    candidates.append((start, size, matches))
+                    for i in span:
+                        consumed[i] = explained[i] = True
+
+        keyword_columns = {col for _, col in columns}
+        ambiguous = False
+        for start, size, matches in candidates:
+            preferred = [m for m in matches if m[0] in keyword_columns] or matches
+            if PLACE_COLUMNS <= {c for c, _ in preferred}:
+                ambiguous = True
+            col, value = preferred[0]
+            filters.setdefault(col, []).append(value)
+            # Keywords inside the value or naming its column are not group-bys
+            columns = [(i, c) for i, c in columns if c != col and not start <= i < start + size]
+
+        confidence = sum(explained) / len(tokens)
+        return {
+            'aggregations': aggregations,
+            'columns': [col for _, col in columns],
+            'filters': filters,
+            'confidence': confidence,
+            'ambiguous': ambiguous,
+            'arabic': detect_arabic(query),
+        }
+
+    def route(self, query):
+        """Answer query locally, or return None when confidence is too low"""
+        intent = self.parse(query)
+        if intent is None or intent['confidence'] < self.min_confidence or intent['ambiguous']:
+            return None
+        if any(len(values) > 1 for values in intent['filters'].values()):
+            # Comparisons between several values of one column go to the LLM
+            return None
+
+        filters = {col: values[0] for col, values in intent['filters'].items()}
+        aggregations = intent['aggregations']
+        measure_columns = [col for col in intent['columns'] if col == AREA_COLUMN]
+        group_columns = [col for col in intent['columns'] if col != AREA_COLUMN]
+
+        if 'trend' in aggregations and not measure_columns and len(group_columns) <= 1:
+            return self._trend(filters, intent['arabic'])
+        if len(group_columns) == 1 and ('distribution' in aggregations or not aggregations):
+            measure = 'area_sum' if measure_columns else 'count'
+            return self._distribution(group_columns[0], measure, filters, intent['arabic'])
+        if group_columns:
+            return None
+        if measure_columns and aggregations & {'mean', 'sum'}:
+            measure = 'area_mean' if 'mean' in aggregations else 'area_sum'
+            return self._scalar(measure, filters, intent['arabic'])
+        if 'count' in aggregations and not measure_columns:
+            return self._scalar('count', filters, intent['arabic'])
+        return None
+
+    def _mask(self, filters):
+        df = self.df
+        mask = pd.Series(True, index=df.index)
+        for col, value in filters.items():
+            mask &= df[col] == value
+        return mask
+
+    def _cube_covers(self, columns):
+        return self.cube is not None and self.cube.covers(columns)
+
+    def _scalar(self, measure, filters, arabic):
+        if self._cube_covers(filters):
+            value = self.cube.scalar(measure, filters)
+        else:
+            rows = self.df[self._mask(filters)]
+            if measure == 'count':
+                value = len(rows)
+            elif measure == 'area_sum':
+                value = float(rows[AREA_COLUMN].sum())
+            else:
+                value = float(rows[AREA_COLUMN].mean())
+
+        where = _describe_filters(filters)
+        if measure == 'count':
+            text = f"عدد السجلات{where}: {value:,}" if arabic else f"Number of records{where}: {value:,}"
+        elif measure == 'area_sum':
+            text = (f"إجمالي مساحة القطع{where}: {value:,.2f} متر مربع" if arabic
+                    else f"Total parcel area{where}: {value:,.2f} m²")
+        else:
+            text = (f"متوسط مساحة القطع{where}: {value:,.2f} متر مربع" if arabic
+                    else f"Average parcel area{where}: {value:,.2f} m²")
+
+        return {
+            'answer': text,
+            'plot': {'type': 'none'},
+            'query_used': _expression(measure, filters),
+            'source': 'local',
+        }
+
+    def _distribution(self, column, measure, filters, arabic):
+        if self._cube_covers([column, *filters]):
+            values = self.cube.rollup([column], measure, filters)
+        elif column in self.df.columns:
+            rows = self.df[self._mask(filters)]
+            grouped = rows.groupby(column, observed=True)
+            values = grouped.size() if measure == 'count' else grouped[AREA_COLUMN].sum()
+        else:
+            return None
+        if column != 'YR':
+            values = values.sort_values(ascending=False, kind='stable')
+        if values.empty:
+            return None
+
+        name = (_ARABIC_NAMES if arabic else _ENGLISH_NAMES).get(column, column)
+        where = _describe_filters(filters)
+        top, top_value = values.index[0], values.iloc[0]
+        if arabic:
+            metric = 'عدد العقارات' if measure == 'count' else 'إجمالي المساحة'
+            text = f"التوزيع حسب {name}{where}. الأعلى: {top} ({top_value:,.0f})."
+            ylabel = 'العدد' if measure == 'count' else 'المساحة (م²)'
+        else:
+            metric = 'Count' if measure == 'count' else 'Total area'
+            text = f"Distribution by {name}{where}. Highest: {top} ({top_value:,.0f})."
+            ylabel = 'Count' if measure == 'count' else 'Area (m²)'
+
+        return {
+            'answer': text,
+            'plot': {
+                'type': 'bar',
+                'data': {
+                    'x': [str(label) for label in values.index],
+                    'y': [float(v) if measure != 'count' else int(v) for v in values.values],
+                    'title': f"{metric} / {name}",
+                    'xlabel': name,
+                    'ylabel': ylabel,
+                },
+            },
+            'query_used': _expression(measure, filters, column),
+            'source': 'local',
+        }
+
+    def _trend(self, filters, arabic):
+        if DATE_COLUMN not in self.df.columns:
+            return None
+        dates = self.df.loc[self._mask(filters), DATE_COLUMN]
+        monthly = dates.dt.to_period('M').value_counts().sort_index()
+        if monthly.empty:
+            return None
+        where = _describe_filters(filters)
+        text = (f"اتجاه التسجيلات الشهرية{where} من {monthly.index[0]} إلى {monthly.index[-1]}."
+                if arabic else
+                f"Monthly registrations{where} from {monthly.index[0]} to {monthly.index[-1]}.")
+        return {
+            'answer': text,
+            'plot': {
+                'type': 'line',
+                'data': {
+                    'x': [str(period) for period in monthly.index],
+                    'y': [int(v) for v in monthly.values],
+                    'title': 'Registrations over time / التسجيلات عبر الزمن',
+                    'xlabel': 'Month / الشهر',
+                    'ylabel': 'Count / العدد',
+                },
+            },
+            'query_used': f"{_frame(filters)}['{DATE_COLUMN}'].dt.to_period('M').value_counts().sort_index()",
+            'source': 'local',
+        }
+
+
+def _describe_filters(filters):
+    if not filters:
+        return ''
+    return ' (' + ', '.join(str(value).strip() for value in filters.values()) + ')'
+
+
+def _frame(filters):
+    if not filters:
+        return 'df'
+    conditions = ' & '.join(f"(df['{col}'] == {value!r})" for col, value in filters.items())
+    return f"df[{conditions}]"
+
+
+def _expression(measure, filters, group_by=None):
+    """Return the pandas expression equivalent to a routed answer"""
+    frame = _frame(filters)
+    if group_by is not None:
+        if measure == 'count':
+            return f"{frame}['{group_by}'].value_counts()"
+        return f"{frame}.groupby('{group_by}')['{AREA_COLUMN}'].sum()"
+    if measure == 'count':
+        return f"len({frame})"
+    if measure == 'area_sum':
+        return f"{frame}['{AREA_COLUMN}'].sum()"
+    return f"{frame}['{AREA_COLUMN}'].mean()"
@@ -0,0 +1,149 @@
+"""
+Persistent cache of LLM answers shared by every session and process
+
+Answers are stored in SQLite keyed by the normalized question, the model name
+and the dataset version, so a repeated question costs no network round trip
+or tokens and the cache survives restarts. Entries expire after a TTL and the
+least recently used entries are evicted above max_entries.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from arabic_text import normalize_query
+
+# Next to the Parquet sidecars (data_store.CACHE_DIR, not imported to keep pandas out)
+CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(os.getenv("DATA_CACHE_DIR", ".data_cache"), "llm_responses.sqlite3")
+)
+MAX_ENTRIES = 5000
+TTL_SECONDS = 7 * 24 * 3600
+
+
+def cache_key(query, model, fingerprint):
+    """Return the cache key of a question for a model and dataset version"""
+    raw = '\x1f'.join([normalize_query(query), model or '', fingerprint or ''])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed LRU + TTL cache of query_data_with_llm results"""
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One connection shared by the Streamlit session threads, guarded by _lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    normalized TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+            # An answer to the normalized question for any data version (get_stale)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_normalized ON responses (normalized, model, created)"
+            )
+
+    def get(self, query, model, fingerprint):
+        """Return the cached result dict, or None on a miss or expired entry"""
+        key = cache_key(query, model, fingerprint)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                (now, key),
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def contains(self, query, model, fingerprint):
+        """Whether an unexpired answer is stored (not counted as a hit or miss)"""
+        key = cache_key(query, model, fingerprint)
+        with self._lock:
+            row = self._conn.execute("SELECT created FROM responses WHERE key = ?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl_seconds
+
+    def get_stale(self, query, model):
+        """Return the newest stored answer to query for any dataset version, or None
+
+        Matches on the normalized question like get(). Used when the LLM is
+        unavailable; not counted as a hit or miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE normalized = ? AND model = ? "
+                "ORDER BY created DESC LIMIT 1",
+                (normalize_query(query), model),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, query, model, fingerprint, result):
+        """Store a result dict, evicting expired and least recently used entries"""
+        key = cache_key(query, model, fingerprint)
+        now = time.time()
+        payload = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, query, normalized, model, fingerprint, response, created, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, query, normalize_query(query), model, fingerprint, payload, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        """Return hit/miss counts for this process and the stored entry count"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
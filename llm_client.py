@@ -0,0 +1,334 @@
+"""
+Resilient OpenAI calls: deadlines, retries with backoff, hedging and a circuit breaker
+
+Every chat completion goes through ResilientCaller:
+  - deadline: a question gets LLM_DEADLINE_SECONDS in total; each attempt's
+    HTTP timeout is what is left of it (at most LLM_ATTEMPT_TIMEOUT_SECONDS)
+  - retries: 429, 5xx, timeouts and connection errors are retried with full
+    jitter exponential backoff (honouring Retry-After) while the deadline
+    allows; other errors (400, 401, ...) fail at once
+  - hedging (LLM_HEDGE=1): when an attempt is still running after the p95 of
+    recent attempt latencies, a duplicate request is sent and the first
+    answer wins
+  - circuit breaker: after LLM_BREAKER_FAILURES consecutive upstream
+    failures calls fail fast with LLMUnavailable for LLM_BREAKER_COOLDOWN_SECONDS,
+    then one probe request decides whether to close it again
+
+The SDK's own retries are turned off (max_retries=0) so only this policy applies.
+LLMUnavailable tells llm_query to fall back to a local or cached answer.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import count, observe
+
+DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "45"))
+ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "30"))
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+
+# Hedged duplicate requests after the p95 attempt latency ('1' enables them)
+HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_SECONDS = 0.5
+LATENCY_WINDOW = 200
+
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# HTTP statuses worth retrying besides 5xx
+RETRY_STATUSES = {408, 409, 429}
+
+
+class LLMUnavailable(Exception):
+    """The LLM could not answer in time: circuit open, deadline passed or retries exhausted"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    """Whether an OpenAI error is transient (429, 5xx, timeout, connection)"""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRY_STATUSES or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # openai.APIConnectionError and its APITimeoutError subclass
+    return any(cls.__name__ == 'APIConnectionError' for cls in type(error).__mro__)
+
+
+def retry_after(error):
+    """Seconds from a Retry-After header, or None"""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """Full jitter exponential backoff before retry number attempt (1, 2, ...)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed -> open -> half-open -> closed)"""
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self._consecutive = 0
+        self._opened = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may go upstream now: True, 'probe' for the one half-open probe, or False"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened >= self.cooldown:
+                self._set('half_open')
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return 'probe'
+            return False
+
+    def release(self):
+        """Let another probe through after one ended without an outcome (deadline, cancellation)"""
+        with self._lock:
+            self._probing = False
+
+    def retry_in(self):
+        """Seconds until the breaker lets a probe through"""
+        with self._lock:
+            return max(0.0, self.cooldown - (time.monotonic() - self._opened)) if self.state == 'open' else 0.0
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._probing = False
+            if self.state != 'closed':
+                self._set('closed')
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._probing = False
+            if self.state == 'half_open' or (self.state == 'closed' and self._consecutive >= self.failures):
+                self._opened = time.monotonic()
+                self._set('open')
+
+    def _set(self, state):
+        self.state = state
+        count('llm_breaker_transitions_total', state=state)
+
+
+class ResilientCaller:
+    """Deadline, retry, hedging and circuit breaker policy around a create() call"""
+
+    def __init__(self, deadline=DEADLINE_SECONDS, attempt_timeout=ATTEMPT_TIMEOUT_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, hedge=HEDGE, breaker=None):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def hedge_delay(self):
+        """Seconds after which a hedged request is sent (None: no hedging yet)"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_SECONDS, samples[int(0.95 * (len(samples) - 1))])
+
+    def _timeout(self, deadline_at):
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise LLMUnavailable(f"No answer within the {self.deadline:.0f}s deadline")
+        return min(self.attempt_timeout, remaining)
+
+    def _admit(self):
+        """Raise LLMUnavailable unless the breaker allows a request; True for the half-open probe"""
+        allowed = self.breaker.allow()
+        if not allowed:
+            count('llm_calls_total', outcome='short_circuit')
+            retry = self.breaker.retry_in()
+            raise LLMUnavailable(f"LLM circuit open, retrying in {retry:.0f}s", retry_after=retry)
+        return allowed == 'probe'
+
+    def _attempt(self, create, request, timeout):
+        start = time.monotonic()
+        response = create(timeout=timeout, **request)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return response
+
+    def _record(self, error):
+        # Only upstream trouble opens the breaker; a bad request says nothing about its health
+        if error is None:
+            self.breaker.success()
+            count('llm_calls_total', outcome='ok')
+        elif is_retryable(error):
+            self.breaker.failure()
+            count('llm_calls_total', outcome='retryable_error')
+        else:
+            self.breaker.success()
+            count('llm_calls_total', outcome='error')
+
+    def _wait_before_retry(self, attempt, error, deadline_at):
+        delay = max(backoff(attempt), retry_after(error) or 0)
+        if time.monotonic() + delay >= deadline_at:
+            raise LLMUnavailable(f"No answer within the {self.deadline:.0f}s deadline: {error}") from error
+        observe('llm_backoff', delay)
+        return delay
+
+    def call(self, create, **request):
+        """create(timeout=..., **request) under the policy; raises LLMUnavailable when it gives up"""
+        deadline_at = time.monotonic() + self.deadline
+        for attempt in range(1, self.max_attempts + 1):
+            probe = self._admit()
+            try:
+                response = self._hedged(create, request, deadline_at)
+            except LLMUnavailable:
+                if probe:
+                    self.breaker.release()
+                raise
+            except Exception as error:
+                self._record(error)
+                if not is_retryable(error):
+                    raise
+                if attempt == self.max_attempts:
+                    raise LLMUnavailable(f"LLM failed after {attempt} attempts: {error}") from error
+                time.sleep(self._wait_before_retry(attempt, error, deadline_at))
+                count('llm_retries_total')
+                continue
+            except BaseException:
+                # Cancelled or interrupted mid-request
+                if probe:
+                    self.breaker.release()
+                raise
+            self._record(None)
+            return response
+
+    def _hedged(self, create, request, deadline_at):
+        timeout = self._timeout(deadline_at)
+        delay = self.hedge_delay()
+        # Streams are consumed by the caller, so only whole responses are hedged
+        if delay is None or delay >= timeout or request.get('stream'):
+            return self._attempt(create, request, timeout)
+
+        pool = self._executor()
+        first = pool.submit(self._attempt, create, request, timeout)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        count('llm_hedges_total', outcome='sent')
+        second = pool.submit(self._attempt, create, request, self._timeout(deadline_at))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    count('llm_hedges_total', outcome='won' if future is second else 'lost')
+                    # The slower request is left to finish in the background
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(8, thread_name_prefix='llm-hedge')
+            return self._pool
+
+    async def acall(self, create, **request):
+        """Async call() for openai.AsyncOpenAI's create"""
+        deadline_at = time.monotonic() + self.deadline
+        for attempt in range(1, self.max_attempts + 1):
+            probe = self._admit()
+            try:
+                response = await self._ahedged(create, request, deadline_at)
+            except LLMUnavailable:
+                if probe:
+                    self.breaker.release()
+                raise
+            except Exception as error:
+                self._record(error)
+                if not is_retryable(error):
+                    raise
+                if attempt == self.max_attempts:
+                    raise LLMUnavailable(f"LLM failed after {attempt} attempts: {error}") from error
+                await asyncio.sleep(self._wait_before_retry(attempt, error, deadline_at))
+                count('llm_retries_total')
+                continue
+            except BaseException:
+                # Cancelled or interrupted mid-request
+                if probe:
+                    self.breaker.release()
+                raise
+            self._record(None)
+            return response
+
+    async def _aattempt(self, create, request, timeout):
+        start = time.monotonic()
+        response = await create(timeout=timeout, **request)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return response
+
+    async def _ahedged(self, create, request, deadline_at):
+        timeout = self._timeout(deadline_at)
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout or request.get('stream'):
+            return await self._aattempt(create, request, timeout)
+
+        first = asyncio.ensure_future(self._aattempt(create, request, timeout))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done:
+            return first.result()
+        count('llm_hedges_total', outcome='sent')
+        second = asyncio.ensure_future(self._aattempt(create, request, self._timeout(deadline_at)))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    count('llm_hedges_total', outcome='won' if task is second else 'lost')
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+
+_caller = None
+_caller_lock = threading.Lock()
+
+
+def get_caller():
+    """The process-wide ResilientCaller (one breaker and latency window for all sessions)"""
+    global _caller
+    with _caller_lock:
+        if _caller is None:
+            _caller = ResilientCaller()
+        return _caller
@@ -0,0 +1,400 @@
+"""
+LLM query pipeline shared by the Streamlit app and the batch runner
+
+Questions are answered locally when possible (housing counts, intent router,
+parcel/meter lookups, response cache). Otherwise the question goes to OpenAI through a pooled
+client, and the returned query_used is executed to fill the plot with the
+real data. OpenAI calls go through llm_client's deadline, retry and circuit
+breaker policy; when the LLM is unavailable the answer falls back to the
+newest cached answer of an older data version, or a notice to retry later.
+"""
+
+import asyncio
+import json
+import os
+import time
+from functools import lru_cache
+
+from dataset_profile import DatasetProfile, count_tokens
+from housing import housing_answer, housing_notes, housing_summary
+from llm_client import LLMUnavailable, get_caller
+from llm_stream import AnswerStreamParser
+from metrics import annotate, count, observe, span, trace
+from planner import is_compound, merge_plan, plan_request, run_plan, tool_plan
+from plot_reduce import plot_data_from_result
+from query_backends import BACKEND_NAME, PARQUET_SOURCE, ResultTooLarge, get_backend
+from query_engine import get_result_cache
+from result_table import is_table, table_spec
+from schema import COLUMN_MAPPING
+from value_index import record_answer
+
+# OpenAI model used for answers (part of the response cache key)
+LLM_MODEL = "gpt-4o-mini"
+
+# Offer comparison questions the planner's parallel sub-queries ('0' disables it)
+DECOMPOSE_QUESTIONS = os.getenv("DECOMPOSE_QUESTIONS", "1") != "0"
+
+# System prompt: the same for every question and data version, so it opens the cacheable prefix
+SYSTEM_PROMPT = """You are a data analyst assistant. Answer questions about the dataset described below with ONE valid JSON object and nothing else:
+{"answer": "...", "plot": {"type": "bar|pie|line|histogram|scatter|none", "data": {"x": [...], "y": [...], "title": "...", "xlabel": "...", "ylabel": "..."}}, "query_used": "..."}
+
+Rules:
+- answer: the result in words, in Arabic for Arabic questions and in English for English ones
+- plot: "none" for single values (how many, what is); bar for comparisons and top N; pie for shares (max 10 slices); line for trends over time; histogram for numeric distributions; scatter for correlations. Titles and labels bilingual where possible
+- query_used: one expression computing the result; it is executed and fills the plot's x/y, e.g. len(df) or df['REGN'].value_counts()
+- Compare Arabic columns with the values exactly as listed in the dataset info
+- Housing questions use the HOUSING_STATUS column and the counts in the data notes, with pie charts
+
+Example, "Show distribution by region":
+{"answer": "Muscat has the most properties (15,234).", "plot": {"type": "bar", "data": {"x": ["محافظة مسقط", "شمال الباطنة"], "y": [15234, 8765], "title": "Distribution by Region / التوزيع حسب المنطقة", "xlabel": "Region / المنطقة", "ylabel": "Count / العدد"}}, "query_used": "df['REGN'].value_counts()"}"""
+
+
+@lru_cache(maxsize=8)
+def get_client(api_key):
+    """Return the process-wide OpenAI client for api_key, reusing its connection pool"""
+    from openai import OpenAI
+    # Retries and timeouts are llm_client's, not the SDK's
+    return OpenAI(api_key=api_key, max_retries=0)
+
+
+def local_answer(df, query, dataset=None):
+    """Return (source, result) when the question is answered without the LLM, else None
+
+    Sources are the housing counts, the intent router and the PAR_PIN /
+    meter lookups; nothing is counted or cached.
+    """
+    # The housing counts and the router describe the loaded frame, not external Parquet data
+    if get_backend(dataset).external:
+        return None
+    # The three housing questions are answered from the derived HOUSING_STATUS counts
+    housing = dataset.housing if dataset is not None else housing_summary(df)
+    housing_result = housing_answer(query, housing)
+    if housing_result is not None:
+        return 'housing', housing_result
+    if dataset is None:
+        return None
+
+    # Common aggregations are answered locally when the router understands the whole question
+    routed = dataset.router.route(query)
+    if routed is not None:
+        return 'router', routed
+
+    # "parcel 8-53-094-03-225" / "meter 1609418" from the hash index
+    found = dataset.values.find_records(query)
+    if found is not None:
+        return 'lookup', record_answer(df, *found)
+    return None
+
+
+def answer_without_llm(df, query, dataset=None, cache=None):
+    """Answer from the housing counts, the intent router or the response cache
+
+    Returns None when the question has to go to the LLM.
+    """
+    local = local_answer(df, query, dataset)
+    if local is not None:
+        return _answered_by(*local)
+
+    if cache is not None and dataset is not None:
+        cached = cache.get(query, LLM_MODEL, cache_fingerprint(dataset))
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return _answered_by('cache', cached)
+    return None
+
+
+def cache_fingerprint(dataset):
+    """Response cache fingerprint: the data version, plus the backend's query language"""
+    if BACKEND_NAME == 'pandas':
+        return dataset.version
+    return f"{dataset.version}:{BACKEND_NAME}:{PARQUET_SOURCE}"
+
+
+def _answered_by(source, result):
+    annotate(source=source)
+    count('answers_total', source=source)
+    return result
+
+
+def record_usage(usage):
+    """Add the token counts of an OpenAI response to the metrics"""
+    if usage is None:
+        return
+    prompt, completion = usage.prompt_tokens or 0, usage.completion_tokens or 0
+    # Prompt tokens the provider served from its prompt cache (the stable prefix)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = (getattr(details, 'cached_tokens', None) or 0) if details is not None else 0
+    annotate(prompt_tokens=prompt, completion_tokens=completion, cached_tokens=cached)
+    count('llm_tokens_total', prompt, kind='prompt')
+    count('llm_tokens_total', completion, kind='completion')
+    count('llm_tokens_total', cached, kind='cached')
+
+
+def dataset_context(df, dataset=None, backend=None):
+    """The dataset part of the prompt; it only changes with the data version"""
+    backend = backend or get_backend(dataset)
+    if not backend.external:
+        profile = dataset.profile if dataset is not None else DatasetProfile(df)
+        return profile.context(housing_notes(dataset.housing if dataset is not None else housing_summary(df)))
+    # External Parquet data: only what the backend can tell cheaply
+    rows, columns, first_date, last_date = backend.table_info(df)
+    lines = [f"Dataset: property/land parcels in Oman, {rows:,} rows, DOC_DATE {first_date} to {last_date}. Columns:"]
+    lines.extend(f"- {col}: {COLUMN_MAPPING[col]}" if col in COLUMN_MAPPING else f"- {col}" for col in columns)
+    return '\n'.join(lines)
+
+
+@lru_cache(maxsize=16)
+def _prefix_tokens(prefix):
+    return count_tokens(prefix, LLM_MODEL)
+
+
+def chat_request(df, query, dataset=None):
+    """Build the chat.completions.create arguments for query
+
+    The system message (instructions, dataset context, query language) is the
+    same for every question on a data version, so the provider can serve it
+    from its prompt cache; the question comes last.
+    """
+    backend = get_backend(dataset)
+    prefix = f"{SYSTEM_PROMPT}\n\n{dataset_context(df, dataset, backend)}\n\n{backend.prompt_notes}"
+    question = f"Question: {query}"
+    prefix_tokens = _prefix_tokens(prefix)
+    annotate(prompt_prefix_tokens=prefix_tokens, prompt_tokens_estimate=prefix_tokens + count_tokens(question, LLM_MODEL))
+    return dict(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": prefix},
+            {"role": "user", "content": question}
+        ],
+        temperature=0,
+        response_format={"type": "json_object"}
+    )
+
+
+def execute_query(expression, df, dataset=None):
+    """Evaluate query_used with the configured backend (see query_backends)
+
+    With the pandas backend, group-by rollups come from the dataset's cube and
+    anything else is validated and run by the sandboxed query engine: in a
+    worker process when the dataset has a Parquet sidecar, otherwise in this
+    thread. SQL and Polars queries scan the Parquet files lazily. Results are
+    memoized per data version, so the same expression from any session is a
+    cache lookup.
+    """
+    with span('execute'):
+        if dataset is None:
+            return get_backend(dataset).execute(expression, df)
+        results = get_result_cache()
+        version = cache_fingerprint(dataset)
+        hit, exec_result = results.get(expression, version)
+        count('result_cache_total', outcome='hit' if hit else 'miss')
+        if not hit:
+            exec_result = get_backend(dataset).execute(expression, df)
+            results.put(expression, version, exec_result)
+        return exec_result
+
+
+def finish_result(result_text, df, dataset=None, cache=None, query=None):
+    """Parse the LLM JSON, fill the plot from the executed query_used and cache it"""
+    with span('parse'):
+        result = json.loads(result_text)
+    _answered_by('llm', result)
+
+    # Literals such as 'محافظة مسقط' are rewritten to the stored spelling (' محافظة مسقط')
+    if result.get('query_used') and dataset is not None and get_backend(dataset).language == 'pandas':
+        result['query_used'], resolved = dataset.values.rewrite(result['query_used'])
+        if resolved:
+            annotate(values_resolved=resolved)
+
+    # Execute the query if provided to get actual data
+    if 'query_used' in result and result['query_used']:
+        try:
+            exec_result = execute_query(result['query_used'], df, dataset)
+
+            # Update plot data if we got results, reduced to the plot's point budget
+            plot_type = result.get('plot', {}).get('type')
+            if plot_type not in (None, 'none') and exec_result is not None:
+                with span('plot_reduce'):
+                    plot_data = plot_data_from_result(plot_type, exec_result)
+                if plot_data is not None:
+                    result['plot'].setdefault('data', {}).update(plot_data)
+
+            # Rows stay on the server; the answer only carries their spec (see result_table)
+            if is_table(exec_result):
+                version = dataset.version if dataset is not None else None
+                result['table'] = table_spec(result['query_used'], exec_result, version)
+        except ResultTooLarge as e:
+            # The rows would be incomplete; say so rather than show part of them
+            annotate(execute_error=str(e))
+            result['answer'] = f"{result.get('answer', '')}\n\n⚠️ {e}"
+        except Exception as e:
+            # If execution fails, we still have the LLM's answer
+            annotate(execute_error=str(e))
+
+    if cache is not None and dataset is not None and query is not None:
+        with span('cache_write'):
+            cache.set(query, LLM_MODEL, cache_fingerprint(dataset), result)
+    return result
+
+
+def error_result(error):
+    """Result dict reported when a query fails"""
+    return {
+        "answer": f"Error: {str(error)}",
+        "plot": {"type": "none"},
+        "query_used": ""
+    }
+
+
+def unavailable_result(query, cache=None, error=None):
+    """Answer when the LLM is unavailable: a cached answer of an older data version, else a notice"""
+    annotate(llm_unavailable=str(error))
+    count('errors_total', stage='llm_unavailable')
+    stale = cache.get_stale(query, LLM_MODEL) if cache is not None else None
+    if stale is not None:
+        notice = "⚠️ The AI service is unavailable; this answer was computed on an earlier version of the data. / خدمة الذكاء الاصطناعي غير متاحة حالياً؛ هذه الإجابة محسوبة على نسخة سابقة من البيانات."
+        return _answered_by('stale_cache', dict(stale, answer=f"{notice}\n\n{stale.get('answer', '')}"))
+    retry_after = getattr(error, 'retry_after', None)
+    wait = f" (~{retry_after:.0f}s)" if retry_after else ""
+    return _answered_by('unavailable', {
+        "answer": f"⚠️ The AI service is unavailable right now, please try again shortly{wait}. / خدمة الذكاء الاصطناعي غير متاحة حالياً، يرجى المحاولة بعد قليل{wait}.",
+        "plot": {"type": "none"},
+        "query_used": "",
+    })
+
+
+def query_data_with_llm(df, query, api_key, dataset=None, cache=None, on_answer=None):
+    """Query data using OpenAI with structured JSON output for visualization
+
+    dataset is the data_store.Dataset that df belongs to. Its precomputed
+    housing counts, intent router and aggregate cube answer common questions
+    and group-bys locally. With a ResponseCache, repeated questions skip OpenAI.
+    If on_answer is given the completion is streamed and on_answer is called
+    with the answer text so far each time it grows. Each call is recorded as
+    a metrics trace.
+    """
+    with trace('query', query=query, streamed=on_answer is not None):
+        try:
+            with span('local_answer'):
+                local = answer_without_llm(df, query, dataset, cache)
+            if local is not None:
+                return local
+
+            return llm_answer(df, query, api_key, dataset, cache, on_answer)
+
+        except LLMUnavailable as e:
+            return unavailable_result(query, cache, e)
+        except Exception as e:
+            annotate(error=str(e))
+            count('errors_total', stage='query')
+            return error_result(e)
+
+
+def llm_answer(df, query, api_key, dataset=None, cache=None, on_answer=None):
+    """Ask OpenAI, execute its query_used and cache the result (no local answers)
+
+    Comparison questions are offered the planner's run_subqueries tool; such
+    a request is not streamed, since the answer is assembled from the parts.
+    """
+    client = get_client(api_key)
+    with span('prompt_build'):
+        request = chat_request(df, query, dataset)
+        planned = wants_plan(query, dataset)
+        if planned:
+            request = plan_request(request)
+
+    # Call OpenAI
+    with span('llm_call'):
+        if on_answer is None or planned:
+            response = get_caller().call(client.chat.completions.create, **request)
+            message = response.choices[0].message
+            result_text = message.content
+            record_usage(getattr(response, 'usage', None))
+        else:
+            result_text = stream_completion(client, request, on_answer)
+
+    plan = tool_plan(message) if planned else None
+    if plan is not None:
+        return finish_plan(plan, df, dataset, cache, query)
+    return finish_result(result_text, df, dataset, cache, query)
+
+
+def wants_plan(query, dataset=None):
+    """Whether to offer the LLM the sub-query planner for this question"""
+    # The merged query_used is a pandas expression
+    return DECOMPOSE_QUESTIONS and is_compound(query) and get_backend(dataset).language == 'pandas'
+
+
+def finish_plan(plan, df, dataset=None, cache=None, query=None):
+    """Run the parts of a run_subqueries plan in parallel, merge and cache the result"""
+    _answered_by('plan', plan)
+    if dataset is not None:
+        for part in plan['parts']:
+            part['query'], _ = dataset.values.rewrite(part['query'])
+    with span('execute_plan'):
+        outcomes = run_plan(plan, lambda expression: execute_query(expression, df, dataset))
+    result = merge_plan(plan, outcomes)
+    annotate(subqueries=len(outcomes), subquery_errors=sum(error is not None for *_, error in outcomes))
+
+    if cache is not None and dataset is not None and query is not None:
+        with span('cache_write'):
+            cache.set(query, LLM_MODEL, cache_fingerprint(dataset), result)
+    return result
+
+
+def stream_completion(client, request, on_answer):
+    """Stream the completion, calling on_answer as the answer text grows"""
+    # "answer" is the first key, so it can be shown before plot/query_used arrive
+    parser = AnswerStreamParser()
+    start = time.perf_counter()
+    first_token = True
+    # Only opening the stream is retried; the answer may already be on screen after that
+    stream = get_caller().call(
+        client.chat.completions.create, stream=True, stream_options={"include_usage": True}, **request
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first_token:
+                observe('llm_first_token', time.perf_counter() - start)
+                first_token = False
+            answer = parser.feed(chunk.choices[0].delta.content)
+            if answer is not None:
+                on_answer(answer)
+        # With include_usage the last chunk has no choices and carries the token counts
+        record_usage(getattr(chunk, 'usage', None))
+    return parser.text
+
+
+async def aquery_data_with_llm(df, query, client, dataset=None, cache=None):
+    """Async query_data_with_llm over a shared openai.AsyncOpenAI client
+
+    The pandas work runs in a worker thread so concurrent queries are not
+    blocked behind it on the event loop.
+    """
+    with trace('query', query=query, streamed=False):
+        try:
+            with span('local_answer'):
+                local = await asyncio.to_thread(answer_without_llm, df, query, dataset, cache)
+            if local is not None:
+                return local
+
+            with span('prompt_build'):
+                request = await asyncio.to_thread(chat_request, df, query, dataset)
+                planned = wants_plan(query, dataset)
+                if planned:
+                    request = plan_request(request)
+            with span('llm_call'):
+                response = await get_caller().acall(client.chat.completions.create, **request)
+            message = response.choices[0].message
+            record_usage(getattr(response, 'usage', None))
+            plan = tool_plan(message) if planned else None
+            if plan is not None:
+                return await asyncio.to_thread(finish_plan, plan, df, dataset, cache, query)
+            return await asyncio.to_thread(finish_result, message.content, df, dataset, cache, query)
+
+        except LLMUnavailable as e:
+            return await asyncio.to_thread(unavailable_result, query, cache, e)
+        except Exception as e:
+            annotate(error=str(e))
+            count('errors_total', stage='query')
+            return error_result(e)
@@ -0,0 +1,74 @@
+"""
+Incremental parsing of the streamed JSON answer from the LLM
+
+The model replies with a JSON object whose "answer" string comes first. The
+parser pulls that string out of the partial JSON as tokens arrive, so the UI
+can render the answer before the plot and query_used parts are complete.
+"""
+
+import re
+
+_ANSWER_KEY = re.compile(r'"answer"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class AnswerStreamParser:
+    """Accumulate streamed JSON text and decode the "answer" value incrementally"""
+
+    def __init__(self):
+        self.text = ''
+        self.answer = ''
+        self.answer_complete = False
+        self._pos = None
+
+    def feed(self, delta):
+        """Add a chunk of text; return the answer so far if it grew, else None"""
+        self.text += delta
+        if self.answer_complete:
+            return None
+        if self._pos is None:
+            match = _ANSWER_KEY.search(self.text)
+            if match is None:
+                return None
+            self._pos = match.end()
+
+        decoded = []
+        pos, text = self._pos, self.text
+        while pos < len(text):
+            char = text[pos]
+            if char == '"':
+                self.answer_complete = True
+                pos += 1
+                break
+            if char != '\\':
+                decoded.append(char)
+                pos += 1
+                continue
+            # Escape sequence - wait for the rest of it if it is split across chunks
+            if pos + 1 >= len(text):
+                break
+            code = text[pos + 1]
+            if code == 'u':
+                if pos + 6 > len(text):
+                    break
+                code_point = int(text[pos + 2:pos + 6], 16)
+                length = 6
+                # Characters outside the BMP arrive as an escaped surrogate pair
+                if 0xD800 <= code_point < 0xDC00:
+                    if pos + 12 > len(text):
+                        break
+                    low = text[pos + 6:pos + 12]
+                    if low.startswith('\\u') and 0xDC00 <= int(low[2:], 16) < 0xE000:
+                        code_point = 0x10000 + ((code_point - 0xD800) << 10) + int(low[2:], 16) - 0xDC00
+                        length = 12
+                decoded.append(chr(code_point))
+                pos += length
+            else:
+                decoded.append(_ESCAPES.get(code, code))
+                pos += 2
+
+        self._pos = pos
+        if not decoded:
+            return None
+        self.answer += ''.join(decoded)
+        return self.answer
@@ -0,0 +1,238 @@
+"""
+Per-stage latency spans, counters and their export
+
+Code is timed with `span('stage')` blocks. A `trace(...)` block groups the
+spans of one question; the finished trace is appended to a JSONL file when
+METRICS_TRACE_PATH is set (it holds the raw questions, so it is opt-in, and is
+rotated to a single .1 file past METRICS_TRACE_MB). Every
+span also feeds a process-wide registry. The registry keeps a window of recent
+samples per stage for p50/p95/p99 and can be rendered as Prometheus text or
+served over HTTP at /metrics.
+"""
+
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# JSONL file receiving one record per finished trace (off by default)
+TRACE_PATH = os.getenv("METRICS_TRACE_PATH", "")
+# Size at which the trace file is moved to <path>.1 and started afresh
+TRACE_MAX_BYTES = int(float(os.getenv("METRICS_TRACE_MB", "50")) * 1024 * 1024)
+
+# Recent samples kept per stage for the quantiles
+SAMPLE_WINDOW = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "chatbot"
+
+_current = contextvars.ContextVar('metrics_trace', default=None)
+
+
+class Trace:
+    """Spans and attributes recorded while answering one question"""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.started = time.time()
+        self._start = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            'trace': self.name,
+            'time': round(self.started, 3),
+            'seconds': round(self.elapsed(), 6),
+            **self.attrs,
+            'spans': self.spans,
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe stage timings and counters for this process"""
+
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._totals = {}
+        self._counters = {}
+
+    def observe(self, stage, seconds):
+        """Record one duration for stage"""
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(seconds)
+            count, total = self._totals.get(stage, (0, 0.0))
+            self._totals[stage] = (count + 1, total + seconds)
+
+    def count(self, name, value=1, **labels):
+        """Add value to the counter name{labels}"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        """Drop every sample and counter"""
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+    def summary(self):
+        """Return {stage: {'count', 'mean', 'p50', 'p95', 'p99'}} over the sample window"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            totals = dict(self._totals)
+        result = {}
+        for stage, values in samples.items():
+            count, total = totals[stage]
+            result[stage] = {
+                'count': count,
+                'mean': total / count,
+                **{f'p{int(q * 100)}': _quantile(values, q) for q in QUANTILES},
+            }
+        return result
+
+    def counters(self):
+        """Return {(name, labels): value}"""
+        with self._lock:
+            return dict(self._counters)
+
+    def prometheus_text(self):
+        """Render the stage timings and counters in the Prometheus text format"""
+        metric = f'{METRIC_PREFIX}_stage_seconds'
+        lines = [
+            f'# HELP {metric} Time spent in each stage of answering a question',
+            f'# TYPE {metric} summary',
+        ]
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            totals = dict(self._totals)
+            counters = dict(self._counters)
+        for stage in sorted(samples):
+            for q in QUANTILES:
+                lines.append(f'{metric}{{stage="{stage}",quantile="{q}"}} {_quantile(samples[stage], q):.6f}')
+            count, total = totals[stage]
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {count}')
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} counter')
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    lines.append(f'{METRIC_PREFIX}_{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _quantile(sorted_values, q):
+    # Nearest-rank quantile of an already sorted list
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+_trace_lock = threading.Lock()
+
+
+def current_trace():
+    """Return the Trace being recorded in this context, if any"""
+    return _current.get()
+
+
+def annotate(**attrs):
+    """Set attributes (source, token counts, errors...) on the current trace"""
+    active = _current.get()
+    if active is not None:
+        active.attrs.update(attrs)
+
+
+def count(name, value=1, **labels):
+    """Add value to a process-wide counter"""
+    registry.count(name, value, **labels)
+
+
+def observe(stage, seconds):
+    """Record a duration measured elsewhere (e.g. time to first token)"""
+    registry.observe(stage, seconds)
+    active = _current.get()
+    if active is not None:
+        active.spans.append({'stage': stage, 'seconds': round(seconds, 6)})
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Group the spans of one question; the trace is written when the block ends"""
+    active = Trace(name, **attrs)
+    token = _current.set(active)
+    try:
+        yield active
+    finally:
+        _current.reset(token)
+        registry.observe(name, active.elapsed())
+        write_trace(active)
+
+
+def write_trace(active, path=None, max_bytes=TRACE_MAX_BYTES):
+    """Append a finished trace to the JSONL trace file, rotating it past max_bytes"""
+    path = TRACE_PATH if path is None else path
+    if not path:
+        return
+    line = json.dumps(active.to_dict(), ensure_ascii=False, default=str)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with _trace_lock:
+            if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+                os.replace(path, f"{path}.1")
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    except OSError:
+        pass
+
+
+def serve_metrics(port, host='127.0.0.1'):
+    """Serve registry.prometheus_text() at http://host:port/metrics in a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
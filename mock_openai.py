@@ -0,0 +1,299 @@
+"""
+Local stand-in for the OpenAI chat completions API
+
+Serves POST /v1/chat/completions with canned JSON answers in the app's
+answer/plot/query_used format, after a configurable latency. Requests that
+offer tools get a call of the first tool with a canned plan. Streaming
+(stream=True, with stream_options.include_usage) is supported, so the app,
+the batch runner and the benchmark can run offline by pointing
+OPENAI_BASE_URL at it. Faults can be injected to exercise the retries and the
+circuit breaker of llm_client: a share of requests fails with an HTTP error
+(429 and 503 carry Retry-After) and a share is answered slow_ms late.
+
+Usage:
+    python mock_openai.py --port 8765 --latency-ms 400 --jitter-ms 100
+    python mock_openai.py --error-rate 0.3 --error-status 503 --slow-rate 0.05 --slow-ms 5000
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test streamlit run app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# (plot type, query_used) pairs; the question's hash picks one
+CANNED_QUERIES = [
+    ('bar', "df['REGN'].value_counts()"),
+    ('bar', "df.groupby('WLYA')['PAR_AREA'].sum().sort_values(ascending=False).head(10)"),
+    ('none', "df[df['PAR_AREA'] > 1000].shape[0]"),
+    ('bar', "df[df['PUSE'] == 'سكني']['WLYA'].value_counts().head(10)"),
+    ('line', "df.groupby(df['DOC_DATE'].dt.month).size()"),
+    ('pie', "df['HOUSING_STATUS'].value_counts()"),
+    ('none', "df['PAR_AREA'].mean()"),
+    ('bar', "df.groupby('REGN')['PAR_AREA'].mean()"),
+    ('bar', "df[df['YR'] == 2024]['PUSE'].value_counts()"),
+]
+
+
+def _question(messages):
+    # The app puts the question after "Question:" in the last user message
+    text = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+    for line in text.splitlines():
+        if line.startswith('Question:'):
+            return line[len('Question:'):].strip()
+    return text.strip()
+
+
+# run_subqueries arguments returned when the request offers tools (the planner)
+CANNED_PLAN = {
+    'summary': 'Mock comparison',
+    'plot_type': 'bar',
+    'title': 'Residential vs social housing / سكني مقابل مسكن اجتماعي',
+    'parts': [
+        {'label': 'سكني', 'query': "len(df[df['PUSE'] == 'سكني'])"},
+        {'label': 'مسكن اجتماعي', 'query': "len(df[df['PUSE'] == 'مسكن اجتماعي'])"},
+    ],
+}
+
+
+def canned_answer(question):
+    """Return the JSON answer text for question (deterministic per question)"""
+    digest = hashlib.sha256(question.encode('utf-8')).digest()
+    plot_type, query_used = CANNED_QUERIES[digest[0] % len(CANNED_QUERIES)]
+    plot = {'type': 'none'}
+    if plot_type != 'none':
+        plot = {
+            'type': plot_type,
+            'data': {'x': [], 'y': [], 'title': question[:60], 'xlabel': '', 'ylabel': ''},
+        }
+    answer = {
+        'answer': f"Mock answer for: {question}",
+        'plot': plot,
+        'query_used': query_used,
+    }
+    return json.dumps(answer, ensure_ascii=False)
+
+
+def _tokens(text):
+    # Rough token count (about 4 characters per token)
+    return max(1, len(text) // 4)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """HTTP server answering chat completions after latency_ms (+ random jitter_ms)
+
+    error_rate of the requests fail with error_status, and slow_rate of them
+    take slow_ms longer.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=300, jitter_ms=0, tokens_per_second=0, seed=None,
+                 error_rate=0.0, error_status=503, slow_rate=0.0, slow_ms=0):
+        super().__init__(address, MockOpenAIHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            self.requests += 1
+            jitter = self.random.uniform(0, self.jitter_ms)
+            slow = self.slow_ms if self.random.random() < self.slow_rate else 0
+        return (self.latency_ms + jitter + slow) / 1000
+
+    def fault(self):
+        """The HTTP status to fail this request with, or None"""
+        with self._lock:
+            if self.random.random() >= self.error_rate:
+                return None
+            self.errors += 1
+        return self.error_status
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        messages = request.get('messages', [])
+        content = canned_answer(_question(messages))
+        usage = {
+            'prompt_tokens': _tokens(''.join(m.get('content', '') for m in messages)),
+            'completion_tokens': _tokens(content),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        model = request.get('model', 'gpt-4o-mini')
+
+        time.sleep(self.server.delay())
+        status = self.server.fault()
+        if status is not None:
+            self._error(status)
+            return
+        if request.get('tools'):
+            self._tool_call(request['tools'][0]['function']['name'], model, usage)
+            return
+        if request.get('stream'):
+            include_usage = (request.get('stream_options') or {}).get('include_usage', False)
+            self._stream(content, model, usage if include_usage else None)
+            return
+        self._send_json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        })
+
+    def _error(self, status):
+        """An OpenAI-style error response (429 and 503 ask the client to retry after 1s)"""
+        body = json.dumps({'error': {'message': f"Injected error {status}", 'type': 'server_error'}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status in (429, 503):
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _tool_call(self, name, model, usage):
+        """Answer with a call of the first offered tool (the canned plan)"""
+        self._send_json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {
+                    'role': 'assistant',
+                    'content': None,
+                    'tool_calls': [{
+                        'id': f"call_{uuid.uuid4().hex[:24]}",
+                        'type': 'function',
+                        'function': {'name': name, 'arguments': json.dumps(CANNED_PLAN, ensure_ascii=False)},
+                    }],
+                },
+                'finish_reason': 'tool_calls',
+            }],
+            'usage': usage,
+        })
+
+    def _stream(self, content, model, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def event(choices, usage=None):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': choices,
+            }
+            if usage is not None:
+                chunk['usage'] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        # About one token (4 characters) per chunk
+        pause = 1 / self.server.tokens_per_second if self.server.tokens_per_second else 0
+        for i in range(0, len(content), 4):
+            event([{'index': 0, 'delta': {'content': content[i:i + 4]}, 'finish_reason': None}])
+            if pause:
+                time.sleep(pause)
+        event([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if usage is not None:
+            event([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(port=0, host='127.0.0.1', latency_ms=300, jitter_ms=0, tokens_per_second=0, seed=None, **faults):
+    """Start a MockOpenAIServer in a daemon thread and return it (port=0 picks a free port)
+
+    faults are MockOpenAIServer's error_rate, error_status, slow_rate and slow_ms.
+    """
+    server = MockOpenAIServer((host, port), latency_ms, jitter_ms, tokens_per_second, seed, **faults)
+    threading.Thread(target=server.serve_forever, name='mock-openai', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible mock server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=300, help="delay before each response")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="extra random delay, uniform in [0, jitter]")
+    parser.add_argument('--tokens-per-second', type=float, default=0, help="streaming speed (0 = no pacing)")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--error-rate', type=float, default=0, help="share of requests that fail")
+    parser.add_argument('--error-status', type=int, default=503, help="HTTP status of the failures (e.g. 429, 500, 503)")
+    parser.add_argument('--slow-rate', type=float, default=0, help="share of requests answered --slow-ms late")
+    parser.add_argument('--slow-ms', type=float, default=0, help="extra delay of the slow requests")
+    args = parser.parse_args(argv)
+
+    server = MockOpenAIServer(
+        (args.host, args.port), args.latency_ms, args.jitter_ms, args.tokens_per_second, args.seed,
+        error_rate=args.error_rate, error_status=args.error_status, slow_rate=args.slow_rate, slow_ms=args.slow_ms,
+    )
+    print(f"Mock OpenAI API at {server.base_url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
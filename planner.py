@@ -0,0 +1,203 @@
+"""
+Decomposition of compound and comparison questions into parallel sub-queries
+
+"Compare the number of properties across regions" or "difference between
+residential and social housing" need several aggregates, which a single
+query_used expression often cannot express. For such questions the LLM is
+offered a run_subqueries tool. When it calls it, each part's query runs on
+its own thread against the dataset (through the result cache, the cube and
+the query engine), so the parts take as long as the slowest one. The answers
+are merged into one result: a line per part, the difference of two numbers,
+one combined plot, and a single query_used that recomputes every part.
+"""
+
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from intent_router import tokenize
+from metrics import count, span
+from plot_reduce import reduce_plot_data
+
+# Sub-queries run at once for one question
+PLAN_WORKERS = int(os.getenv("PLAN_WORKERS", "4"))
+MAX_PARTS = 8
+
+# Words that make a question a comparison worth decomposing
+COMPARE_WORDS = set(tokenize(
+    'قارن مقارنة قارن بين الفرق فرق مقابل بين compare comparison difference versus vs between'
+))
+
+PLAN_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "run_subqueries",
+        "description": (
+            "Use instead of the JSON answer when the question compares or combines several "
+            "quantities (e.g. residential vs social housing, counts in several regions). "
+            "Give one independent query per quantity; they run in parallel and are merged."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "summary": {"type": "string", "description": "One sentence introducing the results, in the question's language"},
+                "plot_type": {"type": "string", "enum": ["bar", "pie", "none"]},
+                "title": {"type": "string", "description": "Chart title (bilingual if possible)"},
+                "parts": {
+                    "type": "array",
+                    "minItems": 2,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "label": {"type": "string", "description": "Short label of the quantity, e.g. سكني"},
+                            "query": {"type": "string", "description": "One pandas expression over df computing it"},
+                        },
+                        "required": ["label", "query"],
+                    },
+                },
+            },
+            "required": ["parts"],
+        },
+    },
+}
+
+
+def is_compound(query):
+    """Whether a question compares or combines several quantities"""
+    return bool(set(tokenize(query)) & COMPARE_WORDS)
+
+
+def plan_request(request):
+    """The chat request with the run_subqueries tool offered"""
+    return dict(request, tools=[PLAN_TOOL], tool_choice="auto")
+
+
+def tool_plan(message):
+    """The run_subqueries arguments of an LLM message, or None if it answered directly"""
+    for call in getattr(message, 'tool_calls', None) or []:
+        if call.function.name != PLAN_TOOL['function']['name']:
+            continue
+        plan = json.loads(call.function.arguments or '{}')
+        parts = [part for part in plan.get('parts') or [] if part.get('query')]
+        if len(parts) >= 2:
+            plan['parts'] = parts[:MAX_PARTS]
+            return plan
+    return None
+
+
+def run_plan(plan, execute, workers=PLAN_WORKERS):
+    """Run execute(query) for every part in parallel
+
+    Returns [(label, query, result, error)] in the plan's order. Each task
+    runs in a copy of the caller's context, so its spans join the question's
+    trace.
+    """
+    parts = plan['parts']
+
+    def run(part):
+        with span('subquery'):
+            try:
+                return execute(part['query']), None
+            except Exception as e:
+                count('errors_total', stage='subquery')
+                return None, str(e)
+
+    with ThreadPoolExecutor(max(1, min(workers, len(parts))), thread_name_prefix='subquery') as pool:
+        futures = [pool.submit(contextvars.copy_context().run, run, part) for part in parts]
+        outcomes = [future.result() for future in futures]
+    return [
+        (part.get('label') or part['query'], part['query'], result, error)
+        for part, (result, error) in zip(parts, outcomes)
+    ]
+
+
+def _scalar(value):
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        if value.size != 1:
+            return None
+        value = value.to_numpy().ravel()[0]
+    value = value.item() if hasattr(value, 'item') else value
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _format(value):
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.2f}"
+    return f"{value:,.0f}"
+
+
+def _describe(result):
+    scalar = _scalar(result)
+    if scalar is not None:
+        return _format(scalar)
+    if isinstance(result, pd.DataFrame) and result.shape[1] == 1:
+        result = result.iloc[:, 0]
+    if isinstance(result, pd.Series):
+        items = [f"{str(key).strip()}: {_format(value) if _scalar(value) is not None else value}"
+                 for key, value in result.head(5).items()]
+        more = f" (+{len(result) - 5:,} more)" if len(result) > 5 else ""
+        return ', '.join(items) + more
+    return str(result)
+
+
+def _literal(label):
+    return repr(str(label))
+
+
+def merge_plan(plan, outcomes):
+    """Combine the parts' results into one answer/plot/query_used result dict"""
+    lines = [plan['summary']] if plan.get('summary') else []
+    scalars = {}
+    series = {}
+    for label, query, result, error in outcomes:
+        if error is not None:
+            lines.append(f"- {label}: could not be computed / تعذر الحساب ({error})")
+            continue
+        lines.append(f"- {label}: {_describe(result)}")
+        scalar = _scalar(result)
+        if scalar is not None:
+            scalars[label] = scalar
+        elif isinstance(result, pd.Series):
+            series[label] = result
+    if len(scalars) == 2 and len(outcomes) == 2:
+        (first, a), (second, b) = scalars.items()
+        lines.append(f"Difference / الفرق ({first} - {second}): {_format(a - b)}")
+
+    plot = {"type": "none"}
+    plot_type = plan.get('plot_type') or 'bar'
+    if plot_type != 'none' and len(scalars) >= 2:
+        data = {'x': list(scalars), 'y': list(scalars.values())}
+    elif plot_type != 'none' and series:
+        # One bar per (part, category), e.g. each region's count for residential and social housing
+        data = {
+            'x': [f"{str(key).strip()} ({label})" for label, values in series.items() for key in values.index],
+            'y': [value for values in series.values() for value in values.tolist()],
+        }
+    else:
+        data = None
+    if data is not None:
+        data = reduce_plot_data(plot_type, data)
+        data.update(title=plan.get('title', ''), xlabel='', ylabel='')
+        plot = {"type": plot_type, "data": data}
+
+    # One expression recomputing every part, so the API / batch runner can return the table
+    if all(_scalar(result) is not None for _, _, result, error in outcomes if error is None):
+        pairs = ', '.join(f"{_literal(label)}: {query}" for label, query, _, _ in outcomes)
+        query_used = f"pd.Series({{{pairs}}})"
+    else:
+        # pd.concat takes no scalars: a scalar part becomes a one-row Series under its label
+        pairs = ', '.join(
+            f"{_literal(label)}: "
+            + (f"pd.Series({{{_literal(label)}: {query}}})" if _scalar(result) is not None else query)
+            for label, query, result, _ in outcomes
+        )
+        query_used = f"pd.concat({{{pairs}}}, axis=1)"
+    return {
+        "answer": '\n'.join(lines),
+        "plot": plot,
+        "query_used": query_used,
+        "parts": [{'label': label, 'query': query, 'error': error} for label, query, _, error in outcomes],
+    }
@@ -0,0 +1,158 @@
+"""
+Reduce plot data to a point budget before it reaches the browser
+
+A query_used result can have tens of thousands of entries (e.g. every parcel
+area). Sending all of them to Plotly freezes the chart, so plot data is
+reduced on the server first:
+  - histogram: values are binned into at most PLOT_HISTOGRAM_BINS bars
+  - line: LTTB downsampling to PLOT_MAX_LINE_POINTS
+  - bar / pie: the largest categories plus one "Other" bucket
+  - scatter: WebGL (Scattergl) above PLOT_WEBGL_POINTS, sampled above
+    PLOT_MAX_SCATTER_POINTS
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+MAX_LINE_POINTS = int(os.getenv("PLOT_MAX_LINE_POINTS", "2000"))
+MAX_BARS = int(os.getenv("PLOT_MAX_BARS", "30"))
+MAX_PIE_SLICES = int(os.getenv("PLOT_MAX_PIE_SLICES", "10"))
+HISTOGRAM_BINS = int(os.getenv("PLOT_HISTOGRAM_BINS", "50"))
+WEBGL_POINTS = int(os.getenv("PLOT_WEBGL_POINTS", "2000"))
+MAX_SCATTER_POINTS = int(os.getenv("PLOT_MAX_SCATTER_POINTS", "20000"))
+
+OTHER_LABEL = "Other / أخرى"
+
+
+def bin_values(values, bins=HISTOGRAM_BINS):
+    """Histogram values into {'x': bin centers, 'y': counts, 'width': bin width}"""
+    numbers = pd.to_numeric(pd.Series(values), errors='coerce').dropna().to_numpy(dtype='float64')
+    if len(numbers) == 0:
+        return {'x': [], 'y': [], 'binned': True}
+    low, high = numbers.min(), numbers.max()
+    if low == high:
+        return {'x': [float(low)], 'y': [len(numbers)], 'width': 1.0, 'binned': True}
+    # Clip the long tail (areas go up to ~80,000 m2) so the bins show the bulk of the data
+    high = min(high, np.percentile(numbers, 99.5))
+    counts, edges = np.histogram(numbers, bins=bins, range=(low, high))
+    counts[-1] += int((numbers > high).sum())
+    centers = (edges[:-1] + edges[1:]) / 2
+    return {
+        'x': np.round(centers, 2).tolist(),
+        'y': counts.tolist(),
+        'width': float(edges[1] - edges[0]),
+        'binned': True,
+    }
+
+
+def lttb(x, y, threshold=MAX_LINE_POINTS):
+    """Largest-Triangle-Three-Buckets downsampling; returns the kept indices"""
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype='float64')
+    x = _numeric_positions(x, n)
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    # Inner points are split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        if i + 2 < len(edges):
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        bucket_x, bucket_y = x[start:end], y[start:end]
+        areas = np.abs(
+            (x[previous] - next_x) * (bucket_y - y[previous])
+            - (x[previous] - bucket_x) * (next_y - y[previous])
+        )
+        previous = start + int(np.nanargmax(areas)) if np.isfinite(areas).any() else start
+        kept[i + 1] = previous
+    return kept
+
+
+def _numeric_positions(x, n):
+    # Numbers and dates keep their spacing; anything else is evenly spaced
+    series = pd.Series(x)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype='float64')
+    dates = pd.to_datetime(series, errors='coerce')
+    if dates.notna().all():
+        return dates.astype('int64').to_numpy(dtype='float64')
+    return np.arange(n, dtype='float64')
+
+
+def top_n(x, y, limit):
+    """Keep the limit - 1 largest categories (in their order) and sum the rest as Other"""
+    if len(x) <= limit:
+        return {'x': list(x), 'y': list(y)}
+    values = pd.to_numeric(pd.Series(y), errors='coerce').fillna(0)
+    keep = set(values.nlargest(limit - 1).index)
+    kept_x = [label for i, label in enumerate(x) if i in keep]
+    kept_y = [value for i, value in enumerate(values.tolist()) if i in keep]
+    other = values[[i not in keep for i in range(len(values))]].sum()
+    return {'x': kept_x + [OTHER_LABEL], 'y': kept_y + [other.item()]}
+
+
+def reduce_plot_data(plot_type, data):
+    """Return a copy of plot data ({'x', 'y', ...}) reduced to its point budget"""
+    data = dict(data)
+    x, y = list(data.get('x') or []), list(data.get('y') or [])
+    size = max(len(x), len(y))
+
+    if plot_type == 'histogram':
+        if not data.get('binned') and len(x) > HISTOGRAM_BINS:
+            data.update(bin_values(x))
+    elif plot_type == 'line' and len(x) == len(y) > MAX_LINE_POINTS:
+        keep = lttb(x, y)
+        data['x'] = [x[i] for i in keep]
+        data['y'] = [y[i] for i in keep]
+    elif plot_type in ('bar', 'pie') and len(x) == len(y):
+        data.update(top_n(x, y, MAX_PIE_SLICES if plot_type == 'pie' else MAX_BARS))
+    elif plot_type == 'scatter' and len(x) == len(y):
+        if size > MAX_SCATTER_POINTS:
+            keep = np.linspace(0, size - 1, MAX_SCATTER_POINTS).astype(np.int64)
+            data['x'] = [x[i] for i in keep]
+            data['y'] = [y[i] for i in keep]
+        data['webgl'] = size > WEBGL_POINTS
+
+    if max(len(data.get('x') or []), len(data.get('y') or [])) < size:
+        data['reduced_from'] = size
+    return data
+
+
+def plot_data_from_result(plot_type, result):
+    """x/y plot data for an executed query_used result (Series or one-column DataFrame)
+
+    Returns None when the result cannot be plotted as x/y.
+    """
+    if isinstance(result, pd.DataFrame) and result.shape[1] == 1:
+        result = result.iloc[:, 0]
+    if not isinstance(result, pd.Series):
+        return None
+    if plot_type == 'histogram':
+        if pd.api.types.is_numeric_dtype(result):
+            # The values are the samples to bin (e.g. df['PAR_AREA'])
+            data = bin_values(result.to_numpy())
+        else:
+            # Categorical samples: one bar per value
+            counts = result.value_counts()
+            data = top_n(counts.index.tolist(), counts.tolist(), MAX_BARS)
+            data['binned'] = True
+        data['reduced_from'] = len(result)
+        return data
+    if plot_type == 'line' and len(result) > MAX_LINE_POINTS and not result.index.is_monotonic_increasing:
+        try:
+            result = result.sort_index()
+        except TypeError:
+            pass
+    index = result.index.astype(str) if isinstance(result.index, pd.PeriodIndex) else result.index
+    data = {'x': index.tolist(), 'y': result.tolist()}
+    return reduce_plot_data(plot_type, data)
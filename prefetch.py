@@ -0,0 +1,181 @@
+"""
+Background prefetch of the answers to the sidebar example questions
+
+The example buttons are the most clicked entry points. When a data version is
+first served, a background thread answers every example question that is not
+answered locally (housing counts, intent router, lookups) or already cached,
+and stores the answer and plot spec in the shared ResponseCache. A click on an
+example is then a cache hit for every session. Answers are cached per data
+version, so a new version (e.g. a merged delta file) starts a new prefetch.
+
+Usage:
+    python prefetch.py --data data.xlsx
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+from llm_cache import ResponseCache
+from llm_query import LLM_MODEL, cache_fingerprint, llm_answer, local_answer
+from metrics import annotate, count, trace
+
+# Prefetch the example answers when a data version is first served ('0' disables it)
+PREFETCH_EXAMPLES = os.getenv("PREFETCH_EXAMPLES", "1") != "0"
+
+# Example questions for users - Updated with housing questions
+EXAMPLE_QUESTIONS = {
+    "أسئلة الإسكان الرئيسية": [
+        "عدد الأراضي الموزعة التي تم إسكانها",
+        "عدد الأراضي الموزعة التي لم يتم البدء في العمل فيها (بناء المساكن)",
+        "عدد الأراضي الموزعة التي لم يكتمل العمل فيها (تم البدء بالبناء ولم يتم الانتهاء)"
+    ],
+    "إحصائيات عامة": [
+        "كم عدد السجلات الإجمالي في البيانات؟",
+        "ما متوسط مساحة القطع؟",
+        "أظهر التوزيع حسب المنطقة"
+    ],
+    "استعلامات محددة": [
+        "كم عدد العقارات في محافظة مسقط؟",
+        "ما إجمالي مساحة العقارات السكنية؟",
+        "أظهر العقارات التي مساحتها أكبر من 1000 متر مربع"
+    ],
+    "تحليل زمني": [
+        "كم عدد العقارات المسجلة في 2024؟",
+        "أظهر اتجاه التسجيلات عبر الزمن",
+        "ما التوزيع حسب السنة؟"
+    ],
+    "مقارنات": [
+        "قارن عدد العقارات في المناطق المختلفة",
+        "ما الفرق بين عدد المساكن السكنية والمساكن الاجتماعية؟"
+    ]
+}
+
+
+def example_questions():
+    """Every example question, in sidebar order"""
+    return [question for questions in EXAMPLE_QUESTIONS.values() for question in questions]
+
+
+class Prefetcher:
+    """Answers questions for one dataset version into the response cache in a thread
+
+    outcomes maps each finished question to 'local' (answered without the
+    LLM on every click anyway), 'cached', 'fetched' or 'error'.
+    """
+
+    def __init__(self, dataset, api_key, cache, questions=None):
+        self.dataset = dataset
+        self.api_key = api_key
+        self.cache = cache
+        self.questions = list(questions) if questions is not None else example_questions()
+        self.outcomes = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def prefetch(self, question):
+        """Make sure question can be answered without a round trip, returning the outcome"""
+        dataset = self.dataset
+        if local_answer(dataset.df, question, dataset) is not None:
+            return 'local'
+        # contains() rather than get(): a prefetch is not counted as a cache hit or miss
+        if self.cache.contains(question, LLM_MODEL, cache_fingerprint(dataset)):
+            return 'cached'
+        with trace('prefetch', query=question):
+            try:
+                llm_answer(dataset.df, question, self.api_key, dataset, self.cache)
+            except Exception as e:
+                annotate(error=str(e))
+                raise
+        return 'fetched'
+
+    def run(self):
+        """Prefetch every question (stopping early if stop() is called)"""
+        self.started = self.started or time.time()
+        for question in self.questions:
+            if self._stop.is_set():
+                break
+            try:
+                outcome = self.prefetch(question)
+            except Exception as e:
+                outcome = 'error'
+                self.errors[question] = str(e)
+                count('errors_total', stage='prefetch')
+            self.outcomes[question] = outcome
+            count('prefetch_total', outcome=outcome)
+        self.finished = time.time()
+        return self
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self.run, name='prefetch-examples', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        """Wait for the prefetch to finish; True if it has"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.finished is not None
+
+    def progress(self):
+        """Return {'done', 'total', 'ready', 'errors', 'running', 'seconds'}"""
+        outcomes = list(self.outcomes.values())
+        end = self.finished or time.time()
+        return {
+            'done': len(outcomes),
+            'total': len(self.questions),
+            'ready': sum(outcome != 'error' for outcome in outcomes),
+            'errors': outcomes.count('error'),
+            'running': self.started is not None and self.finished is None,
+            'seconds': round(end - self.started, 1) if self.started else 0.0,
+        }
+
+
+_prefetchers = {}
+_prefetchers_lock = threading.Lock()
+
+
+def start_prefetch(dataset, api_key, cache, questions=None):
+    """Start prefetching for a dataset version, stopping the one for an older version"""
+    with _prefetchers_lock:
+        previous = _prefetchers.pop(dataset.source, None)
+        if previous is not None:
+            previous.stop()
+        prefetcher = _prefetchers[dataset.source] = Prefetcher(dataset, api_key, cache, questions)
+    return prefetcher.start()
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    from data_store import load_dataset
+
+    parser = argparse.ArgumentParser(description="Answer the example questions into the response cache")
+    parser.add_argument('--data', default='data.xlsx', help="dataset (default: data.xlsx)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        print("OPENAI_API_KEY is not set", file=sys.stderr)
+        return 1
+    prefetcher = Prefetcher(load_dataset(args.data), api_key, ResponseCache()).run()
+    for question, outcome in prefetcher.outcomes.items():
+        error = prefetcher.errors.get(question)
+        print(f"{outcome:<8} {question}" + (f" ({error})" if error else ""))
+    progress = prefetcher.progress()
+    print(f"{progress['ready']}/{progress['total']} example answers ready in {progress['seconds']:.1f}s")
+    return 0 if not progress['errors'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
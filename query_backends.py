@@ -0,0 +1,334 @@
+"""
+Query backends that execute the LLM's query_used
+
+- pandas (default): a pandas expression over `df`, served from the aggregate
+  cube or the sandboxed query engine
+- duckdb: one SQL SELECT over the `parcels` view of the Parquet files
+- polars: a Polars expression over the LazyFrame `lf` from scan_parquet
+
+duckdb and polars scan the Parquet files lazily: filters and column selections
+are pushed down into the scan, scans run on all cores, and the data never has
+to fit in a pandas DataFrame. By default they read the dataset's Parquet
+sidecar. QUERY_PARQUET can name other Parquet files (a glob or a directory),
+e.g. national-scale data that is too large to load. The backend also tells
+the LLM which query language to write.
+"""
+
+import glob
+import json
+import os
+import re
+import threading
+
+import pandas as pd
+
+from query_engine import (
+    BUILTIN_NAMES, ENGINE_MODE, MEMORY_LIMIT_MB, SAFE_BUILTINS, _plans, execute_forked, execute_inline,
+    get_engine,
+)
+from schema import drop_unobserved
+
+# 'pandas', 'duckdb' or 'polars'
+BACKEND_NAME = os.getenv("QUERY_BACKEND", "pandas")
+
+# Parquet files the duckdb/polars backends query instead of the sidecar
+PARQUET_SOURCE = os.getenv("QUERY_PARQUET", "")
+
+# Name of the SQL view over the Parquet files
+SQL_TABLE = "parcels"
+
+# Rows an out-of-core query may return (more raises ResultTooLarge)
+MAX_RESULT_ROWS = 100_000
+
+
+class ResultTooLarge(ValueError):
+    """An out-of-core query returned more than MAX_RESULT_ROWS rows"""
+
+    def __init__(self):
+        super().__init__(f"The result has more than {MAX_RESULT_ROWS:,} rows; filter or aggregate the query")
+
+
+def parquet_files(source):
+    """Expand a Parquet file, directory or glob into a sorted list of files"""
+    if os.path.isdir(source):
+        source = os.path.join(source, '**', '*.parquet')
+    return sorted(glob.glob(source, recursive=True))
+
+
+def simplify_result(frame):
+    """Turn a query result table into the shapes the pandas path produces
+
+    One cell becomes a scalar; a label column plus one value column becomes a
+    Series indexed by the labels (ready for plotting); anything else stays a
+    DataFrame.
+    """
+    if frame.shape == (1, 1):
+        value = frame.iat[0, 0]
+        return value.item() if hasattr(value, 'item') else value
+    if frame.shape[1] == 2 and not pd.api.types.is_numeric_dtype(frame.iloc[:, 0]):
+        series = frame.set_index(frame.columns[0]).iloc[:, 0]
+        series.index.name = None
+        return series
+    return frame
+
+
+class PandasBackend:
+    """The in-memory DataFrame, with the cube and the sandboxed query engine"""
+
+    name = 'pandas'
+    language = 'pandas'
+    external = False
+    prompt_notes = "Query language: write query_used as ONE pandas expression over the DataFrame `df`."
+
+    def __init__(self, dataset=None):
+        self.dataset = dataset
+
+    def execute(self, expression, df):
+        """Evaluate a pandas expression against df"""
+        dataset = self.dataset
+        exec_result = None
+        if dataset is not None:
+            # Parcel / meter lookups from the hash index, then rollups from the cube
+            exec_result = dataset.values.evaluate(expression, df)
+            if exec_result is None:
+                exec_result = dataset.cube.evaluate(expression)
+        if exec_result is None:
+            if ENGINE_MODE == 'process' and dataset is not None and dataset.sidecar_path:
+                exec_result = get_engine(dataset.sidecar_path, dataset.version).execute(expression)
+            elif ENGINE_MODE == 'fork' and hasattr(os, 'fork'):
+                exec_result = execute_forked(expression, df)
+            else:
+                exec_result = execute_inline(expression, df)
+        return drop_unobserved(exec_result)
+
+    def table_info(self, df):
+        """Return (rows, columns, first DOC_DATE, last DOC_DATE) for the prompt"""
+        if self.dataset is not None:
+            return self.dataset.profile.table_info()
+        return len(df), df.columns.tolist(), df['DOC_DATE'].min(), df['DOC_DATE'].max()
+
+    def close(self):
+        pass
+
+
+class DuckDBBackend(PandasBackend):
+    """SQL over the Parquet files with DuckDB (lazy, multithreaded, out-of-core)"""
+
+    name = 'duckdb'
+    language = 'sql'
+    prompt_notes = f"""Query language: write query_used as ONE DuckDB SQL SELECT statement over the table {SQL_TABLE} (not pandas).
+- Quote column names in double quotes, e.g. "REGN", "رقم العداد"
+- Return a label column and a value column for charts, e.g.
+  SELECT "REGN", COUNT(*) AS n FROM {SQL_TABLE} GROUP BY "REGN" ORDER BY n DESC
+- Filter with WHERE on the columns you need; never read other files"""
+
+    # Statements and table functions that touch anything beyond the view
+    _BLOCKED = re.compile(
+        r"\b(attach|detach|copy|export|import|install|load|pragma|set|reset|call|create|insert|update|"
+        r"delete|drop|alter|checkpoint|vacuum|read_\w+|\w+_scan|glob|getenv|current_setting)\b",
+        re.IGNORECASE,
+    )
+
+    def __init__(self, dataset=None, files=None):
+        import duckdb
+
+        super().__init__(dataset)
+        self.files = files
+        self._info = None
+        self._lock = threading.Lock()
+        self._conn = duckdb.connect(config={
+            'threads': os.cpu_count() or 1,
+            'memory_limit': f'{MEMORY_LIMIT_MB}MB',
+        })
+        file_list = ', '.join("'" + path.replace("'", "''") + "'" for path in files)
+        self._conn.execute(
+            f"CREATE VIEW {SQL_TABLE} AS SELECT * FROM read_parquet([{file_list}], union_by_name=true)"
+        )
+        # Only the dataset's files stay readable (no replacement scans of other
+        # paths), and the settings are locked so a query cannot turn access back on
+        allowed = ', '.join("'" + os.path.abspath(path).replace("'", "''") + "'" for path in files)
+        self._conn.execute(f"SET allowed_paths = [{allowed}]")
+        self._conn.execute("SET enable_external_access = false")
+        self._conn.execute("SET lock_configuration = true")
+
+    def validate(self, sql):
+        """Allow only a single SELECT that reads nothing but the view"""
+        import duckdb
+
+        statements = duckdb.extract_statements(sql)
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise ValueError("query_used must be a single SELECT statement")
+        # String literals may contain anything; look for keywords outside them
+        code = re.sub(r"'(?:[^']|'')*'", "''", sql)
+        match = self._BLOCKED.search(code)
+        if match:
+            raise ValueError(f"Disallowed SQL: {match.group(0)}")
+        # FROM '/etc/passwd.csv' and JOIN 'other.parquet' are table references, not keywords
+        tables, ctes = self._tables(sql)
+        for table in tables:
+            if table is None:
+                raise ValueError("Disallowed SQL: table functions")
+            if table.lower() not in ctes | {SQL_TABLE}:
+                raise ValueError(f"Disallowed table: {table}")
+
+    def _tables(self, sql):
+        """(table names read, CTE names) of a statement; None stands for a table function"""
+        with self._lock:
+            cursor = self._conn.cursor()
+        try:
+            tree = json.loads(cursor.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+        finally:
+            cursor.close()
+        if tree.get('error'):
+            raise ValueError(f"Invalid SQL: {tree.get('error_message', '')}")
+        tables, ctes = [], set()
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(node)
+                continue
+            if not isinstance(node, dict):
+                continue
+            if node.get('type') == 'BASE_TABLE':
+                tables.append(node.get('table_name', ''))
+            elif node.get('type') == 'TABLE_FUNCTION':
+                tables.append(None)
+            for entry in (node.get('cte_map') or {}).get('map', []):
+                ctes.add(str(entry.get('key', '')).lower())
+            stack.extend(node.values())
+        return tables, ctes
+
+    def execute(self, sql, df=None):
+        """Run a SELECT against the Parquet files, returning a scalar, Series or DataFrame"""
+        self.validate(sql)
+        with self._lock:
+            # cursor() gives this query its own connection state on the shared database
+            cursor = self._conn.cursor()
+        try:
+            result = cursor.execute(sql)
+            # Vectors of 2048 rows: one chunk holds MAX_RESULT_ROWS + 1 rows
+            frame = result.fetch_df_chunk(MAX_RESULT_ROWS // 2048 + 1)
+            if len(frame) > MAX_RESULT_ROWS or len(result.fetch_df_chunk(1)):
+                raise ResultTooLarge()
+        finally:
+            cursor.close()
+        return simplify_result(frame)
+
+    def table_info(self, df=None):
+        if self._info is not None:
+            return self._info
+        with self._lock:
+            cursor = self._conn.cursor()
+        try:
+            columns = [row[0] for row in cursor.execute(f"DESCRIBE {SQL_TABLE}").fetchall()]
+            rows, first, last = cursor.execute(
+                f'SELECT COUNT(*), MIN("DOC_DATE"), MAX("DOC_DATE") FROM {SQL_TABLE}'
+            ).fetchone()
+        finally:
+            cursor.close()
+        self._info = rows, columns, first, last
+        return self._info
+
+    def close(self):
+        self._conn.close()
+
+
+class PolarsBackend(PandasBackend):
+    """Polars expressions over a LazyFrame scanning the Parquet files"""
+
+    name = 'polars'
+    language = 'polars'
+    prompt_notes = """Query language: write query_used as ONE Polars expression over the LazyFrame `lf` (not pandas); `pl` is the polars module.
+- e.g. lf.group_by('REGN').agg(pl.len().alias('n')).sort('n', descending=True)
+- e.g. lf.filter(pl.col('PAR_AREA') > 1000).select(pl.len())
+- Filter and select before aggregating; do not call .collect()"""
+
+    NAMES = {'lf', 'pl', *BUILTIN_NAMES}
+    # LazyFrame/expression methods and polars constructors an expression may use
+    ATTRIBUTES = frozenset("""
+        filter select with_columns group_by agg sort head tail limit slice unique drop rename explode
+        col lit len count sum mean median min max std var n_unique first last alias cast round abs
+        is_in is_null is_not_null is_between drop_nulls fill_null value_counts top_k bottom_k sort_by
+        when then otherwise over and_ or_ not_ cum_sum quantile
+        str dt contains starts_with ends_with strip_chars to_lowercase to_uppercase len_chars
+        year month day quarter week weekday ordinal_day truncate date
+        Utf8 String Int32 Int64 Float64 Date Datetime Categorical Boolean
+    """.split())
+
+    def __init__(self, dataset=None, files=None):
+        import polars as pl
+
+        super().__init__(dataset)
+        self.pl = pl
+        self.files = files
+        self._info = None
+        self.lf = pl.scan_parquet(files)
+
+    def execute(self, expression, df=None):
+        """Evaluate a Polars expression, collecting a LazyFrame with the streaming engine"""
+        pl = self.pl
+        _, code = _plans.compile(expression, self.NAMES, self.ATTRIBUTES)
+        result = eval(code, {'__builtins__': SAFE_BUILTINS, 'lf': self.lf, 'pl': pl})
+        if isinstance(result, pl.LazyFrame):
+            result = self._collect(result.head(MAX_RESULT_ROWS + 1))
+            if result.height > MAX_RESULT_ROWS:
+                raise ResultTooLarge()
+        if isinstance(result, pl.DataFrame):
+            return simplify_result(result.to_pandas())
+        if isinstance(result, pl.Series):
+            return result.to_pandas()
+        return result
+
+    @staticmethod
+    def _collect(lazy):
+        try:
+            return lazy.collect(engine='streaming')
+        except TypeError:  # polars < 1.0
+            return lazy.collect(streaming=True)
+
+    def table_info(self, df=None):
+        if self._info is not None:
+            return self._info
+        pl = self.pl
+        columns = list(self.lf.collect_schema().names())
+        stats = self._collect(self.lf.select(
+            pl.len(), pl.col('DOC_DATE').min(), pl.col('DOC_DATE').max()
+        ))
+        rows, first, last = stats.row(0)
+        self._info = rows, columns, first, last
+        return self._info
+
+
+BACKENDS = {
+    'pandas': PandasBackend,
+    'duckdb': DuckDBBackend,
+    'polars': PolarsBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(dataset=None, name=None):
+    """Return the shared backend for a dataset version (pandas without a Parquet source)"""
+    name = name or BACKEND_NAME
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown QUERY_BACKEND {name!r}; use one of {', '.join(BACKENDS)}")
+    if name == 'pandas':
+        return PandasBackend(dataset)
+
+    source = PARQUET_SOURCE or (dataset.sidecar_path if dataset is not None else None)
+    files = parquet_files(source) if source else []
+    if not files:
+        raise ValueError(f"The {name} backend needs Parquet files (QUERY_PARQUET or the dataset sidecar)")
+    key = (name, tuple(files), dataset.version if dataset is not None else None)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            # One backend per source; an older dataset version's backend is closed
+            for old_key in [k for k in _backends if k[0] == name]:
+                _backends.pop(old_key).close()
+            backend = _backends[key] = BACKENDS[name](dataset, files)
+            backend.external = bool(PARQUET_SOURCE)
+    return backend
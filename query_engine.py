@@ -0,0 +1,566 @@
+"""
+Sandboxed execution of LLM-generated query_used expressions
+
+Expressions are parsed and checked against an AST whitelist of syntax, names
+and attributes (a method or property not on the list is rejected), then compiled
+once and cached by the hash of their AST. Execution happens in a pool of
+worker processes that each map the dataset's Parquet sidecar, or in a child
+forked per query that shares the caller's frame (QUERY_ENGINE=fork, used by
+the API workers). Each query has a CPU-time limit and an address-space cap,
+so a slow or huge expression fails on its own instead of freezing the app. Frame and Series
+results come back as Arrow IPC buffers, and are memoized in a byte-bounded
+ResultCache per data version so a repeated expression is not re-run.
+"""
+
+import ast
+import builtins
+import hashlib
+import os
+import pickle
+import re
+import select
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+import pandas as pd
+
+try:
+    import resource
+    import signal
+except ImportError:  # Windows: no rlimits, the wall-clock timeout still applies
+    resource = None
+
+# Per-query CPU seconds, worker address-space cap and parent-side wall timeout
+CPU_LIMIT_SECONDS = int(os.getenv("QUERY_CPU_SECONDS", "10"))
+MEMORY_LIMIT_MB = int(os.getenv("QUERY_MEMORY_MB", "2048"))
+WALL_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "20"))
+WORKERS = int(os.getenv("QUERY_WORKERS", "2"))
+PLAN_CACHE_SIZE = 512
+
+# Memory for executed query results shared by all sessions (0 disables the result cache)
+RESULT_CACHE_BYTES = int(float(os.getenv("QUERY_RESULT_CACHE_MB", "64")) * 1024 * 1024)
+
+# 'process' runs queries in the worker pool, 'fork' in a child forked per query,
+# 'inline' in the calling thread without limits
+ENGINE_MODE = os.getenv("QUERY_ENGINE", "process")
+
+# Column name used to carry an unnamed Series through Arrow
+_UNNAMED = '__value__'
+
+BUILTIN_NAMES = ('len', 'min', 'max', 'sum', 'abs', 'round', 'int', 'float', 'str', 'bool',
+                 'list', 'dict', 'tuple', 'sorted')
+SAFE_BUILTINS = {name: getattr(builtins, name) for name in BUILTIN_NAMES}
+ALLOWED_NAMES = {'df', 'pd', *BUILTIN_NAMES}
+
+# Attributes an expression may use: read-only DataFrame/Series/Index/GroupBy
+# methods and properties, the .str/.dt/.cat accessors and the pandas
+# constructors. Anything else (I/O such as to_pickle/to_string(buf=...),
+# eval/pipe, str.format, dunders) is rejected.
+ALLOWED_ATTRIBUTES = frozenset("""
+    loc iloc at iat shape size ndim empty index columns dtypes dtype name names values T
+    head tail nlargest nsmallest sample filter query where mask isin between
+    isna isnull notna notnull dropna fillna ffill bfill drop drop_duplicates duplicated
+    unique nunique value_counts count sum mean median min max std var sem skew kurt mode
+    quantile describe prod cumsum cumprod cummax cummin cumcount pct_change diff shift
+    idxmax idxmin abs round clip rank corr cov any all
+    sort_values sort_index reset_index set_index rename rename_axis reindex astype copy squeeze
+    groupby agg aggregate apply transform map replace size first last nth ngroups ngroup
+    resample rolling expanding unstack stack pivot pivot_table melt explode assign
+    merge join combine_first add sub mul div truediv floordiv mod pow eq ne lt le gt ge
+    to_frame to_list tolist to_dict to_numpy item items keys
+    is_unique is_monotonic_increasing is_monotonic_decreasing hasnans
+    first_valid_index last_valid_index interpolate asfreq
+    str dt cat codes categories as_ordered
+    contains startswith endswith strip lstrip rstrip lower upper title len split rsplit get
+    slice slice_replace extract match fullmatch findall zfill pad center isdigit isnumeric
+    year month day quarter week dayofweek day_of_week dayofyear day_of_year weekday
+    hour minute date day_name month_name to_period to_timestamp strftime floor ceil normalize
+    days total_seconds start_time end_time
+    Series DataFrame Index concat crosstab cut qcut to_datetime to_numeric to_timedelta
+    Timestamp Timedelta Grouper NamedAgg date_range period_range NA NaT
+""".split())
+
+# Methods that take a function, which pandas resolves by name when it is a string
+# (df.apply('to_pickle', ...)): only these reductions may be named
+FUNCTION_METHODS = {'apply', 'agg', 'aggregate', 'transform', 'map'}
+NAMED_FUNCTIONS = frozenset("""
+    sum mean median min max count size nunique std var sem prod first last any all
+    idxmin idxmax cumsum cumcount cummax cummin rank mode skew
+""".split())
+# Non-function keywords of those methods
+FUNCTION_OPTIONS = {'axis', 'raw', 'result_type', 'numeric_only', 'by_row', 'na_action',
+                    'include_groups', 'engine'}
+
+# Keywords naming a file or connection to write to, rejected on any call
+BLOCKED_KEYWORDS = {'buf', 'path', 'path_or_buf', 'path_or_buffer', 'excel_writer',
+                    'filepath_or_buffer', 'con', 'args', 'kwargs'}
+
+# Methods whose string argument pandas evaluates as an expression
+EXPRESSION_METHODS = {'query'}
+
+ALLOWED_NODES = (
+    ast.Expression, ast.Name, ast.Load, ast.Attribute, ast.Call, ast.keyword, ast.Subscript,
+    ast.Slice, ast.Constant, ast.List, ast.Tuple, ast.Dict, ast.Compare, ast.BoolOp,
+    ast.BinOp, ast.UnaryOp, ast.IfExp, ast.Starred,
+    ast.And, ast.Or, ast.Not, ast.Invert, ast.USub, ast.UAdd,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.BitAnd, ast.BitOr, ast.BitXor,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+)
+
+
+class QueryRejected(ValueError):
+    """The expression uses syntax or names outside the whitelist"""
+
+
+class QueryTimeout(TimeoutError):
+    """The expression ran past its CPU or wall-clock limit"""
+
+
+def _check_function(node):
+    """A function argument of apply/agg/...: a string must name a plain reduction
+
+    Only literals, lists/dicts of them and plain functions (len, pd.to_numeric)
+    are accepted, so a method name cannot be computed at run time.
+    """
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, str) and node.value not in NAMED_FUNCTIONS:
+            raise QueryRejected(f"Disallowed function name: {node.value!r}")
+    elif isinstance(node, (ast.List, ast.Tuple)):
+        for element in node.elts:
+            _check_function(element)
+    elif isinstance(node, ast.Dict):
+        # {column: function(s)}
+        for value in node.values:
+            _check_function(value)
+    elif isinstance(node, ast.Call) and _root_name(node) == 'pl':
+        # Polars expressions (pl.len().alias('n')); Polars never dispatches on a string
+        pass
+    elif not isinstance(node, (ast.Name, ast.Attribute)):
+        raise QueryRejected(f"Disallowed function argument: {type(node).__name__}")
+
+
+def _root_name(node):
+    """'pl' for pl.col('x').sum(): the name a chain of calls and attributes starts from"""
+    while isinstance(node, (ast.Call, ast.Attribute)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _check_function_call(node):
+    if node.func.attr == 'map':
+        # map takes a mapping (whose values are data) or a function, never a name
+        if node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+            raise QueryRejected("Disallowed map argument")
+        return
+    for arg in node.args[:1]:
+        _check_function(arg)
+    if any(isinstance(arg, ast.Constant) and isinstance(arg.value, str) for arg in node.args[1:]):
+        raise QueryRejected(f"Disallowed {node.func.attr} arguments")
+    for keyword in node.keywords:
+        if keyword.arg in FUNCTION_OPTIONS:
+            continue
+        value = keyword.value
+        if keyword.arg == 'func':
+            _check_function(value)
+        elif isinstance(value, ast.Tuple) and len(value.elts) == 2:
+            # Named aggregation: total=('PAR_AREA', 'sum')
+            _check_function(value.elts[1])
+        else:
+            _check_function(value)
+
+
+def _check_expression_string(text, attributes):
+    """A df.query string: Python-like syntax, checked with the same attribute whitelist"""
+    if '@' in text or '__' in text:
+        raise QueryRejected("Disallowed df.query expression")
+    # `quoted column names` become plain names for the check
+    code = re.sub(r'`[^`]*`', '_col', text)
+    try:
+        tree = ast.parse(code.strip(), mode='eval')
+    except SyntaxError:
+        raise QueryRejected("Disallowed df.query expression") from None
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise QueryRejected(f"Disallowed syntax in df.query: {type(node).__name__}")
+        if isinstance(node, ast.Attribute) and node.attr not in attributes:
+            raise QueryRejected(f"Disallowed attribute in df.query: {node.attr}")
+
+
+def validate(expression, names=ALLOWED_NAMES, attributes=ALLOWED_ATTRIBUTES):
+    """Parse expression and check it against the whitelist, returning its AST"""
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise QueryRejected(f"Not a single expression: {e.msg}") from None
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise QueryRejected(f"Disallowed syntax: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in names:
+            raise QueryRejected(f"Disallowed name: {node.id}")
+        if isinstance(node, ast.Attribute) and (node.attr.startswith('_') or node.attr not in attributes):
+            raise QueryRejected(f"Disallowed attribute: {node.attr}")
+        if isinstance(node, ast.Constant) and isinstance(node.value, bytes):
+            raise QueryRejected("Disallowed bytes literal")
+        if not isinstance(node, ast.Call):
+            continue
+        for keyword in node.keywords:
+            # **{...} would hide the keyword names from the checks below
+            if keyword.arg is None:
+                raise QueryRejected("Disallowed ** argument")
+            if keyword.arg in BLOCKED_KEYWORDS:
+                raise QueryRejected(f"Disallowed keyword: {keyword.arg}")
+        if not isinstance(node.func, ast.Attribute):
+            continue
+        if (node.func.attr in FUNCTION_METHODS | EXPRESSION_METHODS
+                and any(isinstance(arg, ast.Starred) for arg in node.args)):
+            raise QueryRejected(f"Disallowed * argument to {node.func.attr}")
+        if node.func.attr in FUNCTION_METHODS:
+            _check_function_call(node)
+        elif node.func.attr in EXPRESSION_METHODS:
+            for arg in [*node.args, *(keyword.value for keyword in node.keywords if keyword.arg == 'expr')]:
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                    _check_expression_string(arg.value, attributes)
+                elif not isinstance(arg, ast.Constant):
+                    raise QueryRejected("df.query takes a string literal")
+    return tree
+
+
+def plan_key(tree):
+    """Hash of the expression's AST (ignores formatting differences)"""
+    return hashlib.sha256(ast.dump(tree).encode('utf-8')).hexdigest()
+
+
+class PlanCache:
+    """LRU cache of compiled, validated expressions keyed by AST hash"""
+
+    def __init__(self, max_size=PLAN_CACHE_SIZE):
+        self.max_size = max_size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, expression, names=ALLOWED_NAMES, attributes=ALLOWED_ATTRIBUTES):
+        """Return (key, code) for expression, validating and compiling on a miss"""
+        tree = validate(expression, names, attributes)
+        key = plan_key(tree)
+        with self._lock:
+            code = self._plans.get(key)
+            if code is not None:
+                self._plans.move_to_end(key)
+                return key, code
+        code = compile(tree, '<query_used>', 'eval')
+        with self._lock:
+            self._plans[key] = code
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+        return key, code
+
+
+_plans = PlanCache()
+
+
+def run_plan(code, df):
+    """Evaluate a compiled plan against df with only the whitelisted builtins"""
+    return eval(code, {'__builtins__': SAFE_BUILTINS, 'df': df, 'pd': pd})
+
+
+def to_arrow(value):
+    """Encode a DataFrame/Series as Arrow IPC bytes; other values pass through"""
+    import pyarrow as pa
+
+    if isinstance(value, pd.Series):
+        kind, frame = 'series', value.to_frame(name=value.name if value.name is not None else _UNNAMED)
+    elif isinstance(value, pd.DataFrame):
+        kind, frame = 'frame', value
+    else:
+        return 'value', value
+    frame = frame.copy(deep=False)
+    frame.columns = [str(col) for col in frame.columns]
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    except (pa.ArrowException, TypeError, ValueError):
+        # Mixed-type object columns - send the pandas object as is
+        return 'value', value
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return kind, sink.getvalue().to_pybytes()
+
+
+def from_arrow(kind, payload):
+    """Decode the output of to_arrow (the IPC buffer is read without copying)"""
+    if kind == 'value':
+        return payload
+    import pyarrow as pa
+
+    table = pa.ipc.open_stream(pa.py_buffer(payload)).read_all()
+    frame = table.to_pandas()
+    if kind == 'frame':
+        return frame
+    series = frame.iloc[:, 0]
+    return series.rename(None) if series.name == _UNNAMED else series
+
+
+def canonical_key(expression):
+    """Formatting-independent key of an expression (AST hash; collapsed whitespace for SQL)"""
+    try:
+        return plan_key(ast.parse(expression.strip(), mode='eval'))
+    except SyntaxError:
+        return ' '.join(expression.split())
+
+
+class ResultCache:
+    """LRU of executed query results keyed by canonical expression and data version
+
+    Results are kept pickled: compact (categoricals stay codes), exactly sized
+    for the byte budget, and decoded to a fresh object on every hit so a
+    caller cannot modify the cached result.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, expression, version):
+        """Return (True, result) on a hit, (False, None) on a miss"""
+        key = (canonical_key(expression), version)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return True, pickle.loads(payload)
+
+    def put(self, expression, version, result):
+        """Store a result; one larger than a quarter of the budget is not kept"""
+        if self.max_bytes <= 0:
+            return
+        try:
+            payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        if len(payload) > self.max_bytes // 4:
+            return
+        key = (canonical_key(expression), version)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._entries[key] = payload
+            self.bytes += len(payload)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+_results = ResultCache()
+
+
+def get_result_cache():
+    """The process-wide ResultCache"""
+    return _results
+
+
+# Worker process state
+_worker_df = None
+
+
+def _on_cpu_limit(signum, frame):
+    raise QueryTimeout("Query exceeded its CPU time limit")
+
+
+def _init_worker(sidecar_path, memory_limit_mb):
+    global _worker_df
+    if resource is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    _worker_df = pd.read_parquet(sidecar_path, memory_map=True)
+
+
+def _worker_execute(expression, cpu_seconds):
+    _, code = _plans.compile(expression)
+    if resource is not None:
+        # RLIMIT_CPU counts the whole process, so allow cpu_seconds more than used so far
+        used = resource.getrusage(resource.RUSAGE_SELF)
+        spent = int(used.ru_utime + used.ru_stime)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (spent + cpu_seconds, hard))
+    try:
+        return to_arrow(run_plan(code, _worker_df))
+    except MemoryError:
+        raise MemoryError("Query exceeded the worker memory limit") from None
+    finally:
+        if resource is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, hard))
+
+
+class QueryEngine:
+    """Process pool that executes validated expressions for one dataset version"""
+
+    def __init__(self, sidecar_path, version=None, workers=WORKERS, cpu_seconds=CPU_LIMIT_SECONDS,
+                 memory_limit_mb=MEMORY_LIMIT_MB, timeout=WALL_TIMEOUT_SECONDS):
+        self.sidecar_path = sidecar_path
+        self.version = version
+        self.workers = workers
+        self.cpu_seconds = cpu_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a multi-threaded Streamlit server is not safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.sidecar_path, self.memory_limit_mb),
+                )
+            return self._pool
+
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def execute(self, expression):
+        """Validate expression and run it in a worker, returning the result"""
+        _plans.compile(expression)  # reject bad expressions before they reach a worker
+        pool = self._get_pool()
+        future = pool.submit(_worker_execute, expression, self.cpu_seconds)
+        try:
+            kind, payload = future.result(timeout=self.timeout)
+        except QueryTimeout:
+            # Raised by the worker's CPU limit handler; the worker itself is fine
+            raise
+        except FutureTimeout:
+            # The worker is stuck; its CPU limit will end it, start fresh workers meanwhile
+            self._reset_pool(pool)
+            raise QueryTimeout(f"Query took longer than {self.timeout:.0f}s") from None
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise QueryTimeout("Query worker was terminated (CPU or memory limit)") from None
+        return from_arrow(kind, payload)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def execute_inline(expression, df):
+    """Validate and evaluate expression in this process (no CPU/memory limits)"""
+    _, code = _plans.compile(expression)
+    return run_plan(code, df)
+
+
+def _limit_child(cpu_seconds, memory_limit_mb):
+    # A forked child starts with no CPU time used; its address space already
+    # holds the parent's (shared) pages, so the cap is on top of those
+    signal.signal(signal.SIGXCPU, signal.SIG_DFL)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    try:
+        with open('/proc/self/statm') as f:
+            mapped = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return
+    limit = mapped + memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _run_child(code, df, write_fd, cpu_seconds, memory_limit_mb):
+    status = 0
+    try:
+        if resource is not None:
+            _limit_child(cpu_seconds, memory_limit_mb)
+        try:
+            payload = pickle.dumps(('ok', run_plan(code, df)), protocol=pickle.HIGHEST_PROTOCOL)
+        except MemoryError:
+            payload = pickle.dumps(('error', MemoryError("Query exceeded the worker memory limit")))
+        except Exception as e:
+            try:
+                payload = pickle.dumps(('error', e))
+            except Exception:
+                payload = pickle.dumps(('error', RuntimeError(str(e))))
+        with os.fdopen(write_fd, 'wb') as out:
+            out.write(payload)
+    except BaseException:
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def execute_forked(expression, df, cpu_seconds=CPU_LIMIT_SECONDS, memory_limit_mb=MEMORY_LIMIT_MB,
+                   timeout=WALL_TIMEOUT_SECONDS):
+    """Validate expression and run it in a child forked from this process
+
+    The child reads df through copy-on-write pages, so nothing is copied or
+    reloaded, and runs under the pool workers' CPU and memory limits. Meant
+    for the API workers, which are forked processes themselves (POSIX only).
+    """
+    _, code = _plans.compile(expression)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _run_child(code, df, write_fd, cpu_seconds, memory_limit_mb)
+    os.close(write_fd)
+    chunks = []
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([read_fd], [], [], remaining)[0]:
+                os.kill(pid, signal.SIGKILL)
+                raise QueryTimeout(f"Query took longer than {timeout:g}s")
+            chunk = os.read(read_fd, 1 << 20)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+    if not chunks:
+        # Killed by its CPU limit or the kernel before it could answer
+        raise QueryTimeout("Query worker was terminated (CPU or memory limit)")
+    kind, value = pickle.loads(b''.join(chunks))
+    if kind == 'error':
+        raise value
+    return value
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(sidecar_path, version):
+    """Return the shared QueryEngine for a dataset version, replacing an older one"""
+    global _engine
+    with _engine_lock:
+        if _engine is not None and _engine.version == version and _engine.sidecar_path == sidecar_path:
+            return _engine
+        previous, _engine = _engine, QueryEngine(sidecar_path, version)
+    if previous is not None:
+        previous.shutdown()
+    return _engine
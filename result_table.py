@@ -0,0 +1,130 @@
+"""
+Paged result tables and streamed CSV/Parquet export of row-returning answers
+
+Questions such as "أظهر العقارات التي مساحتها أكبر من 1000 متر مربع" return
+thousands of rows, which do not fit a plot's x/y lists. The answer keeps only
+a small table spec (query_used, data version, row and column counts); the
+rows stay on the server. The executed frame is looked up in the query result
+cache (recomputed on a miss), one page of it is sent to the browser at a
+time, and exports are written chunk by chunk, so the full CSV or Parquet
+file is never built in memory.
+"""
+
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+# Rows per page of a result table, and per chunk of an export
+PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "50"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def is_table(result):
+    """Whether an executed query_used result is rows rather than a value or an x/y series"""
+    return isinstance(result, pd.DataFrame) and len(result) > 0 and result.shape[1] > 1
+
+
+def table_spec(query_used, result, version=None):
+    """The spec stored with an answer instead of its rows"""
+    return {
+        'query_used': query_used,
+        'version': version,
+        'rows': len(result),
+        'columns': [str(col) for col in result.columns],
+    }
+
+
+def page_count(rows, page_size=PAGE_SIZE):
+    return max(1, -(-rows // page_size))
+
+
+def page(frame, number, page_size=PAGE_SIZE):
+    """Rows of page number (1-based, clamped to the last page)"""
+    number = min(max(1, number), page_count(len(frame), page_size))
+    start = (number - 1) * page_size
+    return frame.iloc[start:start + page_size]
+
+
+def iter_csv(frame, chunk_rows=EXPORT_CHUNK_ROWS):
+    """CSV bytes of frame, one chunk of rows at a time (UTF-8 with BOM, so Excel reads the Arabic)"""
+    yield '\ufeff'.encode('utf-8') + frame.iloc[:0].to_csv(index=False).encode('utf-8')
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what pyarrow writes until it is drained"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_parquet(frame, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Parquet bytes of frame, one row group per chunk of rows"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # The schema of the whole frame, so an all-null first chunk does not fix a column to null
+    schema = pa.Schema.from_pandas(frame, preserve_index=False)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for start in range(0, len(frame), chunk_rows):
+            chunk = pa.Table.from_pandas(frame.iloc[start:start + chunk_rows], schema=schema, preserve_index=False)
+            writer.write_table(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(frame, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Export chunks of frame in fmt ('csv' or 'parquet')"""
+    if fmt == 'csv':
+        return iter_csv(frame, chunk_rows)
+    if fmt == 'parquet':
+        return iter_parquet(frame, chunk_rows)
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+def write_export(frame, fmt, out, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write frame to the binary file out chunk by chunk; returns the bytes written"""
+    written = 0
+    for data in iter_export(frame, fmt, chunk_rows):
+        out.write(data)
+        written += len(data)
+    return written
+
+
+def export_file(frame, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """The export in a temporary file on disk, positioned at its start"""
+    out = tempfile.TemporaryFile()
+    write_export(frame, fmt, out, chunk_rows)
+    out.seek(0)
+    return out
@@ -0,0 +1,118 @@
+"""
+Column metadata and the compact ingest schema for the property dataset
+
+read_excel returns object dtype for every text column. apply_schema turns the
+repeated Arabic values into categoricals, downcasts the numeric fields and
+parses the date columns, and memory_report shows the footprint per column.
+"""
+
+import sys
+
+import pandas as pd
+
+# Column mapping for better LLM understanding
+COLUMN_MAPPING = {
+    'PAR_PIN': 'Parcel ID / معرف القطعة',
+    'PLT1_NO': 'Plot Number / رقم المخطط',
+    'REGN': 'Region / المنطقة (Arabic values: محافظة مسقط, شمال الباطنة, etc.)',
+    'WLYA': 'Wilayat / الولاية (Arabic values: مسقط, مطرح, العامرات, etc.)',
+    'VILG': 'Village / القرية (Arabic values)',
+    'PUSE': 'Property Use / الاستخدام (Arabic values: سكني=Residential, مسكن اجتماعي=Social Housing, سكن ريفي=Rural Housing)',
+    'SUB_PUSE_DESC': 'Sub Property Use Description / وصف الاستخدام الفرعي (Arabic values)',
+    'PAR_AREA': 'Parcel Area (m²) / مساحة القطعة',
+    'ZONE_NO': 'Zone Number / رقم المنطقة',
+    'DOC_DATE': 'Document Date / تاريخ الوثيقة',
+    'YR': 'Year / السنة',
+    'رقم العداد': 'Meter Number / Account Number',
+    'المنطقة': 'Area (bilingual: السيب - SEEB, روي - RUWI, etc.)',
+    'تاريخ التوصيل': 'Connection Date / تاريخ التوصيل',
+    'نوع التوصيل': 'Connection Type (Permanent/Temporary) / نوع التوصيل',
+    'HOUSING_STATUS': 'Derived housing status / حالة الإسكان (not_started, incomplete, connected)'
+}
+
+ARABIC_COLUMNS = ['REGN', 'WLYA', 'VILG', 'PUSE', 'SUB_PUSE_DESC', 'ZONE_NO', 'المنطقة', 'نوع التوصيل']
+
+# ZONE_NO holds labels such as 'م/1' or 'المرحلة 1', so it is categorical rather than numeric
+CATEGORICAL_COLUMNS = ARABIC_COLUMNS
+INTEGER_COLUMNS = ['YR']
+FLOAT_COLUMNS = ['PAR_AREA']
+DATE_COLUMNS = ['DOC_DATE', 'تاريخ التوصيل']
+
+
+def _downcast_float(values):
+    """Downcast to float32 only when every value survives the round trip"""
+    smaller = pd.to_numeric(values, errors='coerce', downcast='float')
+    if smaller.dtype == values.dtype:
+        return smaller
+    same = (smaller.astype(values.dtype) == values) | values.isna()
+    return smaller if same.all() else values
+
+
+def apply_schema(df):
+    """Convert df in place to the compact typed schema and return it"""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+
+    for col in INTEGER_COLUMNS:
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce')
+            if values.isna().any():
+                # Nullable integers keep missing years instead of falling back to float
+                df[col] = values.astype('Int16' if values.abs().max() < 2 ** 15 else 'Int64')
+            else:
+                df[col] = pd.to_numeric(values, downcast='integer')
+
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = _downcast_float(pd.to_numeric(df[col], errors='coerce'))
+
+    for col in DATE_COLUMNS:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+
+    return df
+
+
+def drop_unobserved(result):
+    """Drop the empty groups that value_counts/groupby report for unused categories
+
+    Categorical columns list every category, including ones filtered out of the
+    frame, which would otherwise show up as zero bars in plots.
+    """
+    if isinstance(result, pd.Series) and isinstance(result.index, pd.CategoricalIndex):
+        result = result[result.notna() & (result != 0)]
+        result.index = result.index.astype(object)
+    return result
+
+
+def column_memory(df):
+    """Return the deep memory usage of each column in bytes"""
+    return df.memory_usage(deep=True, index=False)
+
+
+def memory_report(before, after):
+    """Compare per-column memory (Series of bytes) before and after apply_schema"""
+    report = pd.DataFrame({'before_bytes': before, 'after_bytes': after})
+    report.loc['TOTAL'] = report.sum()
+    report['ratio'] = (report['after_bytes'] / report['before_bytes']).round(3)
+    return report
+
+
+def format_memory_report(report):
+    """Render a memory report as a plain-text table in MB"""
+    lines = [f"{'column':<16}{'before MB':>12}{'after MB':>12}{'ratio':>8}"]
+    for col, row in report.iterrows():
+        lines.append(
+            f"{str(col):<16}{row['before_bytes'] / 1e6:>12.2f}"
+            f"{row['after_bytes'] / 1e6:>12.2f}{row['ratio']:>8.3f}"
+        )
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    # Usage: python schema.py [data.xlsx]
+    raw = pd.read_excel(sys.argv[1] if len(sys.argv) > 1 else 'data.xlsx')
+    before = column_memory(raw)
+    typed = apply_schema(raw)
+    print(format_memory_report(memory_report(before, column_memory(typed))))
@@ -0,0 +1,168 @@
+"""
+Synthetic datasets shaped like data.xlsx for benchmarks
+
+Rows are sampled from a template workbook, so the Arabic categorical columns
+keep their real values, cardinalities and joint distribution (region ->
+wilaya -> village, meter -> connection). Identifiers, meter numbers, areas and
+dates are regenerated per row so they stay unique and varied at any size.
+
+Excel sheets stop at 1,048,576 rows, so larger datasets are written as Parquet
+(load_dataset reads both).
+
+Usage:
+    python synthetic_data.py 1000000 -o synthetic-1m.xlsx
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_store import load_dataset
+from housing import METER_COLUMN, STATUS_COLUMN, has_meter
+
+# Data rows that fit in one Excel sheet under the header row
+EXCEL_MAX_ROWS = 1_048_575
+
+# Rows generated at a time when writing Parquet, to bound memory at 10M+ rows
+CHUNK_ROWS = 1_000_000
+
+
+def load_template(path='data.xlsx'):
+    """Return the template rows as a DataFrame without derived columns"""
+    return load_dataset(path).df.drop(columns=[STATUS_COLUMN], errors='ignore')
+
+
+def _pins(ids):
+    # PAR_PIN-shaped ids, e.g. 03-12-045-07-1234, unique per row
+    ids = pd.Series(ids)
+    parts = [
+        (ids // 10**8 % 100 + 1).astype(str).str.zfill(2),
+        (ids // 10**6 % 100).astype(str).str.zfill(2),
+        (ids // 10**3 % 1000).astype(str).str.zfill(3),
+        (ids // 10**7 % 10).astype(str).str.zfill(2),
+        (ids % 1000).astype(str),
+    ]
+    return parts[0].str.cat(parts[1:], sep='-').to_numpy()
+
+
+def generate(rows, template, seed=0, start=0):
+    """Return a DataFrame of rows records sampled from template
+
+    start offsets the generated ids, so chunks of one dataset stay unique.
+    """
+    rng = np.random.default_rng([seed, start])
+    picks = rng.integers(0, len(template), rows)
+    df = template.iloc[picks].reset_index(drop=True)
+    ids = np.arange(start, start + rows, dtype=np.int64)
+
+    df['PAR_PIN'] = _pins(ids)
+
+    # Areas: the template value scaled by a small multiplicative jitter
+    area = df['PAR_AREA'].to_numpy(dtype='float64') * rng.lognormal(0.0, 0.1, rows)
+    df['PAR_AREA'] = np.maximum(1.0, np.round(area))
+
+    # Dates: shifted by up to +/- 30 days, with YR kept consistent
+    offsets = pd.to_timedelta(rng.integers(-30 * 86400, 30 * 86400, rows), unit='s')
+    first, last = template['DOC_DATE'].min(), template['DOC_DATE'].max()
+    df['DOC_DATE'] = (df['DOC_DATE'] + offsets).clip(first, last)
+    df['YR'] = df['DOC_DATE'].dt.year.astype(df['YR'].dtype)
+
+    # Meters: new unique numbers where the template row has one
+    meters = df[METER_COLUMN]
+    new_meters = pd.Series(ids).astype(str).str.zfill(7).radd('S')
+    df[METER_COLUMN] = meters.where(~has_meter(meters), new_meters)
+    return df
+
+
+def write_parquet(rows, template, path, seed=0, chunk_rows=CHUNK_ROWS):
+    """Generate rows records straight into a Parquet file, one chunk at a time"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for start in range(0, rows, chunk_rows):
+            chunk = generate(min(chunk_rows, rows - start), template, seed, start)
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def write_dataset(df, path):
+    """Write df as .xlsx (streaming, write-only) or .parquet depending on path"""
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+        return path
+    if len(df) > EXCEL_MAX_ROWS:
+        raise ValueError(f"{len(df):,} rows do not fit in an Excel sheet; write .parquet instead")
+
+    from openpyxl import Workbook
+
+    # Write-only mode streams rows to disk instead of building every cell in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([str(col) for col in df.columns])
+    columns = []
+    for col in df.columns:
+        values = df[col].astype(object).where(df[col].notna(), None)
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            values = values.map(lambda v: v.to_pydatetime() if v is not None else None)
+        columns.append(values.tolist())
+    for row in zip(*columns):
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def default_path(rows, seed=0, directory='.'):
+    """File name for a generated dataset; Parquet when it does not fit in Excel"""
+    ext = 'xlsx' if rows <= EXCEL_MAX_ROWS else 'parquet'
+    return os.path.join(directory, f"synthetic-{rows}-s{seed}.{ext}")
+
+
+def ensure_dataset(rows, directory, template_path='data.xlsx', seed=0, fmt=None):
+    """Return the path of a generated dataset, generating it only if missing"""
+    path = default_path(rows, seed, directory)
+    if fmt is not None:
+        path = os.path.splitext(path)[0] + f'.{fmt}'
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp{os.path.splitext(path)[1]}"
+        build_dataset(rows, load_template(template_path), tmp_path, seed)
+        os.replace(tmp_path, path)
+    return path
+
+
+def build_dataset(rows, template, path, seed=0):
+    """Generate and write rows records to path (.xlsx or chunked .parquet)"""
+    if path.endswith('.parquet'):
+        return write_parquet(rows, template, path, seed)
+    return write_dataset(generate(rows, template, seed), path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a data.xlsx-shaped synthetic dataset")
+    parser.add_argument('rows', type=int, help="number of rows, e.g. 45000, 1000000, 10000000")
+    parser.add_argument('-o', '--output', help="output .xlsx or .parquet (default: synthetic-<rows>-s<seed>)")
+    parser.add_argument('--template', default='data.xlsx', help="workbook to sample rows from")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    output = args.output or default_path(args.rows, args.seed)
+    start = time.perf_counter()
+    build_dataset(args.rows, load_template(args.template), output, args.seed)
+    print(f"Wrote {args.rows:,} rows to {output} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Tests for the HTTP API (api_server.ApiServer) on questions the router answers locally
+"""
+
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from api_server import ApiServer, export_token
+from data_store import Dataset
+from schema import apply_schema
+
+
+@pytest.fixture
+def url():
+    df = apply_schema(pd.DataFrame({
+        'PAR_PIN': ['8-53-094-03-225', '8-53-094-03-226', '8-53-094-03-227'],
+        'REGN': [' محافظة مسقط', 'شمال الباطنة', ' محافظة مسقط'],
+        'WLYA': [' السيب', 'صحار', ' بوشر'],
+        'PUSE': ['سكني', 'سكني', 'سكني'],
+        'PAR_AREA': [600.0, 1200.0, 1500.0],
+        'DOC_DATE': pd.to_datetime(['2024-01-05', '2024-02-10', '2023-07-01']),
+        'رقم العداد': ['S188371', 'No account Exist', '1609418'],
+    }))
+    server = ApiServer(('127.0.0.1', 0), Dataset(df, 'v1', 'test'), 'test-key', use_cache=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def _post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode('utf-8'))
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def test_export_runs_the_answer_of_its_token(url):
+    answer = json.loads(_post(url + '/query', {'question': 'Show property distribution by region'}))
+    assert answer['source'] == 'local'
+
+    data = _post(url + '/export', {'export': answer['export'], 'format': 'csv'})
+
+    exported = pd.read_csv(io.BytesIO(data), encoding='utf-8-sig')
+    assert exported.iloc[:, 1].tolist() == [2, 1]
+
+
+@pytest.mark.parametrize('body', [
+    {'query_used': "df.merge(df, how='cross')"},
+    {'export': "ZGY=.0000"},
+    # Another query under a genuine signature
+    {'export': export_token("df.merge(df, how='cross')").split('.')[0] + '.' + export_token("df").split('.')[1]},
+])
+def test_export_refuses_queries_the_server_did_not_produce(url, body):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        _post(url + '/export', body)
+    assert error.value.code in (400, 404)
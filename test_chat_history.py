@@ -0,0 +1,69 @@
+"""
+Tests for the in-memory and SQLite chat history (chat_history)
+"""
+
+import sqlite3
+
+import pytest
+
+from chat_history import HistoryStore, MemoryHistory, SessionHistory, plot_key
+
+PLOT = {'type': 'bar', 'data': {'x': ['مسقط', 'صحار'], 'y': [3, 2]}, 'title': 'العقارات'}
+
+
+def _fill(history):
+    history.append('user', 'كم عدد العقارات لكل محافظة؟')
+    history.append('assistant', 'مسقط: 3، صحار: 2', PLOT)
+    history.append('assistant', 'No plot', {'type': 'none'})
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def history(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryHistory()
+    return SessionHistory(HistoryStore(str(tmp_path / 'history.db')), 'session-a')
+
+
+def test_records_and_windows(history):
+    _fill(history)
+    assert len(history) == 3
+    records = history.messages()
+    assert records[1] == {'role': 'assistant', 'content': 'مسقط: 3، صحار: 2', 'plot': PLOT, 'table': None}
+    assert records[2]['plot'] is None
+    assert history.messages(1, 2) == records[1:2]
+    assert history.messages(2) == records[2:]
+    history.clear()
+    assert len(history) == 0
+
+
+def test_table_spec_is_stored_instead_of_rows(history):
+    table = {'query_used': "df[df['PAR_AREA'] > 1000]", 'version': 'v1', 'rows': 1843, 'columns': ['PAR_PIN', 'REGN']}
+    history.append('assistant', 'Found 1,843 parcels', None, table)
+    assert history.messages()[-1]['table'] == table
+
+
+def test_sqlite_history_survives_a_reopen(tmp_path):
+    path = str(tmp_path / 'history.db')
+    _fill(SessionHistory(HistoryStore(path), 'session-a'))
+    SessionHistory(HistoryStore(path), 'session-b').append('user', 'other session')
+
+    reopened = HistoryStore(path)
+    assert [m['content'] for m in reopened.messages('session-a')] == [
+        'كم عدد العقارات لكل محافظة؟', 'مسقط: 3، صحار: 2', 'No plot',
+    ]
+    assert reopened.messages('session-a')[1]['plot'] == PLOT
+    assert reopened.count('session-b') == 1
+
+
+def test_expired_sessions_are_dropped_on_open(tmp_path):
+    path = str(tmp_path / 'history.db')
+    HistoryStore(path).append('old', 'user', 'question')
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE messages SET created = created - 3600")
+    assert HistoryStore(path, ttl_seconds=60).count('old') == 0
+
+
+def test_plot_key_ignores_key_order():
+    reordered = {'title': PLOT['title'], 'data': PLOT['data'], 'type': PLOT['type']}
+    assert plot_key(reordered) == plot_key(PLOT)
+    assert plot_key(dict(PLOT, type='pie')) != plot_key(PLOT)
@@ -0,0 +1,43 @@
+"""
+Tests for the dataset profile and its token-budgeted prompt context (dataset_profile.DatasetProfile)
+"""
+
+import pandas as pd
+import pytest
+
+from dataset_profile import DatasetProfile, count_tokens
+
+
+@pytest.fixture
+def profile():
+    villages = [f"قرية رقم {i}" for i in range(40)]
+    return DatasetProfile(pd.DataFrame({
+        'VILG': pd.Categorical([villages[i % 40] for i in range(400)]),
+        'PAR_AREA': [600.0 + i for i in range(400)],
+        'DOC_DATE': pd.date_range('2020-01-01', periods=400, freq='D'),
+        'PAR_PIN': [None] + [f"8-53-094-03-{i}" for i in range(1, 400)],
+    }), top_values=8)
+
+
+def test_column_lines_describe_the_data(profile):
+    assert profile.table_info()[0] == 400
+    assert profile.column_line('DOC_DATE', 8).endswith('date 2020-01-01 to 2021-02-03')
+    assert 'category, 40 values' in profile.column_line('VILG', 8)
+    assert '+32 more' in profile.column_line('VILG', 8)
+    assert profile.column_line('PAR_PIN', 8).endswith('399 distinct, e.g. 8-53-094-03-1; 1 missing')
+
+
+def test_context_lists_fewer_values_to_fit_the_budget(profile):
+    full = profile.context()
+    budget = count_tokens(profile.describe(2))
+    shrunk = profile.context(budget=budget)
+    assert count_tokens(shrunk) <= budget < count_tokens(full)
+    assert shrunk == profile.describe(2)
+    # Below the bare column list nothing more can be dropped
+    assert profile.context(budget=1) == profile.describe(0)
+
+
+def test_context_is_built_once_per_notes_and_budget(profile):
+    with_notes = profile.context('Housing: 3 connected')
+    assert with_notes.endswith('\n\nHousing: 3 connected')
+    assert profile.context('Housing: 3 connected') is with_notes
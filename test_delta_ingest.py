@@ -0,0 +1,66 @@
+"""
+Tests for merging delta files (delta_ingest.read_delta / merge_delta / apply_delta)
+"""
+
+import pandas as pd
+import pytest
+
+import value_index
+from data_store import Dataset
+from delta_ingest import apply_delta, merge_delta, read_delta, write_delta_sidecar
+from schema import apply_schema
+
+
+@pytest.fixture
+def base():
+    return apply_schema(pd.DataFrame({
+        'PAR_PIN': ['8-53-094-03-225', '8-53-094-03-226'],
+        'REGN': [' محافظة مسقط', 'شمال الباطنة'],
+        'WLYA': [' مسقط', 'صحار'],
+        'PAR_AREA': [600.0, 1200.0],
+        'رقم العداد': ['S188371', 'No account Exist'],
+    }))
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.parquet'])
+def test_numeric_meter_delta_merges(base, tmp_path, suffix):
+    # Daily meter files usually carry plain numbers in رقم العداد
+    delta = pd.DataFrame({
+        'PAR_PIN': ['8-53-094-03-226', '8-53-094-03-300'],
+        'رقم العداد': [1609418, 1609419],
+    })
+    path = tmp_path / f"meters{suffix}"
+    if suffix == '.csv':
+        delta.to_csv(path, index=False)
+    else:
+        delta.to_parquet(path, index=False)
+
+    merged, updated, touched = merge_delta(base, read_delta(str(path)))
+
+    assert merged['رقم العداد'].tolist() == ['S188371', '1609418', '1609419']
+    assert list(updated) == [1] and list(touched) == [1, 2]
+    sidecar = write_delta_sidecar(merged, 'data.xlsx', 'v2', cache_dir=str(tmp_path / 'cache'))
+    assert sidecar is not None
+    assert pd.read_parquet(sidecar)['رقم العداد'].tolist() == ['S188371', '1609418', '1609419']
+
+
+def test_apply_delta_updates_derived_data_like_a_rebuild(base, tmp_path, monkeypatch):
+    # Patch the record lookups instead of rebuilding them, however small the frame
+    monkeypatch.setattr(value_index, 'REBUILD_SHARE', 1.0)
+    dataset = Dataset(base, 'v1', 'data.xlsx')
+    # The same parcel changes meter twice; a new parcel brings a new wilayat
+    for i, (pins, meters) in enumerate([
+        (['8-53-094-03-226', '8-53-094-03-300'], ['1609418', '1609419']),
+        (['8-53-094-03-226'], ['1609420']),
+    ]):
+        path = tmp_path / f"delta{i}.csv"
+        pd.DataFrame({'PAR_PIN': pins, 'WLYA': ['صحم'] * len(pins), 'رقم العداد': meters}).to_csv(path, index=False)
+        dataset = apply_delta(dataset, str(path), cache_dir=str(tmp_path / 'cache'))
+
+    rebuilt = Dataset(dataset.df, dataset.version, 'data.xlsx')
+    assert dataset.housing == rebuilt.housing
+    assert dataset.values.values['WLYA'] == rebuilt.values.values['WLYA']
+    for col, number in [('رقم العداد', '1609418'), ('رقم العداد', '1609420'), ('رقم العداد', 'S188371'),
+                        ('PAR_PIN', '8-53-094-03-300'), ('PAR_PIN', '8-53-094-03-225')]:
+        assert dataset.values.lookup(col, number).tolist() == rebuilt.values.lookup(col, number).tolist()
+    assert dataset.values.lookup('رقم العداد', '1609418').tolist() == []
@@ -0,0 +1,51 @@
+"""
+Tests for the local intent router (intent_router.IntentRouter)
+"""
+
+import pandas as pd
+import pytest
+
+from intent_router import IntentRouter
+from value_index import ValueIndex
+
+
+@pytest.fixture
+def router():
+    # Stored spellings as in the workbook: leading spaces and tatweel
+    df = pd.DataFrame({
+        'REGN': [' محافظة مسقط'] * 3 + ['شـمال الباطنة'] * 2,
+        'WLYA': [' مسقط', ' السيب', ' السيب', 'صحار', 'صحار'],
+        'PUSE': ['سكني', 'سكني', 'تجاري', 'سكني', 'سكني'],
+        'PAR_AREA': [600.0, 1200.0, 1500.0, 800.0, 400.0],
+    })
+    return IntentRouter(df, index=ValueIndex(df))
+
+
+def _query_used(router, question):
+    routed = router.route(question)
+    return routed and routed['query_used']
+
+
+@pytest.mark.parametrize('arabic, english', [
+    ('كم عدد العقارات في مسقط؟', 'How many properties in Muscat?'),
+    ('كم عدد العقارات في محافظة مسقط؟', 'How many properties are in Muscat governorate?'),
+    ('كم عدد العقارات في ولاية مسقط؟', 'How many properties in wilayat Muscat?'),
+])
+def test_arabic_and_english_spellings_give_the_same_answer(router, arabic, english):
+    assert _query_used(router, arabic) == _query_used(router, english)
+
+
+def test_bare_governorate_and_wilayat_name_goes_to_the_llm(router):
+    assert router.route('كم عدد العقارات في مسقط؟') is None
+    assert router.route('How many properties in Muscat?') is None
+
+
+def test_qualified_place_names_pick_the_column(router):
+    assert router.route('كم عدد العقارات في محافظة مسقط؟')['answer'].endswith(': 3')
+    assert router.route('How many properties in wilayat Muscat?')['answer'].endswith(': 1')
+
+
+def test_near_miss_matched_by_the_value_index(router):
+    # 'السييب' is one letter off the stored ' السيب'
+    assert router.route('كم عدد العقارات في السييب')['query_used'] == "len(df[(df['WLYA'] == ' السيب')])"
+    assert IntentRouter(router.df).route('كم عدد العقارات في السييب') is None
@@ -0,0 +1,62 @@
+"""
+Tests for the circuit breaker of the resilient LLM caller (llm_client)
+"""
+
+import asyncio
+
+import pytest
+
+from llm_client import CircuitBreaker, LLMUnavailable, ResilientCaller
+
+
+@pytest.fixture
+def half_open():
+    breaker = CircuitBreaker(failures=1, cooldown=0)
+    breaker.failure()
+    assert breaker.state == 'open'
+    return breaker
+
+
+def _create(timeout=None, **request):
+    return 'answer'
+
+
+async def _acreate(timeout=None, **request):
+    return 'answer'
+
+
+def test_probe_past_the_deadline_lets_the_next_probe_through(half_open):
+    # A zero deadline ends the probe in _timeout, before any request is sent
+    with pytest.raises(LLMUnavailable):
+        ResilientCaller(deadline=0, breaker=half_open).call(_create)
+    assert ResilientCaller(breaker=half_open).call(_create) == 'answer'
+    assert half_open.state == 'closed'
+
+
+def test_async_probe_past_the_deadline_lets_the_next_probe_through(half_open):
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(ResilientCaller(deadline=0, breaker=half_open).acall(_acreate))
+    assert asyncio.run(ResilientCaller(breaker=half_open).acall(_acreate)) == 'answer'
+    assert half_open.state == 'closed'
+
+
+def test_cancelled_probe_lets_the_next_probe_through(half_open):
+    async def hang(timeout=None, **request):
+        await asyncio.sleep(60)
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(ResilientCaller(breaker=half_open).acall(hang))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert half_open.allow() == 'probe'
+
+
+def test_one_probe_at_a_time(half_open):
+    assert half_open.allow() == 'probe'
+    assert half_open.allow() is False
+    half_open.failure()
+    assert half_open.state == 'open'
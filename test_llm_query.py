@@ -0,0 +1,46 @@
+"""
+Tests for the answer fallbacks of llm_query when the LLM is unavailable
+"""
+
+import pandas as pd
+import pytest
+
+import llm_client
+from llm_cache import ResponseCache
+from llm_client import CircuitBreaker, ResilientCaller
+from llm_query import LLM_MODEL, query_data_with_llm
+
+
+@pytest.fixture
+def open_breaker(monkeypatch):
+    breaker = CircuitBreaker(failures=1, cooldown=60)
+    breaker.failure()
+    monkeypatch.setattr(llm_client, '_caller', ResilientCaller(breaker=breaker))
+    return breaker
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'REGN': [' محافظة مسقط', 'شمال الباطنة'],
+        'PAR_AREA': [600.0, 1200.0],
+        'DOC_DATE': pd.to_datetime(['2024-01-05', '2024-02-10']),
+    })
+
+
+def test_open_breaker_serves_stale_answer_to_rephrased_question(open_breaker, df):
+    cache = ResponseCache(':memory:')
+    stored = {'answer': 'Sohar: 42', 'plot': {'type': 'none'}, 'query_used': ''}
+    cache.set('Who is the largest landowner in Sohar?', LLM_MODEL, 'old-version', stored)
+
+    result = query_data_with_llm(df, '  who is the LARGEST landowner in sohar ', 'test-key', cache=cache)
+
+    assert open_breaker.state == 'open'
+    assert result['answer'].endswith('Sohar: 42')
+
+
+def test_open_breaker_without_cached_answer_asks_to_retry(open_breaker, df):
+    result = query_data_with_llm(df, 'Who owns the most land in Nizwa?', 'test-key', cache=ResponseCache(':memory:'))
+
+    assert 'unavailable' in result['answer']
+    assert result['plot'] == {'type': 'none'}
@@ -0,0 +1,39 @@
+"""
+Tests for the incremental answer parser of streamed LLM replies (llm_stream)
+"""
+
+import json
+
+import pytest
+
+from llm_stream import AnswerStreamParser
+
+
+def _feed(text, size):
+    parser = AnswerStreamParser()
+    answers = [parser.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    return parser, [a for a in answers if a is not None]
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 1000])
+def test_answer_is_decoded_whatever_the_chunking(size):
+    reply = json.dumps({'answer': 'عدد العقارات: 3\n"تم" 😀', 'plot': None, 'query_used': 'len(df)'})
+    parser, answers = _feed(reply, size)
+    assert answers[-1] == 'عدد العقارات: 3\n"تم" 😀'
+    assert parser.answer_complete
+    assert parser.text == reply
+
+
+@pytest.mark.parametrize('size', [1, 3, 1000])
+def test_escaped_surrogate_pair_is_one_character(size):
+    parser, answers = _feed('{"answer": "ok \\ud83d\\ude00!"}', size)
+    assert answers[-1] == 'ok \U0001F600!'
+    assert all(not 0xD800 <= ord(c) < 0xE000 for answer in answers for c in answer)
+
+
+def test_answer_grows_only_until_its_closing_quote():
+    parser = AnswerStreamParser()
+    assert parser.feed('{"plot": null, ') is None
+    assert parser.feed('"answer": "Mus') == 'Mus'
+    assert parser.feed('cat", "query_used": "df"}') == 'Muscat'
+    assert parser.feed(' ') is None
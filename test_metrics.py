@@ -0,0 +1,73 @@
+"""
+Tests for the stage spans, counters, Prometheus text and trace file of metrics
+"""
+
+import json
+
+import pytest
+
+import metrics
+from metrics import MetricsRegistry, Trace, annotate, span, trace, write_trace
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    fresh = MetricsRegistry()
+    monkeypatch.setattr(metrics, 'registry', fresh)
+    return fresh
+
+
+def test_spans_are_grouped_by_trace(registry, tmp_path, monkeypatch):
+    path = tmp_path / 'traces.jsonl'
+    monkeypatch.setattr(metrics, 'TRACE_PATH', str(path))
+    with trace('question', query='كم عدد العقارات'):
+        with span('parse'):
+            pass
+        annotate(source='router')
+    with span('outside'):
+        pass
+
+    record = json.loads(path.read_text(encoding='utf-8'))
+    assert record['trace'] == 'question' and record['source'] == 'router'
+    assert [s['stage'] for s in record['spans']] == ['parse']
+    assert set(registry.summary()) == {'parse', 'question', 'outside'}
+
+
+def test_trace_file_is_off_by_default(registry, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with trace('question'):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_trace_file_rotates(tmp_path):
+    path = str(tmp_path / 'traces.jsonl')
+    for _ in range(5):
+        write_trace(Trace('question', query='x' * 100), path=path, max_bytes=300)
+    assert (tmp_path / 'traces.jsonl.1').exists()
+    assert len(open(path, encoding='utf-8').readlines()) < 5
+
+
+def test_summary_quantiles():
+    registry = MetricsRegistry()
+    for ms in range(1, 101):
+        registry.observe('llm_call', ms / 1000)
+    summary = registry.summary()['llm_call']
+    assert summary['count'] == 100
+    assert (summary['p50'], summary['p95'], summary['p99']) == (0.05, 0.095, 0.099)
+    assert summary['mean'] == pytest.approx(0.0505)
+
+
+def test_prometheus_text():
+    registry = MetricsRegistry()
+    registry.observe('parse', 0.25)
+    registry.count('llm_calls_total', outcome='ok')
+    registry.count('llm_calls_total', 2, outcome='say "hi"')
+
+    lines = registry.prometheus_text().splitlines()
+
+    assert 'chatbot_stage_seconds{stage="parse",quantile="0.5"} 0.250000' in lines
+    assert 'chatbot_stage_seconds_count{stage="parse"} 1' in lines
+    assert '# TYPE chatbot_llm_calls_total counter' in lines
+    assert 'chatbot_llm_calls_total{outcome="ok"} 1' in lines
+    assert 'chatbot_llm_calls_total{outcome="say \\"hi\\""} 2' in lines
@@ -0,0 +1,69 @@
+"""
+Tests for running and merging the sub-queries of a compound question (planner)
+"""
+
+import json
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from planner import is_compound, merge_plan, run_plan, tool_plan
+from query_engine import execute_inline
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'REGN': pd.Categorical([' محافظة مسقط', 'شمال الباطنة', ' محافظة مسقط', 'شمال الباطنة']),
+        'PUSE': ['سكني', 'سكني', 'مسكن اجتماعي', 'سكني'],
+        'PAR_AREA': [600.0, 1200.0, 1500.0, 800.0],
+    })
+
+
+def _merged(df, parts, **plan):
+    plan = dict(plan, parts=[{'label': label, 'query': query} for label, query in parts])
+    merged = merge_plan(plan, run_plan(plan, lambda query: execute_inline(query, df)))
+    return merged, execute_inline(merged['query_used'], df)
+
+
+def test_two_counts_give_their_difference(df):
+    merged, recomputed = _merged(df, [
+        ('سكني', "len(df[df['PUSE'] == 'سكني'])"),
+        ('مسكن اجتماعي', "len(df[df['PUSE'] == 'مسكن اجتماعي'])"),
+    ], summary='Residential vs social')
+    assert merged['answer'].splitlines() == [
+        'Residential vs social', '- سكني: 3', '- مسكن اجتماعي: 1', 'Difference / الفرق (سكني - مسكن اجتماعي): 2',
+    ]
+    assert merged['plot']['data']['x'] == ['سكني', 'مسكن اجتماعي']
+    assert recomputed.tolist() == [3, 1]
+
+
+def test_mixed_scalar_and_series_parts(df):
+    merged, recomputed = _merged(df, [
+        ('Total', 'len(df)'),
+        ('Residential by region', "df[df['PUSE'] == 'سكني']['REGN'].value_counts()"),
+    ])
+    assert '- Total: 4' in merged['answer']
+    assert merged['plot']['data']['y'] == [2, 1]
+    assert recomputed.loc['Total', 'Total'] == 4
+    assert recomputed.loc['شمال الباطنة', 'Residential by region'] == 2
+
+
+def test_failed_part_is_reported(df):
+    plan = {'parts': [{'label': 'ok', 'query': 'len(df)'}, {'label': 'bad', 'query': "df['NOPE'].sum()"}]}
+    merged = merge_plan(plan, run_plan(plan, lambda query: execute_inline(query, df)))
+    assert '- ok: 4' in merged['answer']
+    assert merged['parts'][1]['error'] is not None
+
+
+def test_tool_plan_needs_two_parts():
+    def message(parts):
+        arguments = json.dumps({'parts': parts})
+        call = SimpleNamespace(function=SimpleNamespace(name='run_subqueries', arguments=arguments))
+        return SimpleNamespace(tool_calls=[call])
+
+    assert tool_plan(message([{'label': 'a', 'query': 'len(df)'}, {'label': 'b', 'query': ''}])) is None
+    assert len(tool_plan(message([{'query': 'len(df)'}] * 12))['parts']) == 8
+    assert tool_plan(SimpleNamespace(tool_calls=None)) is None
+    assert is_compound('قارن بين مسقط وصحار') and not is_compound('كم عدد العقارات؟')
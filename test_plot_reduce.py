@@ -0,0 +1,55 @@
+"""
+Tests for the point-budget reduction of plot data (plot_reduce)
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from plot_reduce import MAX_SCATTER_POINTS, OTHER_LABEL, bin_values, lttb, plot_data_from_result, reduce_plot_data, top_n
+
+
+def test_lttb_keeps_the_ends_and_the_spikes():
+    x = np.arange(10000)
+    y = np.sin(x / 500)
+    y[4321] = 50
+    keep = lttb(x, y, 200)
+    assert len(keep) == 200
+    assert keep[0] == 0 and keep[-1] == 9999
+    assert (np.diff(keep) > 0).all()
+    assert 4321 in keep
+
+
+def test_lttb_leaves_short_series_alone():
+    assert lttb([1, 2, 3], [3, 1, 2], 10).tolist() == [0, 1, 2]
+
+
+def test_top_n_keeps_order_and_total():
+    x = [f"region {i}" for i in range(40)]
+    y = [(i * 37) % 101 for i in range(40)]
+    reduced = top_n(x, y, 10)
+    assert len(reduced['x']) == 10 and reduced['x'][-1] == OTHER_LABEL
+    assert reduced['x'][:-1] == [label for label in x if label in reduced['x']]
+    assert min(reduced['y'][:-1]) >= max(v for label, v in zip(x, y) if label not in reduced['x'])
+    assert sum(reduced['y']) == sum(y)
+
+
+def test_bins_count_every_value():
+    values = np.concatenate([np.random.default_rng(0).uniform(100, 2000, 5000), [80000]])
+    binned = bin_values(values, bins=20)
+    assert len(binned['x']) == 20
+    assert sum(binned['y']) == len(values)
+
+
+@pytest.mark.parametrize('size, webgl', [(100, False), (MAX_SCATTER_POINTS + 1, True)])
+def test_scatter_is_sampled_and_switched_to_webgl(size, webgl):
+    data = reduce_plot_data('scatter', {'x': list(range(size)), 'y': list(range(size))})
+    assert data['webgl'] is webgl
+    assert len(data['x']) == min(size, MAX_SCATTER_POINTS)
+    assert ('reduced_from' in data) is (size > MAX_SCATTER_POINTS)
+
+
+def test_histogram_of_a_numeric_result_is_binned():
+    data = plot_data_from_result('histogram', pd.DataFrame({'PAR_AREA': np.arange(1000.0)}))
+    assert data['binned'] and data['reduced_from'] == 1000
+    assert sum(data['y']) == 1000
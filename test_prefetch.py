@@ -0,0 +1,74 @@
+"""
+Tests for the background prefetch of example answers (prefetch.Prefetcher) against mock_openai
+"""
+
+import pandas as pd
+import pytest
+
+import llm_client
+from data_store import Dataset
+from llm_cache import ResponseCache
+from llm_client import ResilientCaller
+from llm_query import LLM_MODEL, cache_fingerprint, get_client
+from mock_openai import start_server
+from prefetch import Prefetcher
+from schema import apply_schema
+
+pytest.importorskip('openai')
+
+LOCAL = 'Show property distribution by region'
+REMOTE = ['Who owns the most land in Nizwa?', 'ما أكبر قطعة في صحار؟']
+
+
+@pytest.fixture
+def dataset():
+    return Dataset(apply_schema(pd.DataFrame({
+        'PAR_PIN': ['8-53-094-03-225', '8-53-094-03-226', '8-53-094-03-227'],
+        'REGN': [' محافظة مسقط', 'شمال الباطنة', ' محافظة مسقط'],
+        'WLYA': [' السيب', 'صحار', ' بوشر'],
+        'PUSE': ['سكني', 'سكني', 'مسكن اجتماعي'],
+        'PAR_AREA': [600.0, 1200.0, 1500.0],
+        'DOC_DATE': pd.to_datetime(['2024-01-05', '2024-02-10', '2023-07-01']),
+    })), 'v1', 'test')
+
+
+def _mock(monkeypatch, **faults):
+    server = start_server(latency_ms=0, seed=0, **faults)
+    monkeypatch.setenv('OPENAI_BASE_URL', server.base_url)
+    monkeypatch.setattr(llm_client, '_caller', ResilientCaller(max_attempts=1, deadline=5))
+    get_client.cache_clear()
+    return server
+
+
+@pytest.fixture(autouse=True)
+def fresh_client():
+    yield
+    get_client.cache_clear()
+
+
+def test_remote_answers_are_fetched_once(monkeypatch, dataset):
+    server = _mock(monkeypatch)
+    cache = ResponseCache(':memory:')
+
+    first = Prefetcher(dataset, 'test-key', cache, [LOCAL] + REMOTE).start()
+    assert first.wait(10)
+    assert first.outcomes == {LOCAL: 'local', REMOTE[0]: 'fetched', REMOTE[1]: 'fetched'}
+    assert server.requests == 2
+    assert cache.get(REMOTE[1], LLM_MODEL, cache_fingerprint(dataset))['answer'] == f"Mock answer for: {REMOTE[1]}"
+
+    second = Prefetcher(dataset, 'test-key', cache, [LOCAL] + REMOTE).run()
+    assert list(second.outcomes.values()) == ['local', 'cached', 'cached']
+    assert server.requests == 2
+    assert second.progress()['ready'] == 3 and not second.progress()['running']
+
+
+def test_failures_are_reported_per_question(monkeypatch, dataset):
+    _mock(monkeypatch, error_rate=1.0, error_status=503)
+    cache = ResponseCache(':memory:')
+
+    prefetcher = Prefetcher(dataset, 'test-key', cache, REMOTE).run()
+
+    assert prefetcher.outcomes == {question: 'error' for question in REMOTE}
+    assert set(prefetcher.errors) == set(REMOTE)
+    assert prefetcher.progress()['errors'] == 2
+    assert not cache.contains(REMOTE[0], LLM_MODEL, cache_fingerprint(dataset))
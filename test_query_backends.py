@@ -0,0 +1,95 @@
+"""
+Smoke tests of the DuckDB and Polars query backends (skipped when the engine is not installed)
+"""
+
+import importlib.util
+
+import pandas as pd
+import pytest
+
+import query_backends
+from query_backends import DuckDBBackend, PolarsBackend, ResultTooLarge
+from query_engine import QueryRejected
+
+
+@pytest.fixture
+def parquet(tmp_path):
+    path = tmp_path / 'parcels.parquet'
+    pd.DataFrame({
+        'REGN': ['محافظة مسقط', 'شمال الباطنة', 'محافظة مسقط'],
+        'PAR_AREA': [600.0, 1200.0, 1500.0],
+        'DOC_DATE': pd.to_datetime(['2024-01-05', '2024-02-10', '2023-07-01']),
+    }).to_parquet(path, index=False)
+    secret = tmp_path / 'secret.csv'
+    secret.write_text('a,b\n1,secret\n')
+    return str(path), str(secret)
+
+
+def test_duckdb_queries_the_view(parquet):
+    pytest.importorskip('duckdb')
+    backend = DuckDBBackend(files=[parquet[0]])
+    try:
+        assert backend.execute('SELECT COUNT(*) FROM parcels') == 3
+        counts = backend.execute('SELECT "REGN", COUNT(*) AS n FROM parcels GROUP BY "REGN" ORDER BY n DESC')
+        assert counts.tolist() == [2, 1]
+        assert backend.table_info()[0] == 3
+    finally:
+        backend.close()
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT * FROM '{secret}'",
+    "SELECT * FROM parcels JOIN '{secret}' ON true",
+    "SELECT * FROM parcels, '{secret}'",
+    "SELECT (SELECT COUNT(*) FROM '{secret}') FROM parcels",
+    "SELECT * FROM read_csv('{secret}')",
+    "SELECT * FROM duckdb_settings()",
+])
+def test_duckdb_rejects_other_files(parquet, sql):
+    pytest.importorskip('duckdb')
+    backend = DuckDBBackend(files=[parquet[0]])
+    try:
+        with pytest.raises(ValueError):
+            backend.execute(sql.format(secret=parquet[1]))
+    finally:
+        backend.close()
+
+
+def test_duckdb_connection_cannot_read_other_files(parquet):
+    duckdb = pytest.importorskip('duckdb')
+    backend = DuckDBBackend(files=[parquet[0]])
+    try:
+        # Even past validate(), the connection only reads the dataset's files
+        with pytest.raises(duckdb.PermissionException):
+            backend._conn.cursor().execute(f"SELECT * FROM '{parquet[1]}'").fetchall()
+        with pytest.raises(duckdb.Error):
+            backend._conn.cursor().execute("SET enable_external_access = true")
+    finally:
+        backend.close()
+
+
+def test_polars_expressions(parquet):
+    pytest.importorskip('polars')
+    backend = PolarsBackend(files=[parquet[0]])
+    counts = backend.execute("lf.group_by('REGN').agg(pl.len().alias('n')).sort('n', descending=True)")
+    assert counts.tolist() == [2, 1]
+    assert backend.execute("lf.filter(pl.col('PAR_AREA') > 1000).select(pl.len())") == 2
+    with pytest.raises(QueryRejected):
+        backend.execute(f"pl.read_csv('{parquet[1]}')")
+
+
+def test_results_past_the_row_limit_raise(parquet, monkeypatch):
+    monkeypatch.setattr(query_backends, 'MAX_RESULT_ROWS', 2)
+    if importlib.util.find_spec('duckdb'):
+        backend = DuckDBBackend(files=[parquet[0]])
+        try:
+            assert len(backend.execute('SELECT * FROM parcels LIMIT 2')) == 2
+            with pytest.raises(ResultTooLarge):
+                backend.execute('SELECT * FROM parcels')
+        finally:
+            backend.close()
+    if importlib.util.find_spec('polars'):
+        backend = PolarsBackend(files=[parquet[0]])
+        assert len(backend.execute('lf.head(2)')) == 2
+        with pytest.raises(ResultTooLarge):
+            backend.execute('lf')
@@ -0,0 +1,136 @@
+"""
+Regression tests for the query_used sandbox (query_engine.validate / execute_inline) and the result cache
+"""
+
+import os
+import pickle
+
+import pandas as pd
+import pytest
+
+from query_engine import QueryRejected, QueryTimeout, ResultCache, execute_forked, execute_inline
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'REGN': pd.Categorical([' محافظة مسقط', 'شمال الباطنة', ' محافظة مسقط']),
+        'PUSE': ['سكني', 'تجاري', 'سكني'],
+        'PAR_AREA': [600.0, 1200.0, 1500.0],
+        'DOC_DATE': pd.to_datetime(['2024-01-05', '2024-02-10', '2023-07-01']),
+    })
+
+
+@pytest.mark.parametrize('expression', [
+    # Writes any file, including importable Python
+    "pd.Series(['import os']).to_string('{path}', index=False)",
+    "df.to_string(buf='{path}')",
+    "df.to_markdown('{path}')",
+    "df.info(buf='{path}')",
+    # Reaches a blocked method through pandas' string dispatch
+    "df.apply('to_pickle', args=('{path}',))",
+    "df.agg('to_pickle', '{path}')",
+    "df.transform('to_pickle', '{path}')",
+    "df.groupby('REGN').apply('to_pickle', '{path}')",
+    "df.pipe(pd.to_pickle, '{path}')",
+    # Methods called inside a df.query string
+    "df.query(\"PAR_AREA.to_pickle('{path}') == 1\", engine='python')",
+    # Keywords and arguments hidden behind ** and *
+    "df.query(**{{'expr': '@df.to_csv(\"{path}\") == 1 or PAR_AREA > 0', 'engine': 'python'}})",
+    "df.to_string(**{{'buf': '{path}'}})",
+    "df.query(*['@df.to_csv(\"{path}\") == 1'], engine='python')",
+    "df.apply(*['to_pickle'], ('{path}',))",
+    # A method name computed at run time
+    "df.agg('to_' + 'pickle', '{path}')",
+    "df.agg('sum' if len(df) < 0 else 'to_pickle', '{path}')",
+])
+def test_file_writes_rejected(df, tmp_path, expression):
+    path = str(tmp_path / 'evil_mod.py')
+    with pytest.raises(QueryRejected):
+        execute_inline(expression.format(path=path), df)
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize('expression', [
+    "'{0.__class__.__init__.__globals__}'.format(df)",
+    "'{x}'.format_map({'x': df})",
+    "str.format('{0.__class__}', df)",
+    "df.query('@df')",
+    "df.query(**{'expr': '@pd.io.common.os.getcwd()', 'engine': 'python'})",
+])
+def test_string_formatting_rejected(df, expression):
+    with pytest.raises(QueryRejected):
+        execute_inline(expression, df)
+
+
+@pytest.mark.parametrize('expression', [
+    "len(df)",
+    "df['REGN'].value_counts()",
+    "df.groupby('REGN', observed=True)['PAR_AREA'].agg(['sum', 'mean'])",
+    "df.groupby('REGN', observed=True).agg(total=('PAR_AREA', 'sum'))",
+    "df.groupby('REGN', observed=True)['PAR_AREA'].transform('max')",
+    "df[df['PAR_AREA'] > 1000]",
+    "df.query('PAR_AREA > 1000 and PUSE == \"سكني\"')",
+    "df['PUSE'].map({'سكني': 'Residential', 'تجاري': 'Commercial'})",
+    "df[df['REGN'].str.contains('مسقط')].shape[0]",
+    "df.groupby(df['DOC_DATE'].dt.year).size()",
+    "pd.Series({'a': len(df), 'b': df['PAR_AREA'].sum()})",
+])
+def test_common_expressions_allowed(df, expression):
+    execute_inline(expression, df)
+
+
+needs_fork = pytest.mark.skipif(not hasattr(os, 'fork'), reason="fork engine is POSIX only")
+
+
+@needs_fork
+def test_forked_query_returns_result_and_errors(df):
+    result = execute_forked("df[df['PAR_AREA'] > 1000]", df)
+    pd.testing.assert_frame_equal(result, df[df['PAR_AREA'] > 1000])
+    with pytest.raises(KeyError):
+        execute_forked("df['missing']", df)
+    with pytest.raises(QueryRejected):
+        execute_forked("df.to_pickle('x')", df)
+
+
+@needs_fork
+@pytest.mark.parametrize('limits', [
+    {'memory_limit_mb': 64},
+    {'cpu_seconds': 1, 'memory_limit_mb': 1 << 20},
+    {'timeout': 0.5, 'memory_limit_mb': 1 << 20},
+])
+def test_forked_query_limits(limits):
+    # 4e8 rows: too big for the memory cap and too slow for the CPU and wall limits
+    big = pd.DataFrame({'a': range(20000)})
+    with pytest.raises((MemoryError, QueryTimeout)):
+        execute_forked("len(df.merge(df, how='cross'))", big, **limits)
+
+
+def test_result_cache_keys_on_the_expression_not_its_formatting(df):
+    cache = ResultCache(max_bytes=1024 * 1024)
+    counts = df['REGN'].value_counts()
+    cache.put("df['REGN'].value_counts()", 'v1', counts)
+
+    hit, result = cache.get('df[ "REGN" ].value_counts( )', 'v1')
+    assert hit and result.equals(counts) and result is not counts
+    assert cache.get("df['REGN'].value_counts()", 'v2') == (False, None)
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    # A cached result cannot be modified through a hit
+    result.iloc[0] = -1
+    assert cache.get("df['REGN'].value_counts()", 'v1')[1].equals(counts)
+
+
+def test_result_cache_evicts_by_bytes():
+    big = pd.Series(range(1000))
+    cache = ResultCache(max_bytes=len(pickle.dumps(big)) * 5)
+    for i in range(8):
+        cache.put(f"df.head({i})", 'v1', big)
+        cache.get("df.head(0)", 'v1')
+    stats = cache.stats()
+    assert stats['bytes'] <= cache.max_bytes and stats['entries'] < 8
+    # Recently used entries are kept, the oldest untouched ones go first
+    assert cache.get("df.head(0)", 'v1')[0] and not cache.get("df.head(1)", 'v1')[0]
+
+    cache.put("df", 'v1', pd.Series(range(100000)))
+    assert not cache.get("df", 'v1')[0]
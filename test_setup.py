@@ -53,15 +53,15 @@ def test_data_loading():
         import pandas as pd
         import os
         
-        # Check for default data file
-        default_path = '/mnt/user-data/uploads/بيانات.xlsx'
+        # Check for the data file the app loads (data.xlsx next to app.py)
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.xlsx')
         if os.path.exists(default_path):
             df = pd.read_excel(default_path)
             print(f"✓ Successfully loaded data: {len(df)} rows, {len(df.columns)} columns")
             print(f"  Columns: {', '.join(df.columns.tolist()[:5])}...")
             return True
         else:
-            print("⚠ Default data file not found. You'll need to upload an Excel file in the app.")
+            print("⚠ data.xlsx not found. Place it in the project root before running the app.")
             return True  # Not a critical error
     except Exception as e:
         print(f"✗ Error loading data: {e}")
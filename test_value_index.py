@@ -0,0 +1,59 @@
+"""
+Tests for literal repair and parcel/meter lookups of the value index (value_index.ValueIndex)
+"""
+
+import pandas as pd
+import pytest
+
+from value_index import ValueIndex
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'PAR_PIN': ['8-53-094-03-225', '8-53-094-03-226', '8-53-094-03-227', '8-53-094-03-227'],
+        'REGN': pd.Categorical([' محافظة مسقط', 'الظـا هـرة', ' محافظة مسقط', 'الظاهرة']),
+        'WLYA': pd.Categorical([' السيب', 'عبري', ' بوشر', 'عبري']),
+        'PAR_AREA': [600.0, 1200.0, 1500.0, 800.0],
+        'رقم العداد': ['S188371', 'No account Exist', '1609418', '1609419'],
+    })
+
+
+@pytest.fixture
+def index(df):
+    return ValueIndex(df)
+
+
+def test_literals_are_rewritten_to_the_stored_spelling(index):
+    expression, resolved = index.rewrite("len(df[df['REGN'] == 'محافظة مسقط'])")
+    assert expression == "len(df[df['REGN'] == ' محافظة مسقط'])"
+    assert resolved == {'محافظة مسقط': [' محافظة مسقط']}
+
+
+def test_several_spellings_become_isin(index, df):
+    expression, _ = index.rewrite("df[df['REGN'] != 'الظاهرة']")
+    assert len(eval(expression, {'df': df})) == 2
+    expression, _ = index.rewrite("df[df['WLYA'].isin(['السيب', 'بوشر'])]")
+    assert len(eval(expression, {'df': df})) == 2
+
+
+def test_near_miss_and_unknown_literals(index):
+    assert index.rewrite("df[df['WLYA'] == 'السييب']")[0] == "df[df['WLYA'] == ' السيب']"
+    # Nothing close: the query is left alone rather than guessed
+    assert index.rewrite("df[df['WLYA'] == 'صلالة']") == ("df[df['WLYA'] == 'صلالة']", {})
+    assert index.rewrite("df[df['PAR_AREA'] == 600]") == ("df[df['PAR_AREA'] == 600]", {})
+
+
+def test_record_lookups_use_the_hash_index(index, df):
+    assert index.evaluate("df[df['PAR_PIN'] == '8-53-094-03-227']", df)['PAR_AREA'].tolist() == [1500.0, 800.0]
+    assert index.evaluate("df[df['رقم العداد'] == 'No account Exist']", df) is None
+    assert index.lookup('رقم العداد', 's188371').tolist() == [0]
+
+
+def test_find_records_only_for_plain_lookups(index):
+    column, number, positions = index.find_records('تفاصيل القطعة 8-53-094-03-226')
+    assert (column, number, positions.tolist()) == ('PAR_PIN', '8-53-094-03-226', [1])
+    assert index.find_records('meter 1609418')[0] == 'رقم العداد'
+    # A bare number is not taken as a meter, and filters go elsewhere
+    assert index.find_records('1609418') is None
+    assert index.find_records('parcels in Muscat larger than 8-53-094-03-226') is None
@@ -0,0 +1,366 @@
+"""
+Value index over the Arabic category columns and the parcel/meter numbers
+
+The stored category values are not clean: 'محافظة مسقط' is stored as
+' محافظة مسقط', 'الظاهرة' as 'الظـا هـرة', and some villages appear under two
+spellings. A query_used filter that compares a column with the LLM's
+spelling therefore silently matches nothing. The index is built once per data
+version and
+  - maps every value's normalized key (arabic_text folding, no spaces) to all
+    stored values with that key, with a character trigram index for fuzzy
+    matches, so query_used literals are rewritten to the stored values
+    before execution
+  - hashes PAR_PIN and the meter numbers for O(1) record lookups
+A delta version gets an updated() copy: new values from the touched rows are
+added and the record lookups are patched, instead of indexing every row again.
+"""
+
+import ast
+import copy
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+from arabic_text import normalize_arabic, normalize_query
+from housing import METER_COLUMN, NO_METER_VALUES
+from intent_router import STOPWORDS, tokenize
+from schema import ARABIC_COLUMNS
+
+PIN_COLUMN = 'PAR_PIN'
+KEY_COLUMNS = [PIN_COLUMN, METER_COLUMN]
+
+# Minimum trigram Dice similarity for a fuzzy value match
+FUZZY_CUTOFF = 0.7
+
+# Records shown for a parcel / meter lookup
+MAX_LOOKUP_ROWS = 5
+
+# Share of the rows patched by deltas above which a record lookup is rebuilt
+REBUILD_SHARE = 0.1
+
+_RECORD_COLUMNS = ['REGN', 'WLYA', 'VILG', 'PUSE', 'PAR_AREA', 'DOC_DATE', METER_COLUMN,
+                   'تاريخ التوصيل', 'نوع التوصيل', 'HOUSING_STATUS']
+
+_LOOKUP_PATTERN = re.compile(
+    r"""^df\[\s*df\[\s*(['"])(?P<col>[^'"]+)\1\s*\]\s*==\s*(['"])(?P<value>[^'"]+)\3\s*\]$"""
+)
+_TOKEN = re.compile(r'[\w\-/]+')
+
+# Words a parcel / meter lookup question may contain besides the number
+LOOKUP_WORDS = set(tokenize(
+    'رقم القطعة قطعة أرض بيانات تفاصيل معلومات ابحث اعرض الحساب حساب عداد العداد '
+    'parcel pin plot land number no details info information find search lookup look up about '
+    'for with which has account meter'
+))
+METER_WORDS = set(tokenize('عداد العداد الحساب حساب meter account'))
+
+
+def value_key(text):
+    """Normalized, space-free key of a category value"""
+    return normalize_query(text).replace(' ', '')
+
+
+def record_key(text):
+    """Normalized key of a parcel or meter number"""
+    return normalize_arabic(text).replace(' ', '').upper()
+
+
+def trigrams(key):
+    padded = f"#{key}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _RecordLookup:
+    """Key -> row positions for one column (hashed when the keys are unique)
+
+    positions are the row positions of values when it is a subset of the column.
+    """
+
+    def __init__(self, values, positions=None):
+        keys = values.astype('string').str.strip().str.upper()
+        keep = keys.notna() & ~keys.str.lower().isin(NO_METER_VALUES)
+        self.positions = np.flatnonzero(keep.to_numpy())
+        if positions is not None:
+            self.positions = np.asarray(positions)[self.positions]
+        index = pd.Index(keys[keep].to_numpy(dtype=object))
+        self.unique = index.is_unique
+        if self.unique:
+            self.index = index
+        else:
+            # Sorted keys: a lookup is a binary search returning a slice
+            order = np.argsort(index.to_numpy(), kind='stable')
+            self.index = index[order]
+            self.positions = self.positions[order]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key):
+        """Row positions of key (empty if unknown)"""
+        if key not in self.index:
+            return np.array([], dtype=np.int64)
+        loc = self.index.get_loc(key)
+        # An int for a unique key, a slice (or mask) for a repeated one
+        return self.positions[[loc]] if isinstance(loc, (int, np.integer)) else self.positions[loc]
+
+
+class _PatchedLookup:
+    """A _RecordLookup of an older version plus one over the rows deltas changed or added"""
+
+    def __init__(self, base, values, patched):
+        self.base = base
+        self.patched = patched
+        self.patch = _RecordLookup(values.iloc[patched], positions=patched)
+
+    def __contains__(self, key):
+        return len(self.get(key)) > 0
+
+    def get(self, key):
+        """Row positions of key (empty if unknown)"""
+        positions = self.base.get(key)
+        if len(positions):
+            positions = positions[~np.isin(positions, self.patched)]
+        return np.sort(np.concatenate([positions, self.patch.get(key)]))
+
+
+def _uniques(series):
+    return series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else series.dropna().unique()
+
+
+def _add_values(keys, grams, values):
+    """Add values to a column's {key: [stored values]} and {trigram: {key}} maps in place"""
+    for value in values:
+        key = value_key(value)
+        if not key or value in keys.get(key, ()):
+            continue
+        # New lists and sets, as updated() copies share the older version's
+        keys[key] = [*keys.get(key, ()), value]
+        for gram in trigrams(key):
+            grams[gram] = grams.get(gram, set()) | {key}
+
+
+class ValueIndex:
+    """Normalized and fuzzy value lookup for one dataset version"""
+
+    def __init__(self, df):
+        # column -> {key: [stored values]}
+        self.values = {}
+        # column -> {trigram: {key, ...}}
+        self.grams = {}
+        for col in ARABIC_COLUMNS:
+            if col not in df.columns:
+                continue
+            keys = defaultdict(list)
+            for value in _uniques(df[col]):
+                key = value_key(value)
+                if key:
+                    keys[key].append(value)
+            grams = defaultdict(set)
+            for key in keys:
+                for gram in trigrams(key):
+                    grams[gram].add(key)
+            self.values[col] = dict(keys)
+            self.grams[col] = dict(grams)
+        self.records = {col: _RecordLookup(df[col]) for col in KEY_COLUMNS if col in df.columns}
+
+    def updated(self, df, touched):
+        """Index of df, this version's frame with the rows at touched changed or appended
+
+        Values of the touched rows are added (a value no longer stored stays
+        and matches no rows, like an unused category) and the record lookups
+        are patched, so the cost follows the delta rather than the frame.
+        """
+        index = copy.copy(self)
+        index.values, index.grams = dict(self.values), dict(self.grams)
+        rows = df.iloc[touched]
+        for col in ARABIC_COLUMNS:
+            if col not in df.columns:
+                continue
+            keys, grams = dict(self.values.get(col, {})), dict(self.grams.get(col, {}))
+            _add_values(keys, grams, rows[col].dropna().unique())
+            index.values[col], index.grams[col] = keys, grams
+
+        index.records = {}
+        for col in KEY_COLUMNS:
+            if col not in df.columns:
+                continue
+            previous = self.records.get(col)
+            if isinstance(previous, _PatchedLookup):
+                base, patched = previous.base, np.union1d(previous.patched, touched)
+            else:
+                base, patched = previous, np.unique(touched)
+            if base is None or len(patched) > REBUILD_SHARE * len(df):
+                index.records[col] = _RecordLookup(df[col])
+            else:
+                index.records[col] = _PatchedLookup(base, df[col], patched)
+        return index
+
+    def search(self, col, text, limit=5):
+        """Return [(stored values, score)] of the closest values in col, best first"""
+        key = value_key(text)
+        lookup = self.values.get(col)
+        if not key or not lookup:
+            return []
+        if key in lookup:
+            return [(lookup[key], 1.0)]
+        query = trigrams(key)
+        overlap = Counter()
+        for gram in query:
+            overlap.update(self.grams[col].get(gram, ()))
+        scored = [
+            (2 * shared / (len(query) + len(trigrams(candidate))), candidate)
+            for candidate, shared in overlap.items()
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(lookup[candidate], round(score, 3)) for score, candidate in scored[:limit]]
+
+    def resolve(self, col, value):
+        """Stored values of col that value means, or None if nothing is close"""
+        lookup = self.values.get(col)
+        if lookup is None or not isinstance(value, str):
+            return None
+        matches = self.search(col, value, limit=2)
+        if not matches or matches[0][1] < FUZZY_CUTOFF:
+            return None
+        # Two equally close values are ambiguous
+        if len(matches) > 1 and matches[1][1] == matches[0][1]:
+            return None
+        return matches[0][0]
+
+    def rewrite(self, expression):
+        """Rewrite literals compared with category columns to the stored values
+
+        Returns (expression, {literal: stored values}); the expression is
+        unchanged when every literal already matches.
+        """
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError:
+            return expression, {}
+        fixer = _LiteralFixer(self)
+        tree = fixer.visit(tree)
+        if not fixer.resolved:
+            return expression, {}
+        return ast.unparse(ast.fix_missing_locations(tree)), fixer.resolved
+
+    def lookup(self, col, value):
+        """Row positions whose PAR_PIN / meter number is value"""
+        records = self.records.get(col)
+        return records.get(record_key(value)) if records is not None else np.array([], dtype=np.int64)
+
+    def evaluate(self, expression, df):
+        """Answer df[df[PAR_PIN or meter] == value] from the hash index, else None"""
+        match = _LOOKUP_PATTERN.match((expression or '').strip())
+        if not match or match.group('col') not in self.records:
+            return None
+        key = record_key(match.group('value'))
+        if key not in self.records[match.group('col')]:
+            # e.g. 'No account Exist', which is not indexed
+            return None
+        return df.iloc[self.records[match.group('col')].get(key)]
+
+    def find_records(self, query):
+        """Return (column, number, positions) when the question only asks for a parcel or meter
+
+        Like the intent router, this declines (None) when the question has
+        words beyond the number and lookup words, e.g. a filter or aggregation.
+        """
+        text = normalize_arabic(query)
+        for token in _TOKEN.findall(text):
+            if not any(char.isdigit() for char in token):
+                continue
+            key = record_key(token)
+            rest = set(tokenize(text.replace(token, ' ')))
+            if not rest <= LOOKUP_WORDS | STOPWORDS:
+                continue
+            if PIN_COLUMN in self.records and key in self.records[PIN_COLUMN]:
+                return PIN_COLUMN, token, self.records[PIN_COLUMN].get(key)
+            # Bare numbers are only meter numbers when the question says so
+            if METER_COLUMN in self.records and rest & METER_WORDS and key in self.records[METER_COLUMN]:
+                return METER_COLUMN, token, self.records[METER_COLUMN].get(key)
+        return None
+
+
+def _column(node):
+    # df['COL'] / frame['COL'] or df.COL
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant):
+        return node.slice.value if isinstance(node.slice.value, str) else None
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'df':
+        return node.attr
+    return None
+
+
+class _LiteralFixer(ast.NodeTransformer):
+
+    def __init__(self, index):
+        self.index = index
+        self.resolved = {}
+
+    def _resolve(self, col, value):
+        stored = self.index.resolve(col, value)
+        if stored is None or stored == [value]:
+            return None
+        self.resolved[value] = stored
+        return stored
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        col = _column(node.left)
+        if (col not in self.index.values or len(node.ops) != 1
+                or not isinstance(node.ops[0], (ast.Eq, ast.NotEq))
+                or not isinstance(node.comparators[0], ast.Constant)):
+            return node
+        stored = self._resolve(col, node.comparators[0].value)
+        if stored is None:
+            return node
+        if len(stored) == 1:
+            node.comparators[0] = ast.Constant(stored[0])
+            return node
+        # Several stored spellings: == becomes isin, != becomes ~isin
+        isin = ast.Call(
+            func=ast.Attribute(value=node.left, attr='isin', ctx=ast.Load()),
+            args=[ast.List(elts=[ast.Constant(value) for value in stored], ctx=ast.Load())],
+            keywords=[],
+        )
+        return isin if isinstance(node.ops[0], ast.Eq) else ast.UnaryOp(op=ast.Invert(), operand=isin)
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if (not isinstance(func, ast.Attribute) or func.attr != 'isin' or len(node.args) != 1
+                or not isinstance(node.args[0], (ast.List, ast.Tuple, ast.Set))):
+            return node
+        col = _column(func.value)
+        if col not in self.index.values:
+            return node
+        values, changed = [], False
+        for element in node.args[0].elts:
+            stored = self._resolve(col, element.value) if isinstance(element, ast.Constant) else None
+            if stored is None:
+                values.append(element)
+            else:
+                values.extend(ast.Constant(value) for value in stored)
+                changed = True
+        if changed:
+            node.args[0] = ast.List(elts=values, ctx=ast.Load())
+        return node
+
+
+def record_answer(df, col, number, positions):
+    """Result dict describing the records found for a parcel or meter number"""
+    label = 'Parcel / القطعة' if col == PIN_COLUMN else 'Meter / العداد'
+    rows = df.iloc[positions[:MAX_LOOKUP_ROWS]]
+    lines = [f"{label} {number}: {len(positions):,} record(s) / سجل"]
+    for _, row in rows.iterrows():
+        fields = [
+            f"{name}: {row[name].date() if hasattr(row[name], 'date') else str(row[name]).strip()}"
+            for name in _RECORD_COLUMNS if name in row.index and pd.notna(row[name])
+        ]
+        lines.append(f"- {row[PIN_COLUMN]} | " + ' | '.join(fields))
+    return {
+        "answer": '\n'.join(lines),
+        "plot": {"type": "none"},
+        "query_used": f"df[df['{col}'] == '{number}']",
+    }
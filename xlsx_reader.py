@@ -0,0 +1,228 @@
+"""
+Streaming, low-memory xlsx reader
+
+Rows are streamed from openpyxl in read-only mode and converted chunk by
+chunk into the compact schema (categoricals, parsed dates, numbers), so the
+workbook never exists as a full frame of Python objects the way it does with
+pd.read_excel. Several sheets or workbooks are parsed in parallel in a
+process pool and their chunks are concatenated with unified categories. Each
+read reports its wall-clock time and peak RSS.
+
+Usage:
+    python xlsx_reader.py data.xlsx more.xlsx --sheets all --workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, the peak RSS is not reported
+    resource = None
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from schema import CATEGORICAL_COLUMNS, DATE_COLUMNS, FLOAT_COLUMNS, INTEGER_COLUMNS, apply_schema, column_memory
+
+# Rows converted at a time
+CHUNK_ROWS = int(os.getenv("XLSX_CHUNK_ROWS", "10000"))
+
+# Processes for multi-sheet / multi-file reads
+LOAD_WORKERS = int(os.getenv("DATA_LOAD_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def peak_rss_mb(children=False):
+    """Peak resident set size of this process (or its largest child) in MB
+
+    None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(who).ru_maxrss / scale, 1)
+
+
+def sheet_names(path):
+    """Return the sheet names of a workbook"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def _header(row):
+    # Same names pd.read_excel gives blank header cells
+    return [str(name).strip() if name is not None else f"Unnamed: {i}" for i, name in enumerate(row)]
+
+
+def compact_chunk(rows, columns):
+    """Build one chunk of rows (tuples) as a frame in the compact schema
+
+    Text columns outside the schema stay object; they are typed once all
+    chunks are joined (see finish_frame).
+    """
+    frame = pd.DataFrame.from_records(rows, columns=columns, coerce_float=False)
+    raw = column_memory(frame)
+    for col in frame.columns:
+        values = frame[col]
+        if col in DATE_COLUMNS:
+            frame[col] = pd.to_datetime(values, errors='coerce')
+        elif col in INTEGER_COLUMNS or col in FLOAT_COLUMNS:
+            frame[col] = pd.to_numeric(values, errors='coerce')
+        elif col in CATEGORICAL_COLUMNS:
+            values = values.astype(object)
+            frame[col] = values.where(values.isna(), values.astype(str)).astype('category')
+    return frame, raw
+
+
+def read_sheet(path, sheet=None, chunk_rows=CHUNK_ROWS):
+    """Stream one sheet (the first by default) into a compact frame
+
+    Returns (frame, raw column bytes, stats).
+    """
+    import openpyxl
+
+    start = time.perf_counter()
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        worksheet = workbook[sheet] if sheet is not None else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        columns = _header(next(rows, ()))
+        chunks, raw, batch = [], None, []
+        for row in rows:
+            # Blank rows (e.g. formatted but empty rows at the end) are skipped like read_excel does
+            if any(value is not None for value in row):
+                batch.append(row[:len(columns)])
+            if len(batch) >= chunk_rows:
+                chunk, chunk_raw = compact_chunk(batch, columns)
+                chunks.append(chunk)
+                raw = chunk_raw if raw is None else raw + chunk_raw
+                batch = []
+        if batch or not chunks:
+            chunk, chunk_raw = compact_chunk(batch, columns)
+            chunks.append(chunk)
+            raw = chunk_raw if raw is None else raw + chunk_raw
+    finally:
+        workbook.close()
+
+    frame = concat_chunks(chunks)
+    stats = {
+        'file': os.path.basename(path),
+        'sheet': worksheet.title,
+        'rows': len(frame),
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    return frame, raw, stats
+
+
+def concat_chunks(frames):
+    """Concatenate compact frames, unifying the categories of categorical columns"""
+    if len(frames) == 1:
+        return frames[0]
+    columns = list(dict.fromkeys(col for frame in frames for col in frame.columns))
+    for col in columns:
+        parts = [frame[col] for frame in frames if col in frame.columns]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            categories = union_categoricals(parts, sort_categories=True).categories
+            for frame in frames:
+                if col in frame.columns:
+                    frame[col] = frame[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def finish_frame(frame):
+    """Type the remaining object columns and apply the schema to the joined frame"""
+    for col in frame.columns:
+        values = frame[col]
+        if values.dtype != object:
+            continue
+        # Columns of only numbers or dates get that dtype as with read_excel; mixed ones are text
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        if kind in ('integer', 'floating', 'mixed-integer-float', 'empty'):
+            frame[col] = pd.to_numeric(values)
+        elif kind in ('datetime', 'datetime64'):
+            frame[col] = pd.to_datetime(values)
+        else:
+            frame[col] = values.astype(str).where(values.notna())
+    return apply_schema(frame)
+
+
+def _read_task(task):
+    path, sheet, chunk_rows = task
+    return read_sheet(path, sheet, chunk_rows)
+
+
+def read_workbooks(paths, sheets=None, workers=LOAD_WORKERS, chunk_rows=CHUNK_ROWS):
+    """Read sheets of one or more workbooks into one compact frame
+
+    sheets is None (the first sheet of each workbook), 'all', or a list of
+    names. Sheets are parsed in parallel when there is more than one. Returns
+    (frame, raw column bytes, report) where report has the wall-clock time,
+    peak RSS and per-sheet stats.
+    """
+    start = time.perf_counter()
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    tasks = []
+    for path in paths:
+        if sheets is None:
+            tasks.append((path, None, chunk_rows))
+        else:
+            names = sheet_names(path) if sheets == 'all' else sheets
+            tasks.extend((path, name, chunk_rows) for name in names)
+
+    if len(tasks) == 1 or workers <= 1:
+        results = [_read_task(task) for task in tasks]
+    else:
+        # spawn, not fork: the loader may run inside a threaded Streamlit server
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(min(workers, len(tasks)), mp_context=context) as pool:
+            results = list(pool.map(_read_task, tasks))
+
+    frame = finish_frame(concat_chunks([result[0] for result in results]))
+    raw = results[0][1]
+    for result in results[1:]:
+        raw = raw.add(result[1], fill_value=0)
+    report = {
+        'rows': len(frame),
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'sheets': [result[2] for result in results],
+    }
+    return frame, raw, report
+
+
+def _megabytes(value):
+    return f"{value:.0f} MB" if value is not None else "n/a"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read workbooks with the streaming reader and report time and memory")
+    parser.add_argument('paths', nargs='+', help="xlsx files")
+    parser.add_argument('--sheets', help="'all' or comma-separated sheet names (default: first sheet)")
+    parser.add_argument('-w', '--workers', type=int, default=LOAD_WORKERS)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    sheets = args.sheets if args.sheets in (None, 'all') else args.sheets.split(',')
+    frame, raw, report = read_workbooks(args.paths, sheets, args.workers, args.chunk_rows)
+    for sheet in report['sheets']:
+        print(f"{sheet['file']}[{sheet['sheet']}]: {sheet['rows']:,} rows in {sheet['seconds']:.2f}s, "
+              f"peak {_megabytes(sheet['peak_rss_mb'])}")
+    print(f"{report['rows']:,} rows in {report['seconds']:.2f}s, peak RSS {_megabytes(report['peak_rss_mb'])}, "
+          f"{column_memory(frame).sum() / 1e6:.1f} MB in memory ({raw.sum() / 1e6:.1f} MB as read)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())